@@ -1,24 +1,42 @@
 import concurrent.futures
 import email.utils
+import hashlib
 import logging
 import mimetypes
+import multiprocessing
 import os
 import os.path
 import re
 import socket
 import ssl
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from functools import partial
+from email.message import Message
+from functools import lru_cache, partial
 from http.client import InvalidURL
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from xml.etree.ElementTree import ParseError  # nosec B405
 
-import certifi
-import feedparser
-from feedparser import FeedParserDict
-from genutility.concurrency import ProgressThreadPool
 from genutility.datetime import naive_to_aware, now
 from genutility.filesystem import safe_filename
 from genutility.func import retry
@@ -27,6 +45,31 @@ from genutility.iter import first_not_none
 from genutility.json import BuiltinRoundtripDecoder, BuiltinRoundtripEncoder, read_json, write_json
 from genutility.string import toint
 
+from . import downloader
+from .episode import Episode, compact_episodes
+from .events import DownloadEvents, Subscription
+from .feedstream import DEFAULT_STOP_AFTER, FeedStreamParser, UnsupportedFeed
+from .index import EpisodeIndex
+from .journal import ACTIVE_STATES, STATE_DONE, STATE_FAILED, STATE_QUEUED, DownloadJournal
+from .locks import KeyLocks, RWLock
+from .refresh import DEFAULT_REFRESH_CONCURRENCY, DEFAULT_REFRESH_CONCURRENCY_PER_HOST, AsyncFeedFetcher, RefreshWorker
+from .schedule import (
+    failure_interval,
+    next_due,
+    parse_skip_hours,
+    publisher_interval,
+    publishing_interval,
+    refresh_interval,
+)
+from .storage import ChangesT, DescriptionsT, JsonStorage, LazyDatabase, SqliteStorage, split_descriptions
+
+# asyncio, certifi and feedparser are slow to import and imported when they are used,
+# so commands which don't refresh feeds start faster
+if TYPE_CHECKING:
+    import asyncio
+
+    from feedparser import FeedParserDict
+
 logger = logging.getLogger(__name__)
 
 """
@@ -40,11 +83,29 @@ None (HTTP Error 404: Media File not found)
 
 DEFAULT_NETWORK_TIMEOUT = 60
 DEFAULT_CONCURRENT_DOWNLOADS = 2
+DEFAULT_SEGMENT_THRESHOLD = 100 * 1024 * 1024
+DEFAULT_DOWNLOAD_RETRIES = 2  # attempts after the first one in the same run
+DEFAULT_DOWNLOAD_MAX_FAILURES = 10  # bulk downloads give up on episodes which failed in this many runs
+
+PRIORITY_BULK = 0
+PRIORITY_INTERACTIVE = 10
 DEFAULT_USER_AGENT = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36"
 )
 
-ssl_context = ssl.create_default_context(cadata=certifi.contents())
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_SPOOL_SIZE = 1024 * 1024  # data read by the streaming parser is kept in memory up to this size
+
+RETRY_EXCEPTIONS = (ConnectionError, URLError, socket.timeout, ContentInvalidLength)
+
+FutureT = Union[concurrent.futures.Future, "asyncio.Future"]
+
+
+@lru_cache(maxsize=None)
+def get_ssl_context() -> ssl.SSLContext:
+    import certifi
+
+    return ssl.create_default_context(cadata=certifi.contents())
 
 
 """
@@ -70,9 +131,31 @@ def download(
     report: Optional[Callable[[int, int], None]] = None,
     timeout=5 * 60,
     headers=None,
+    resumed: Optional[Callable[[int], None]] = None,
+    segments: int = 1,
+    segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD,
 ) -> Tuple[Optional[int], str]:
-    return URLRequest(url, headers, timeout, ssl_context).download(
-        basepath, filename, fn_prio, overwrite, suffix, report
+    """Files larger than `segment_threshold` are downloaded in `segments` concurrent parts if `segments` > 1."""
+
+    if segments > 1:
+        return downloader.download_segmented(
+            url,
+            basepath,
+            filename,
+            fn_prio,
+            overwrite,
+            suffix,
+            report,
+            timeout,
+            headers,
+            get_ssl_context(),
+            resumed,
+            segments,
+            segment_threshold,
+        )
+
+    return downloader.download(
+        url, basepath, filename, fn_prio, overwrite, suffix, report, timeout, headers, get_ssl_context(), resumed
     )
 
 
@@ -87,14 +170,29 @@ def download_handle(
     expected_size=None,
     timeout=None,
     headers=None,
+    resumed: Optional[Dict[str, int]] = None,
+    segments: int = 1,
+    segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD,
 ) -> Tuple[Callable, Optional[Exception], Any]:
+    """`resumed` is a dict which maps the urls of running downloads to the number of bytes resumed from partial files."""
+
     localname: Optional[str] = None
     length: Optional[int] = None
     status: Optional[Exception] = None
 
     try:
         length, localname = download(
-            url, basepath, filename, fn_prio, overwrite, report=report, timeout=timeout, headers=headers
+            url,
+            basepath,
+            filename,
+            fn_prio,
+            overwrite,
+            report=report,
+            timeout=timeout,
+            headers=headers,
+            resumed=None if resumed is None else partial(resumed.__setitem__, url),
+            segments=segments,
+            segment_threshold=segment_threshold,
         )
 
         if expected_size and expected_size != length:
@@ -129,6 +227,9 @@ def download_handle(
     except Exception as e:
         status = e
         logging.exception("Downloading <%s> failed.", url)
+    finally:
+        if resumed is not None:
+            resumed.pop(url, None)
 
     return setter, status, (url, localname, length)  # put some info there to make sure failed downloads can be repeated
 
@@ -141,6 +242,14 @@ class InvalidFeed(Exception):
     pass
 
 
+class NotModified(Exception):
+    pass
+
+
+class CastRemoved(KeyError):
+    pass
+
+
 durationp = re.compile(r"(?:([0-9]{1,2}):)?([0-9]{1,2}):([0-9]{1,2})")
 
 
@@ -164,13 +273,231 @@ def parse_itunes_duration(itunes_duration: Optional[str]) -> Optional[timedelta]
         return timedelta(seconds=sec)
 
 
+def get_entry_fingerprint(entry: "FeedParserDict") -> str:
+    """Cheap hash over the raw entry fields which are used by `normalize_entry()`."""
+
+    # `dict.get` avoids feedparser's deprecated fallback from "updated" to "published",
+    # so the keys "guid" and "description" are used by their real names "id" and "summary"
+    parts = [
+        dict.get(entry, key) for key in ("id", "link", "title", "published", "updated", "itunes_duration", "summary")
+    ]
+    for enclosure in entry.get("enclosures", []):
+        parts.extend((enclosure.get("href"), enclosure.get("length"), enclosure.get("type")))
+
+    data = "\0".join("" if part is None else str(part) for part in parts)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def normalize_entry(entry: "FeedParserDict") -> Dict[str, Any]:
+    """Converts a feed entry to an episode dict as stored in `Catcher.db`."""
+
+    try:
+        entry_pub: Optional[datetime] = naive_to_aware(email.utils.parsedate_to_datetime(entry.published))
+    except AttributeError:
+        entry_pub = None
+
+    episode = {
+        "title": entry.get("title"),
+        "date": entry_pub,
+        "duration": parse_itunes_duration(entry.get("itunes_duration")),
+        "description": entry.get("description"),
+    }
+
+    encs = len(entry.get("enclosures"))
+    if encs == 0:
+        episode.update({"href": None, "length": None, "mimetype": None})
+    elif encs == 1:
+        enclosure = entry.enclosures[0]
+        episode.update(
+            {
+                "href": enclosure.get("href"),
+                "length": toint(enclosure.get("length")),
+                "mimetype": enclosure.get("type"),
+            }
+        )
+    else:
+        raise InvalidFeed("Feed contains multiple enclosures")
+
+    return episode
+
+
+def get_episode_uid(entry: "FeedParserDict") -> Optional[str]:
+    return first_not_none([entry.get("guid"), entry.get("link"), entry.get("title"), entry.get("description")])
+
+
+class EpisodeRecord(NamedTuple):
+    episode_uid: Optional[str]
+    fingerprint: str
+    episode: Dict[str, Any]  # from `normalize_entry()`
+
+
+class ParsedFeed(NamedTuple):
+    """Normalized feed. It's small and picklable, so it can be sent from a parse process to `Catcher.update_feed()`.
+    Fields which were not parsed are None if not `complete`.
+    """
+
+    date: Optional[datetime]
+    etag: Optional[str]
+    modified: Optional[str]
+    publisher_interval: Optional[timedelta]
+    skiphours: Optional[List[int]]
+    episodes: List[EpisodeRecord]  # only new and changed entries
+    unchanged: int
+    complete: bool
+
+
+FeedT = Union["FeedParserDict", ParsedFeed]
+
+
+def normalize_feed(feed: "FeedParserDict", known: Optional[Dict[str, str]] = None) -> ParsedFeed:
+    """Normalizes the entries of `feed` which are not in `known` (episode uid -> fingerprint) or changed."""
+
+    known = known or {}
+
+    try:
+        pub: Optional[datetime] = naive_to_aware(email.utils.parsedate_to_datetime(feed.feed.published))
+    except AttributeError:
+        pub = None
+
+    episodes = []
+    unchanged = feed.get("skipped", 0)
+    for entry in feed.entries:
+        episode_uid = get_episode_uid(entry)
+        fingerprint = get_entry_fingerprint(entry)
+        if episode_uid is not None and known.get(episode_uid) == fingerprint:
+            unchanged += 1
+        else:
+            episodes.append(EpisodeRecord(episode_uid, fingerprint, normalize_entry(entry)))
+
+    return ParsedFeed(
+        pub,
+        feed.get("etag"),
+        feed.get("modified"),
+        publisher_interval(feed),
+        feed.get("skiphours"),
+        episodes,
+        unchanged,
+        feed.get("complete", True),
+    )
+
+
+def parse_feed(url: str, data: bytes, headers: Message) -> Tuple[str, "FeedParserDict"]:
+    """Parses the feed document `data` which was retrieved from `url` with response `headers`."""
+
+    import feedparser
+
+    feed = feedparser.parse(
+        BytesIO(data),
+        response_headers={
+            "Content-Location": url,
+            "content-type": headers["content-type"],
+        },
+    )
+
+    # same keys feedparser uses when it fetches the feed itself
+    feed["etag"] = headers.get("ETag")
+    feed["modified"] = headers.get("Last-Modified")
+    feed["skiphours"] = parse_skip_hours(data)
+
+    if feed.bozo:
+        logging.error("Feed mal-formed <%s>: %s", url, feed.bozo_exception)
+
+    if len(feed.feed) == 0 and len(feed.entries) == 0:  # compare with standard
+        raise InvalidFeed("Feed does neither contain a description nor files")
+
+    title = feed.feed.get("title")
+
+    return (title, feed)
+
+
+def parse_feed_stream(
+    url: str,
+    fp: BinaryIO,
+    headers: Message,
+    known: Optional[Dict[str, str]] = None,
+    stop_after: int = DEFAULT_STOP_AFTER,
+) -> Tuple[str, "FeedParserDict"]:
+    """Parses the feed document from the file-like `fp` while it's read, see `feedstream.FeedStreamParser`.
+    Only the entries which are not in `known` (episode uid -> fingerprint) or changed are returned.
+    Documents which are not well-formed XML are parsed by `parse_feed()` instead.
+    """
+
+    fingerprints = known or {}
+
+    def unchanged(entry: "FeedParserDict") -> bool:
+        episode_uid = get_episode_uid(entry)
+        return episode_uid is not None and fingerprints.get(episode_uid) == get_entry_fingerprint(entry)
+
+    parser = FeedStreamParser(unchanged if fingerprints else None, stop_after)
+
+    # the data read so far is only needed for the fallback
+    with SpooledTemporaryFile(STREAM_SPOOL_SIZE) as spool:
+        try:
+            while not parser.done:
+                data = fp.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                spool.write(data)
+                parser.feed(data)
+            feed = parser.close()
+        except (ParseError, UnsupportedFeed) as e:
+            logging.info("Parsing feed <%s> with feedparser: %s", url, e)
+            copyfileobj(fp, spool)
+            spool.seek(0)
+            return parse_feed(url, spool.read(), headers)
+
+    feed["etag"] = headers.get("ETag")
+    feed["modified"] = headers.get("Last-Modified")
+
+    if len(feed.feed) == 0 and len(feed.entries) == 0 and feed.skipped == 0:
+        raise InvalidFeed("Feed does neither contain a description nor files")
+
+    title = feed.feed.get("title")
+
+    return (title, feed)
+
+
+def parse_and_normalize(
+    url: str,
+    data: bytes,
+    headers: Message,
+    known: Optional[Dict[str, str]] = None,
+    parser: str = "feedparser",
+    stop_after: int = DEFAULT_STOP_AFTER,
+) -> Tuple[str, ParsedFeed]:
+    """Parses and normalizes a feed document. Runs in the parse processes of `Catcher`."""
+
+    if parser == "stream":
+        title, feed = parse_feed_stream(url, BytesIO(data), headers, known, stop_after)
+    else:
+        title, feed = parse_feed(url, data, headers)
+
+    return title, normalize_feed(feed, known)
+
+
+class EpisodeFailures(downloader.DownloadListener):
+    """Records failed downloads in the episodes of the feeds database of `catcher`."""
+
+    def __init__(self, catcher: "Catcher") -> None:
+        self.catcher = catcher
+
+    def finished(self, key: Optional[Tuple[str, str]], status: Optional[Exception], ret: Any) -> None:
+        if key is not None and status is not None:
+            self.catcher._download_failed(key[0], key[1], status)
+
+
 class Catcher:
     FILENAME_CONFIG = "config.json"
     FILENAME_CASTS = "casts.json"
     FILENAME_FEEDS = "feeds.db.json"
+    FILENAME_FEEDS_SQLITE = "feeds.db.sqlite"
+    FILENAME_FEEDS_SNAPSHOT = "feeds.db.snapshot"
+    FILENAME_JOURNAL = "downloads.journal"
+
+    FAILURE_FIELDS = ("failures", "failed", "error", "permanent")  # episode keys set by failed downloads
 
     casts: Dict[str, Dict[str, Any]]
-    db: Dict[str, Any]
+    db: MutableMapping[str, Any]
 
     def __init__(self, appdatadir: Path) -> None:
         """Call `Catcher.load_feeds()` afterwards to load feeds from cache or download if not available."""
@@ -182,19 +509,89 @@ class Catcher:
         self.timeout = self.config.get("network-timeout", DEFAULT_NETWORK_TIMEOUT)
         self.user_agent = self.config.get("user-agent", DEFAULT_USER_AGENT)
         self.casts_dir = Path(self.config["casts-directory"])
-        self.interval = self.config["refresh-interval"]  # seconds, unused so far
+        self.interval = self.config["refresh-interval"]  # seconds, minimum time between refreshes of a feed
         self.concurrent_downloads = self.config.get("concurrent-downloads", DEFAULT_CONCURRENT_DOWNLOADS)
+        self.download_segments = self.config.get("download-segments", 1)  # opt-in, 1 disables segmented downloads
+        self.download_segment_threshold = self.config.get("download-segment-threshold", DEFAULT_SEGMENT_THRESHOLD)
+        self.refresh_engine = self.config.get("refresh-engine", "threads")
+        self.refresh_concurrency = self.config.get("refresh-concurrency", DEFAULT_REFRESH_CONCURRENCY)
+        self.refresh_concurrency_per_host = self.config.get(
+            "refresh-concurrency-per-host", DEFAULT_REFRESH_CONCURRENCY_PER_HOST
+        )
+        self.feed_parser = self.config.get("feed-parser", "feedparser")  # or "stream"
+        self.stream_stop_after = self.config.get("stream-stop-after", DEFAULT_STOP_AFTER)
+        self.parse_processes = self.config.get("parse-processes", 0)  # 0 parses feeds in the refresh threads
+        self.parse_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None  # started on first use
+        self.parse_pool_lock = threading.Lock()
 
         self.headers = {"User-Agent": self.user_agent}
 
-        self.dl = ProgressThreadPool(concurrent=self.concurrent_downloads)
+        self.retry_policy = downloader.RetryPolicy(
+            attempts=1 + self.config.get("download-retries", DEFAULT_DOWNLOAD_RETRIES),
+            delay=self.config.get("download-retry-delay", 10.0),  # seconds, doubled for every attempt
+            max_delay=self.config.get("download-retry-max-delay", 600.0),
+        )
+        self.max_failures = self.config.get("download-max-failures", DEFAULT_DOWNLOAD_MAX_FAILURES)
+
+        self.dl = downloader.DownloadScheduler(
+            concurrent=self.concurrent_downloads,
+            per_host=self.config.get("concurrent-downloads-per-host"),
+            bandwidth=self.config.get("download-bandwidth"),  # bytes per second
+            host_bandwidth=self.config.get("download-bandwidth-per-host"),
+            retry_policy=self.retry_policy,
+        )
+        self.resumed: Dict[str, int] = {}
+
+        self.journal = DownloadJournal(self.appdatadir / self.FILENAME_JOURNAL)
+        self.resumable = {key: info for key, info in self.journal.load().items() if info.get("state") in ACTIVE_STATES}
+        # the episode has to be updated before the journal finishes the download, otherwise the failure
+        # could be compacted from the journal and be missing from a database saved in between
+        self.dl.add_listener(EpisodeFailures(self))
+        self.dl.add_listener(self.journal)
+        # seconds between progress events
+        self.events = DownloadEvents(self.config.get("progress-interval", 1.0), self.resumed)
+        self.dl.add_listener(self.events)
+
+        # `self.lock` protects the structure of `self.db` and `self.casts`, the cast locks protect the contents
+        # of a single cast. Adding, removing or renaming casts requires the write lock,
+        # modifying a cast requires the read lock and the lock of the cast.
+        self.lock = RWLock()
+        self.cast_locks = KeyLocks()
+        self.changes_lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+        self.storage = self._create_storage(self.config.get("storage", "json"))
+        self.changes: ChangesT = set()
+        self.new_descriptions: DescriptionsT = {}  # not saved yet
+        self.index = EpisodeIndex()  # built on first use, as it needs all casts to be loaded
+        self.index_built = False
+        self.refresher = RefreshWorker(self.update_feeds)  # refreshes feeds in the background
 
         self.load_roaming()
         # self.load_local()
 
     def close(self):
+        self.refresher.stop()
+        self.refresher.join()
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
         self.dl.stop()
         self.dl.join()
+        self.journal.close()
+        self.storage.close()
+
+    def _create_storage(self, engine: str):
+        if engine == "json":
+            snapshot_path = None
+            if self.config.get("feeds-snapshot", False):  # opt-in, written in addition to the json database
+                snapshot_path = self.appdatadir / self.FILENAME_FEEDS_SNAPSHOT
+            return JsonStorage(self.appdatadir / self.FILENAME_FEEDS, snapshot_path=snapshot_path)
+        elif engine == "sqlite":
+            return SqliteStorage(
+                self.appdatadir / self.FILENAME_FEEDS_SQLITE, json_path=self.appdatadir / self.FILENAME_FEEDS
+            )
+        else:
+            raise ValueError(f"Invalid storage engine: {engine}")
 
     def load_config(self) -> None:
         self.config = read_json(self.appdatadir / self.FILENAME_CONFIG, cls=BuiltinRoundtripDecoder)
@@ -204,6 +601,15 @@ class Catcher:
             self.config, self.appdatadir / self.FILENAME_CONFIG, indent="\t", cls=BuiltinRoundtripEncoder, safe=True
         )
 
+    def get_config(self) -> Dict[str, Any]:
+        return dict(self.config)
+
+    def update_config(self, values: Dict[str, Any]) -> None:
+        """Changes and saves the config. Most values take effect only after a restart."""
+
+        self.config.update(values)
+        self.save_config()
+
     def load_roaming(self) -> None:
         try:
             self.casts = read_json(self.appdatadir / self.FILENAME_CASTS, cls=BuiltinRoundtripDecoder)
@@ -211,6 +617,9 @@ class Catcher:
             self.casts = {}
 
     def _check_casts_consistency(self) -> None:
+        if not hasattr(self, "db"):  # only the roaming information is loaded, see `Catcher.load_local()`
+            return
+
         a = self.casts.keys() - self.db.keys()
         b = self.db.keys() - self.casts.keys()
 
@@ -220,17 +629,195 @@ class Catcher:
             )
 
     def save_roaming(self) -> None:
-        self._check_casts_consistency()
-        write_json(
-            self.casts, self.appdatadir / self.FILENAME_CASTS, indent="\t", cls=BuiltinRoundtripEncoder, safe=True
-        )
+        with self.lock.read():
+            self._check_casts_consistency()
+            write_json(
+                self.casts, self.appdatadir / self.FILENAME_CASTS, indent="\t", cls=BuiltinRoundtripEncoder, safe=True
+            )
+
+    @contextmanager
+    def _cast_locked(self, cast_uid: str) -> Iterator[None]:
+        """Locks the database for modifications of `cast_uid`."""
+
+        with self.lock.read(), self.cast_locks(cast_uid):
+            yield
+
+    def get_casts(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Returns the cast uids and their roaming information."""
+
+        with self.lock.read():
+            return list(self.casts.items())
+
+    def has_cast(self, cast_uid: str) -> bool:
+        with self.lock.read():
+            return cast_uid in self.db
+
+    def _loaded(self, cast_uid: str) -> bool:
+        return not isinstance(self.db, LazyDatabase) or self.db.loaded(cast_uid)
+
+    def _episode_dates(self, cast_uid: str) -> List[Tuple[str, Optional[datetime]]]:
+        """Returns the uids and dates of the episodes of a cast. Casts which are not loaded are not loaded
+        for this, the dates are read from the storage engine instead.
+        """
+
+        if self._loaded(cast_uid):
+            return [(episode_uid, episode.get("date")) for episode_uid, episode in self.db[cast_uid]["items"].items()]
+        return self.storage.episode_dates(cast_uid)
+
+    def _ensure_index(self) -> None:
+        if not self.index_built:
+            with self.lock.write():
+                if not self.index_built:
+                    self.index.build_dates((cast_uid, self._episode_dates(cast_uid)) for cast_uid in self.db)
+                    self.index_built = True
+
+    def count_episodes(self, cast_uid: Optional[str] = None) -> int:
+        self._ensure_index()
+        return self.index.count(cast_uid)
+
+    def episode_file(self, cast_uid: str, episode_uid: str) -> Optional[Tuple[Path, Optional[str]]]:
+        """Returns the path and mimetype of the downloaded file of the episode or None if it wasn't downloaded."""
+
+        with self._cast_locked(cast_uid):
+            info = self.episode(cast_uid, episode_uid)
+            if not info or not info.get("localname"):
+                return None
+            return self.casts_dir / safe_filename(cast_uid, "_") / info["localname"], info.get("mimetype")
+
+    def _load_cast(self, cast_uid: str) -> Dict[str, Any]:
+        cast = self.storage.load_cast(cast_uid)
+        db = {cast_uid: cast}
+        with self.changes_lock:
+            # databases of older versions contain descriptions
+            self.new_descriptions.update(split_descriptions(db))
+        compact_episodes(db)
+        return cast
 
     def load_local(self) -> None:
-        self.db = read_json(self.appdatadir / self.FILENAME_FEEDS, cls=BuiltinRoundtripDecoder)
+        """Casts are loaded when they are accessed the first time, see `storage.LazyDatabase`."""
+
+        db = LazyDatabase(self.storage.cast_uids(), self._load_cast)
+
+        with self.lock.write():
+            self.db = db
+            self.index_built = False
+            with self.changes_lock:
+                self.changes = set()
+                self.new_descriptions = {}
+            applied = self._apply_journal()
+
+        if applied:
+            self.save_local()
+
+    def _snapshot(self, changes: Optional[ChangesT] = None) -> Dict[str, Any]:
+        """Returns a copy of `self.db` which can be saved while the database is modified by other threads.
+        If `changes` is given, only the changed casts and episodes are copied.
+        Casts which were not loaded are not loaded for this and are None in the copy.
+        """
+
+        if changes is None:
+            with self.lock.read():
+                selected: Dict[str, Optional[List[str]]] = {cast_uid: None for cast_uid in self.db}
+        else:
+            selected = {}
+            for cast_uid, episode_uid in changes:
+                episodes = selected.setdefault(cast_uid, [])
+                if episode_uid is not None:
+                    episodes.append(episode_uid)  # type: ignore[union-attr]
+
+        snapshot: Dict[str, Optional[Dict[str, Any]]] = {}
+        with self.lock.read():
+            for cast_uid, episode_uids in selected.items():
+                if episode_uids is None and cast_uid in self.db and not self._loaded(cast_uid):
+                    snapshot[cast_uid] = None
+                    continue
+                with self.cast_locks(cast_uid):
+                    cast = self.db.get(cast_uid)
+                    if cast is None:
+                        continue
+                    items = cast["items"]
+                    if episode_uids is None:
+                        episode_uids = list(items)
+                    snapshot[cast_uid] = {
+                        **cast,
+                        "items": {
+                            episode_uid: dict(items[episode_uid])
+                            for episode_uid in episode_uids
+                            if episode_uid in items
+                        },
+                    }
+
+        return snapshot
 
     def save_local(self) -> None:
-        self._check_casts_consistency()
-        write_json(self.db, self.appdatadir / self.FILENAME_FEEDS, indent="\t", cls=BuiltinRoundtripEncoder, safe=True)
+        """Saves a snapshot of the database, so it can be called while other threads modify it."""
+
+        with self.save_lock:
+            with self.lock.read():
+                self._check_casts_consistency()
+            mark = self.journal.mark()
+            with self.changes_lock:
+                changes, self.changes = self.changes, set()
+                descriptions, self.new_descriptions = self.new_descriptions, {}
+            db = self._snapshot(changes if self.storage.incremental else None)
+            self.storage.save(db, changes, descriptions)
+            self.journal.compact(mark)
+
+    def _apply_journal(self) -> int:
+        """Applies downloads which finished after the database was last saved. Returns the number of changes."""
+
+        applied = 0
+        for (cast_uid, episode_uid), info in self.journal.items.items():
+            if info.get("state") != STATE_DONE:
+                continue
+            episode = self.episode(cast_uid, episode_uid)
+            if episode is not None and episode.get("localname") != info["localname"]:
+                episode["localname"] = info["localname"]
+                self._changed(cast_uid, episode_uid)
+                applied += 1
+
+        if applied:
+            logging.info("Recovered %d finished downloads from the journal", applied)
+
+        return applied
+
+    def resume_downloads(self) -> int:
+        """Queues the downloads which were queued or running when the process ended.
+        Returns the number of queued downloads.
+        """
+
+        resumable, self.resumable = self.resumable, {}
+
+        queued = 0
+        for (cast_uid, episode_uid), info in resumable.items():
+            key = (cast_uid, episode_uid)
+            try:
+                if self.download_item(
+                    cast_uid,
+                    episode_uid,
+                    info.get("force", False),
+                    info.get("overwrite", False),
+                    info.get("priority", PRIORITY_BULK),
+                ):
+                    queued += 1
+                elif not self.journal.is_active(key):
+                    # finish the entry, so it's removed from the journal by the next compaction
+                    self.journal.record(key, STATE_FAILED, reason="Not resumed")
+            except KeyError:
+                self.journal.record(key, STATE_FAILED, reason="Episode not found")
+
+        logging.info("Resumed %d of %d downloads", queued, len(resumable))
+        return queued
+
+    def _changed(self, cast_uid: str, episode_uid: Optional[str] = None) -> None:
+        """Marks a cast or episode as changed, so it is written by the next `Catcher.save_local()`
+        and updated in the episode index.
+        """
+
+        with self.changes_lock:
+            self.changes.add((cast_uid, episode_uid))
+        if self.index_built:
+            self.index.update(self.db, cast_uid, episode_uid)
 
     def load_feeds(self) -> bool:
         """Returns `True` if feeds where refreshed and `False` if loaded from cache."""
@@ -239,10 +826,14 @@ class Catcher:
             self.load_local()
             return False
         except FileNotFoundError:
+            with self.lock.write():
+                self.db = {}
+                self.index.build(self.db)
+                self.index_built = True
             self.update_feeds()
             return True
 
-    def episode(self, cast_uid: str, episode_uid: str) -> Optional[dict]:
+    def episode(self, cast_uid: str, episode_uid: str) -> Optional[Episode]:
         # if "|" in cast_uid or "|" in episode_uid:
         # 	raise ValueError("arguments cannot contain '|'")
 
@@ -251,64 +842,173 @@ class Catcher:
             return cast["items"].get(episode_uid)
         return None
 
+    def episodes(
+        self, cast_uid: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100, descending: bool = True
+    ) -> Tuple[List[Tuple[str, str, Episode]], Optional[str]]:
+        """Returns a page of up to `limit` episodes of `cast_uid` (or of all casts) ordered by date
+        as `(cast_uid, episode_uid, episode)` and the cursor of the next page (or None for the last page).
+        Raises ValueError for invalid cursors.
+        """
+
+        self._ensure_index()
+        keys, next_cursor = self.index.page(cast_uid, cursor, limit, descending)
+        episodes = []
+        for key in keys:
+            episode = self.episode(*key)
+            if episode is not None:  # could have been removed in the meantime
+                episodes.append((key[0], key[1], episode))
+        return episodes, next_cursor
+
+    def description(self, cast_uid: str, episode_uid: str) -> Optional[str]:
+        """Descriptions are not part of `self.db` and are loaded on demand."""
+
+        self.db.get(cast_uid)  # loading the cast moves descriptions of older databases to `self.new_descriptions`
+        with self.changes_lock:
+            try:
+                return self.new_descriptions[(cast_uid, episode_uid)]
+            except KeyError:
+                pass
+        return self.storage.load_description(cast_uid, episode_uid)
+
     def listenedto(self, cast_uid: str, episode_uid: str, date: Optional[datetime] = None) -> datetime:
         if not date:
             date = now()
-        info = self.episode(cast_uid, episode_uid)
-        if not info:
-            raise KeyError((cast_uid, episode_uid))
-        info["listened"] = date
+        with self._cast_locked(cast_uid):
+            info = self.episode(cast_uid, episode_uid)
+            if not info:
+                raise KeyError((cast_uid, episode_uid))
+            info["listened"] = date
+            self._changed(cast_uid, episode_uid)
         return date
 
     def forget_episode(self, cast_uid: str, episode_uid: str) -> datetime:
-        info = self.episode(cast_uid, episode_uid)
-        if not info:
-            raise KeyError((cast_uid, episode_uid))
-        return info.pop("listened")
-
-    def get_feed(self, url: str) -> Tuple[str, FeedParserDict]:
-        r = URLRequest(url, headers=self.headers, context=ssl_context)
-        data = BytesIO(r.load())
-        feed = feedparser.parse(
-            data,
-            response_headers={
-                "Content-Location": url,
-                "content-type": r.headers["content-type"],
-            },
+        with self._cast_locked(cast_uid):
+            info = self.episode(cast_uid, episode_uid)
+            if not info:
+                raise KeyError((cast_uid, episode_uid))
+            listened = info.pop("listened")
+            self._changed(cast_uid, episode_uid)
+        return listened
+
+    def get_feed(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        modified: Optional[str] = None,
+        known: Optional[Dict[str, str]] = None,
+    ) -> Tuple[str, "FeedParserDict"]:
+        """Raises `NotModified` if the validators `etag` or `modified` are given
+        and the server reports that the feed didn't change since.
+        With the "stream" feed parser, `known` maps episode uids to fingerprints to stop parsing early.
+        """
+
+        r = self._request(url, etag, modified)
+
+        if self.feed_parser == "stream":
+            with r.response:
+                return self.parse_feed_stream(url, r.response, r.headers, known)
+
+        return self.parse_feed(url, r.load(), r.headers)
+
+    def _request(self, url: str, etag: Optional[str], modified: Optional[str]) -> URLRequest:
+        headers = dict(self.headers)
+        headers.update(self._conditional_headers(etag, modified))
+
+        try:
+            return URLRequest(url, headers=headers, context=get_ssl_context())
+        except HTTPError as e:
+            if e.code == 304:
+                raise NotModified(url) from None
+            raise
+
+    def _get_parse_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self.parse_pool_lock:
+            if self.parse_pool is None:
+                self.parse_pool = concurrent.futures.ProcessPoolExecutor(
+                    self.parse_processes, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.parse_pool
+
+    def _refresh_feed(
+        self, url: str, etag: Optional[str], modified: Optional[str], known: Optional[Dict[str, str]]
+    ) -> Tuple[str, FeedT]:
+        """Fetches the feed at `url` for `update_feeds()`. With parse processes the feed is parsed and normalized
+        in one of them and only the normalized new and changed entries are sent back.
+        """
+
+        if not self.parse_processes:
+            return self.get_feed(url, etag, modified, known)
+
+        r = self._request(url, etag, modified)
+        future = self._get_parse_pool().submit(
+            parse_and_normalize, url, r.load(), r.headers, known, self.feed_parser, self.stream_stop_after
         )
+        return future.result()
+
+    @staticmethod
+    def _conditional_headers(etag: Optional[str], modified: Optional[str]) -> Dict[str, str]:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+        return headers
+
+    def parse_feed(self, url: str, data: bytes, headers: Message) -> Tuple[str, "FeedParserDict"]:
+        """Parses the feed document `data` which was retrieved from `url` with response `headers`."""
 
-        if feed.bozo:
-            logging.error("Feed mal-formed <%s>: %s", url, feed.bozo_exception)
+        return parse_feed(url, data, headers)
 
-        if len(feed.feed) == 0 and len(feed.entries) == 0:  # compare with standard
-            raise InvalidFeed("Feed does neither contain a description nor files")
+    def parse_feed_stream(
+        self, url: str, fp: BinaryIO, headers: Message, known: Optional[Dict[str, str]] = None
+    ) -> Tuple[str, "FeedParserDict"]:
+        """Parses the feed document from the file-like `fp` while it's read, see `parse_feed_stream()`."""
 
-        title = feed.feed.get("title")
+        return parse_feed_stream(url, fp, headers, known, self.stream_stop_after)
 
-        return (title, feed)
+    def _fingerprints(self, cast_uid: str) -> Dict[str, str]:
+        """Returns the fingerprints of the known episodes of `cast_uid`."""
+
+        with self._cast_locked(cast_uid):
+            items = self.db.get(cast_uid, {}).get("items", {})
+            return {
+                episode_uid: episode["fingerprint"]
+                for episode_uid, episode in items.items()
+                if "fingerprint" in episode
+            }
+
+    def _refresh_known(self, cast_uid: str) -> Optional[Dict[str, str]]:
+        """Returns the fingerprints which are passed to the refresh of `cast_uid`, if its parser uses them."""
+
+        if self.feed_parser == "stream" or self.parse_processes:
+            return self._fingerprints(cast_uid)
+        return None
 
     def update_feed_url(self, cast_uid: str, url: str):
-        try:
-            feed = self.casts[cast_uid]
-        except KeyError:
-            raise ValueError(f"Feed {cast_uid} doesn't exist.") from None
+        with self.lock.write():
+            try:
+                feed = self.casts[cast_uid]
+            except KeyError:
+                raise ValueError(f"Feed {cast_uid} doesn't exist.") from None
 
-        feed["url"] = url
+            feed["url"] = url
 
-    def add_feed(self, url: str, cast_uid: str, feed: FeedParserDict) -> bool:
+    def add_feed(self, url: str, cast_uid: str, feed: "FeedParserDict") -> bool:
         if not url or not cast_uid or not feed:
             raise ValueError("argument values cannot be empty")
 
-        if cast_uid in self.casts:
-            raise ValueError(f"{cast_uid} already exists")
+        with self.lock.write():
+            if cast_uid in self.casts:
+                raise ValueError(f"{cast_uid} already exists")
 
-        cast_uid_safe = safe_filename(cast_uid, "_")
-        collision = self.is_name_collision_add(cast_uid_safe)
-        if collision:
-            raise ValueError(f"Name collision with {collision}")
+            cast_uid_safe = safe_filename(cast_uid, "_")
+            collision = self.is_name_collision_add(cast_uid_safe)
+            if collision:
+                raise ValueError(f"Name collision with {collision}")
+
+            self.casts[cast_uid] = {"url": url}
+            self.update_feed(cast_uid, feed)
 
-        self.casts[cast_uid] = {"url": url}
-        self.update_feed(cast_uid, feed)
         self.save_roaming()
         self.save_local()
 
@@ -322,14 +1022,17 @@ class Catcher:
             return False
 
     def remove_cast(self, cast_uid: str, files: bool = False) -> None:
-        if (cast_uid in self.casts) != (cast_uid in self.db):
-            raise RuntimeError("Inconsistent database")
+        with self.lock.write():
+            if (cast_uid in self.casts) != (cast_uid in self.db):
+                raise RuntimeError("Inconsistent database")
 
-        if files:
-            raise RuntimeError("Deleting files not yet implemented")
+            if files:
+                raise RuntimeError("Deleting files not yet implemented")
+
+            del self.casts[cast_uid]
+            del self.db[cast_uid]  # should 'listened to' information be kept?
+            self._changed(cast_uid)
 
-        del self.casts[cast_uid]
-        del self.db[cast_uid]  # should 'listened to' information be kept?
         self.save_roaming()
         self.save_local()
 
@@ -349,34 +1052,46 @@ class Catcher:
         return None
 
     def rename_cast(self, cast_uid_old: str, cast_uid_new: str) -> None:
-        if (cast_uid_new in self.casts) != (cast_uid_new in self.db):
-            raise RuntimeError("Inconsistent database")
+        with self.lock.write():
+            if (cast_uid_new in self.casts) != (cast_uid_new in self.db):
+                raise RuntimeError("Inconsistent database")
 
-        if (cast_uid_old in self.casts) != (cast_uid_old in self.db):
-            raise RuntimeError("Inconsistent database")
+            if (cast_uid_old in self.casts) != (cast_uid_old in self.db):
+                raise RuntimeError("Inconsistent database")
 
-        if cast_uid_old == cast_uid_new:  # put after asserts, so inconsistent database is found earlier
-            return
-
-        if cast_uid_new in self.casts:
-            raise ValueError("Cast already exists")
+            if cast_uid_old == cast_uid_new:  # put after asserts, so inconsistent database is found earlier
+                return
 
-        cast_uid_old_safe = safe_filename(cast_uid_old, "_")
-        cast_uid_new_safe = safe_filename(cast_uid_new, "_")
+            if cast_uid_new in self.casts:
+                raise ValueError("Cast already exists")
 
-        collision = self.is_name_collision_rename(cast_uid_new_safe, cast_uid_old)
-        if collision:
-            raise ValueError(f"Name collision with {collision}")
+            cast_uid_old_safe = safe_filename(cast_uid_old, "_")
+            cast_uid_new_safe = safe_filename(cast_uid_new, "_")
 
-        try:
-            (self.casts_dir / cast_uid_old_safe).rename(self.casts_dir / cast_uid_new_safe)
-        except FileNotFoundError:
-            raise ValueError("Cast directory not found")
-        except FileExistsError:
-            raise ValueError("Directory already exists")
+            collision = self.is_name_collision_rename(cast_uid_new_safe, cast_uid_old)
+            if collision:
+                raise ValueError(f"Name collision with {collision}")
 
-        self.casts[cast_uid_new] = self.casts.pop(cast_uid_old)
-        self.db[cast_uid_new] = self.db.pop(cast_uid_old)
+            try:
+                (self.casts_dir / cast_uid_old_safe).rename(self.casts_dir / cast_uid_new_safe)
+            except FileNotFoundError:
+                raise ValueError("Cast directory not found")
+            except FileExistsError:
+                raise ValueError("Directory already exists")
+
+            for episode_uid in self.db[cast_uid_old]["items"]:
+                description = self.description(cast_uid_old, episode_uid)
+                if description is not None:
+                    with self.changes_lock:
+                        self.new_descriptions[(cast_uid_new, episode_uid)] = description
+
+            self.casts[cast_uid_new] = self.casts.pop(cast_uid_old)
+            self.db[cast_uid_new] = self.db.pop(cast_uid_old)
+
+            self._changed(cast_uid_old)
+            self._changed(cast_uid_new)
+            for episode_uid in self.db[cast_uid_new]["items"]:
+                self._changed(cast_uid_new, episode_uid)
 
         self.save_roaming()
         self.save_local()
@@ -385,78 +1100,191 @@ class Catcher:
         if file:
             raise RuntimeError("Deleting files not yet implemented")
 
-        ep = self.episode(cast_uid, episode_uid)
-        if not ep:
-            raise KeyError((cast_uid, episode_uid))
-
-        return ep.pop("localname", None)
+        with self._cast_locked(cast_uid):
+            ep = self.episode(cast_uid, episode_uid)
+            if not ep:
+                raise KeyError((cast_uid, episode_uid))
+
+            localname = ep.pop("localname", None)
+            self._changed(cast_uid, episode_uid)
+        return localname
+
+    def update_feed(self, cast_uid: str, feed: FeedT, subscribed: bool = False) -> Dict[str, int]:
+        """Modifies `self.db`, calling function should take care of persisting it.
+        `feed` is either parsed by feedparser or already normalized by `normalize_feed()`.
+        Only entries whose fingerprint changed are normalized again.
+        Feeds from `parse_feed_stream()` only contain the new and changed entries and, if parsing stopped early,
+        might lack feed level fields. Those fields keep their previous values then.
+        Returns the number of added, changed and unchanged entries.
+        If `subscribed` is True, raises `CastRemoved` if the cast was removed from `self.casts`.
+        """
+
+        if isinstance(feed, ParsedFeed):
+            parsed = feed
+        else:
+            parsed = normalize_feed(feed, self._fingerprints(cast_uid))
 
-    def update_feed(self, cast_uid: str, feed: FeedParserDict) -> None:
-        """Modifies `self.db`, calling function should take care of persisting it."""
+        if cast_uid not in self.db:
+            with self.lock.write():
+                if subscribed and cast_uid not in self.casts:
+                    raise CastRemoved(cast_uid)
+                self.db.setdefault(cast_uid, {"items": {}})
 
-        try:
-            pub: Optional[datetime] = naive_to_aware(email.utils.parsedate_to_datetime(feed.feed.published))
-        except AttributeError:
-            pub = None
+        with self._cast_locked(cast_uid):
+            try:
+                cast = self.db[cast_uid]
+            except KeyError:  # removed in the meantime
+                raise CastRemoved(cast_uid) from None
 
-        try:
-            self.db[cast_uid]["date"] = pub
-        except KeyError:
-            self.db[cast_uid] = dict()
-            self.db[cast_uid]["items"] = dict()
-            self.db[cast_uid]["date"] = pub
+            if parsed.date is not None or parsed.complete:
+                cast["date"] = parsed.date
+            # validators for conditional requests
+            cast["etag"] = parsed.etag
+            cast["modified"] = parsed.modified
+            self._changed(cast_uid)
 
-        for entry in feed.entries:
-            try:
-                db_entry = self.db[cast_uid]["items"][self.get_episode_uid(entry)]
-            except KeyError:
-                episode_uid = self.get_episode_uid(entry)
-                self.db[cast_uid]["items"][episode_uid] = dict()
-                db_entry = self.db[cast_uid]["items"][episode_uid]
+            items = cast["items"]
+            stats = {"added": 0, "changed": 0, "unchanged": parsed.unchanged}
 
-            try:
-                entry_pub: Optional[datetime] = naive_to_aware(email.utils.parsedate_to_datetime(entry.published))
-            except AttributeError:
-                entry_pub = None
-
-            duration = parse_itunes_duration(entry.get("itunes_duration"))
-            db_entry.update(
-                {
-                    "title": entry.get("title"),
-                    "date": entry_pub,
-                    "duration": duration,
-                    "description": entry.get("description"),
-                }
+            for episode_uid, fingerprint, episode in parsed.episodes:
+                try:
+                    db_entry = items[episode_uid]
+                except KeyError:
+                    db_entry = None
+                else:
+                    if db_entry.get("fingerprint") == fingerprint:
+                        stats["unchanged"] += 1
+                        continue
+
+                normalized = dict(episode, fingerprint=fingerprint)
+                with self.changes_lock:
+                    self.new_descriptions[(cast_uid, episode_uid)] = normalized.pop(  # type: ignore[index]
+                        "description"
+                    )
+
+                if db_entry is None:
+                    items[episode_uid] = Episode(normalized)
+                    stats["added"] += 1
+                else:
+                    if db_entry.get("href") != normalized["href"]:  # failures of the old url don't apply
+                        for field in self.FAILURE_FIELDS:
+                            db_entry.pop(field, None)
+                    db_entry.update(normalized)
+                    stats["changed"] += 1
+
+                self._changed(cast_uid, episode_uid)
+
+            cast["interval"] = refresh_interval(
+                timedelta(seconds=self.interval),
+                parsed.publisher_interval,
+                publishing_interval(episode.get("date") for episode in items.values()),
             )
+            if parsed.skiphours is not None or parsed.complete:
+                cast["skiphours"] = parsed.skiphours or []
+            self._schedule(cast_uid)
+
+        logging.debug(
+            "Updated %s: %d added, %d changed, %d unchanged",
+            cast_uid,
+            stats["added"],
+            stats["changed"],
+            stats["unchanged"],
+        )
 
-            encs = len(entry.get("enclosures"))
-            if encs == 0:
-                db_entry.update({"href": None, "length": None, "mimetype": None})
-            elif encs == 1:
-                enclosure = entry.enclosures[0]
-                db_entry.update(
-                    {
-                        "href": enclosure.get("href"),
-                        "length": toint(enclosure.get("length")),
-                        "mimetype": enclosure.get("type"),
-                    }
-                )
+        return stats
+
+    def _schedule(self, cast_uid: str, failed: bool = False) -> None:
+        """Sets the time of the next refresh of `cast_uid` after it was checked just now.
+        Feeds which `failed` to refresh back off for every consecutive failure.
+        """
+
+        with self._cast_locked(cast_uid):
+            cast = self.db.get(cast_uid)
+            if cast is None:  # removed in the meantime
+                return
+            interval = cast.get("interval") or timedelta(seconds=self.interval)
+            if failed:
+                cast["refresh_failures"] = cast.get("refresh_failures", 0) + 1
+                interval = failure_interval(interval, cast["refresh_failures"])
             else:
-                raise InvalidFeed("Feed contains multiple enclosures")
+                cast.pop("refresh_failures", None)
+            cast["due"] = next_due(now(), interval, cast.get("skiphours", []))
+            self._changed(cast_uid)
+
+    def due_casts(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the casts which should be refreshed now."""
+
+        _now = now()
+        due = {}
+        with self.lock.read():
+            for cast_uid, cast in self.casts.items():
+                next_refresh = self.db.get(cast_uid, {}).get("due")
+                if next_refresh is None or next_refresh <= _now:
+                    due[cast_uid] = cast
+
+        return due
 
-    def update_feeds(self) -> None:
-        feed: FeedParserDict
+    def update_feeds(
+        self, force: bool = False, progress: Optional[Callable[[int, int], None]] = None
+    ) -> Dict[str, int]:
+        """Refreshes all feeds which are due (or all feeds if `force` is True)
+        using conditional requests where possible. `progress(done, total)` is called for every refreshed feed.
+        Returns the number of feeds which were not modified (hits), downloaded (misses), failed or skipped,
+        because they were not due or were removed during the refresh.
+        """
 
         logging.debug("Refreshing all feeds")
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        with self.lock.read():
+            casts = dict(self.casts) if force else self.due_casts()
+            not_due = len(self.casts) - len(casts)
+            stats = {"hits": 0, "misses": 0, "failed": 0, "skipped": not_due}
+
+        def report() -> None:
+            if progress is not None:
+                done = stats["hits"] + stats["misses"] + stats["failed"] + stats["skipped"] - not_due
+                progress(done, len(casts))
+
+        report()
+        if self.refresh_engine == "asyncio":
+            import asyncio
+
+            asyncio.run(self._update_feeds_async(casts, stats, report))
+        elif self.refresh_engine == "threads":
+            self._update_feeds_threaded(casts, stats, report)
+        else:
+            raise ValueError(f"Invalid refresh engine: {self.refresh_engine}")
+
+        logging.info(
+            "Refreshed feeds: %d not modified, %d updated, %d failed, %d not due",
+            stats["hits"],
+            stats["misses"],
+            stats["failed"],
+            stats["skipped"],
+        )
+
+        self.save_local()
+        return stats
+
+    def _update_feeds_threaded(
+        self, casts: Dict[str, Dict[str, Any]], stats: Dict[str, int], report: Callable[[], None]
+    ) -> None:
+        # enough threads to keep the parse processes busy
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(3, self.parse_processes)) as executor:
             futures: Dict[concurrent.futures.Future, str] = {}
-            for cast_uid, cast in self.casts.items():
+            for cast_uid, cast in casts.items():
+                local = self.db.get(cast_uid, {})
                 future = executor.submit(
                     retry,
-                    partial(self.get_feed, cast["url"]),
+                    partial(
+                        self._refresh_feed,
+                        cast["url"],
+                        local.get("etag"),
+                        local.get("modified"),
+                        self._refresh_known(cast_uid),
+                    ),
                     10,
-                    (ConnectionError, URLError, socket.timeout, ContentInvalidLength),
+                    RETRY_EXCEPTIONS,
                     attempts=2,
                     multiplier=1.5,
                 )
@@ -464,45 +1292,159 @@ class Catcher:
 
             for future in concurrent.futures.as_completed(futures):
                 cast_uid = futures[future]
-                cast = self.casts[cast_uid]
-                try:
-                    _title, feed = future.result()
-                    self.update_feed(cast_uid, feed)
-                except (ConnectionError, URLError, socket.timeout, ContentInvalidLength) as e:
-                    logging.warning("Could not update %s <%s>: %s", cast_uid, cast["url"], e)
-                except InvalidFeed as e:
-                    logging.warning("Invalid feed %s <%s>: %s", cast_uid, cast["url"], e)
+                self._apply_feed_result(cast_uid, casts[cast_uid], future, stats)
+                report()
+
+    async def _get_feed_async(
+        self,
+        fetcher: AsyncFeedFetcher,
+        url: str,
+        etag: Optional[str],
+        modified: Optional[str],
+        known: Optional[Dict[str, str]] = None,
+    ) -> Tuple[str, FeedT]:
+        import asyncio
+
+        headers = self._conditional_headers(etag, modified)
+
+        for attempt in range(2):
+            try:
+                _final_url, status, response_headers, data = await fetcher.fetch(url, headers)
+                break
+            except RETRY_EXCEPTIONS as e:
+                if attempt == 1:
+                    raise
+                logging.info("Attempt %s (%s) failed: %s", attempt + 1, url, e)
+                await asyncio.sleep(10)
+
+        if status == 304:
+            raise NotModified(url)
+
+        if self.parse_processes:
+            future = self._get_parse_pool().submit(
+                parse_and_normalize, url, data, response_headers, known, self.feed_parser, self.stream_stop_after
+            )
+            return await asyncio.wrap_future(future)
 
-        self.save_local()
+        if self.feed_parser == "stream":
+            return await fetcher.run_in_executor(self.parse_feed_stream, url, BytesIO(data), response_headers, known)
+
+        return await fetcher.run_in_executor(self.parse_feed, url, data, response_headers)
+
+    async def _update_feeds_async(
+        self, casts: Dict[str, Dict[str, Any]], stats: Dict[str, int], report: Callable[[], None]
+    ) -> None:
+        import asyncio
+
+        fetcher = AsyncFeedFetcher(
+            self.refresh_concurrency, self.refresh_concurrency_per_host, self.timeout, self.headers, get_ssl_context()
+        )
+
+        try:
+            tasks: Dict[asyncio.Future, str] = {}
+            for cast_uid, cast in casts.items():
+                local = self.db.get(cast_uid, {})
+                coro = self._get_feed_async(
+                    fetcher, cast["url"], local.get("etag"), local.get("modified"), self._refresh_known(cast_uid)
+                )
+                tasks[asyncio.ensure_future(coro)] = cast_uid
+
+            # results are applied in the event loop thread, so `self.db` is only modified by one thread
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    cast_uid = tasks[task]
+                    self._apply_feed_result(cast_uid, casts[cast_uid], task, stats)
+                    report()
+        finally:
+            fetcher.close()
+
+    def _apply_feed_result(self, cast_uid: str, cast: Dict[str, Any], future: FutureT, stats: Dict[str, int]) -> None:
+        feed: FeedT
+
+        with self.lock.read():
+            subscribed = cast_uid in self.casts
+        if not subscribed:
+            logging.debug("Feed %s <%s> was removed during the refresh", cast_uid, cast["url"])
+            stats["skipped"] += 1
+            return
+
+        try:
+            _title, feed = future.result()
+            self.update_feed(cast_uid, feed, subscribed=True)
+            stats["misses"] += 1
+        except CastRemoved:  # after the check above
+            logging.debug("Feed %s <%s> was removed during the refresh", cast_uid, cast["url"])
+            stats["skipped"] += 1
+        except NotModified:
+            logging.debug("Feed %s <%s> not modified", cast_uid, cast["url"])
+            self._schedule(cast_uid)
+            stats["hits"] += 1
+        except RETRY_EXCEPTIONS as e:
+            logging.warning("Could not update %s <%s>: %s", cast_uid, cast["url"], e)
+            self._schedule(cast_uid, failed=True)
+            stats["failed"] += 1
+        except InvalidFeed as e:
+            logging.warning("Invalid feed %s <%s>: %s", cast_uid, cast["url"], e)
+            self._schedule(cast_uid, failed=True)
+            stats["failed"] += 1
 
     def get_episode_uid(self, item: dict) -> Optional[str]:
-        return first_not_none([item.get("guid"), item.get("link"), item.get("title"), item.get("description")])
+        return get_episode_uid(item)
+
+    def get_download_status(self) -> Tuple[list, list, list, List[Tuple[str, Any]]]:
+        """Running downloads are returned as `(url, basepath, filename, expected_size), done, total, resumed`,
+        where `resumed` is the number of bytes which were continued from a partial file.
+        Failed downloads are returned with the error message instead of the exception, as not all exceptions
+        can be pickled for the processes which use the Catcher through `serve.connect_catcher()`.
+        """
 
-    def get_download_status(self) -> Tuple[list, list, list, List[Tuple[Exception, Any]]]:
         waiting = list(
-            (url, basepath, filename, expected_size)
-            for callable, (setter, url, basepath, filename, fn_prio, overwrite), (
-                expected_size,
-                timeout,
-                headers,
-            ) in self.dl.get_waiting()
+            (url, basepath, filename, kwargs["expected_size"])
+            for callable, (setter, url, basepath, filename, fn_prio, overwrite), kwargs in self.dl.get_waiting()
         )
         running = list(
-            ((url, basepath, filename, expected_size), done, total)
+            ((url, basepath, filename, kwargs["expected_size"]), done, total, self.resumed.get(url, 0))
             for (
                 callable,
                 (setter, url, basepath, filename, fn_prio, overwrite),
-                (expected_size, timeout, headers),
+                kwargs,
             ), done, total in self.dl.get_running()
         )
         completed = self.dl.get_completed()
-        failed = self.dl.get_failed()
+        failed = [(str(status), ret) for status, ret in self.dl.get_failed()]
         return waiting, running, completed, failed
 
+    def trigger_refresh(self, force: bool = False) -> bool:
+        """Refreshes the feeds in the background, see `RefreshWorker.trigger()`."""
+
+        return self.refresher.trigger(force)
+
+    def refresh_status(self) -> Dict[str, Any]:
+        return self.refresher.status()
+
+    def subscribe(self) -> Subscription:
+        """Returns a subscription to the changes of the download queue, see `podcatcher.events`.
+        It should be passed to `Catcher.unsubscribe()` when it's not used anymore.
+        """
+
+        return self.events.subscribe()
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.events.unsubscribe(subscription)
+
     def download_item(
-        self, cast_uid: str, episode_uid: str, force: bool = False, overwrite: bool = False
-    ) -> Optional[dict]:
-        """A completed download changes `self.db`, so Catcher.save_local()` should be called afterwards."""
+        self,
+        cast_uid: str,
+        episode_uid: str,
+        force: bool = False,
+        overwrite: bool = False,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Optional[Episode]:
+        """A completed download changes `self.db`, so Catcher.save_local()` should be called afterwards.
+        Downloads with higher `priority` are started first.
+        """
 
         fn_prio = self.casts[cast_uid].get("filename", None)
         if fn_prio:
@@ -525,6 +1467,16 @@ class Catcher:
             logging.debug("File already downloaded for %s/%s: %s", cast_uid, episode_uid, db_entry.get("localname"))
             return None
 
+        key = (cast_uid, episode_uid)
+        if self.journal.is_active(key):
+            logging.debug("Download already queued for %s/%s", cast_uid, episode_uid)
+            return None
+
+        # interactive downloads are always attempted, bulk downloads back off from failing episodes
+        if not force and priority < PRIORITY_INTERACTIVE and not self.should_retry(db_entry):
+            logging.debug("Skipping failed download of %s/%s: %s", cast_uid, episode_uid, db_entry.get("error"))
+            return None
+
         # these two values are only given own variables to aid mypy in its flow analysis
         title = db_entry.get("title")
         mimetype = db_entry.get("mimetype")
@@ -541,7 +1493,11 @@ class Catcher:
 
         def setter(ret: Tuple[str, str, int]) -> None:
             url, localname, length = ret
-            db_entry["localname"] = localname  # type: ignore[index]
+            with self._cast_locked(cast_uid):
+                db_entry["localname"] = localname  # type: ignore[index]
+                for field in self.FAILURE_FIELDS:
+                    db_entry.pop(field, None)
+                self._changed(cast_uid, episode_uid)
 
         url = db_entry.get("href")
 
@@ -552,6 +1508,8 @@ class Catcher:
         # try to fix some common URL errors
         url = url.replace(" ", "%20")
 
+        self.journal.record(key, STATE_QUEUED, force=force, overwrite=overwrite, priority=priority)
+
         self.dl.start(
             download_handle,
             setter,
@@ -563,18 +1521,56 @@ class Catcher:
             expected_size=db_entry.get("length"),
             timeout=self.timeout,
             headers=self.headers,
+            resumed=self.resumed,
+            segments=self.download_segments,
+            segment_threshold=self.download_segment_threshold,
+            priority=priority,
+            host=urlsplit(url).netloc,
+            key=key,
         )
 
         return db_entry
 
+    def should_retry(self, episode: Episode) -> bool:
+        """Returns False if the download of `episode` failed permanently, failed too often
+        or failed too recently to try again.
+        """
+
+        failures = episode.get("failures", 0)
+        if not failures:
+            return True
+
+        if episode.get("permanent") or failures >= self.max_failures:
+            return False
+
+        return now() >= self.retry_policy.next_run(failures, episode["failed"])
+
+    def _download_failed(self, cast_uid: str, episode_uid: str, status: Exception) -> None:
+        with self._cast_locked(cast_uid):
+            episode = self.episode(cast_uid, episode_uid)
+            if episode is None:  # removed in the meantime
+                return
+
+            episode["failures"] = episode.get("failures", 0) + 1
+            episode["failed"] = now()
+            episode["error"] = str(status)
+            episode["permanent"] = not self.retry_policy.is_transient(status)
+            self._changed(cast_uid, episode_uid)
+
     def download_items(self, force: bool = False, overwrite: bool = False) -> List[Tuple[str, str]]:
         """Asynchronously downloads all items. Returns a list of items which were not queued for download."""
 
         ignored: List[Tuple[str, str]] = []
 
-        for cast_uid, feed in self.db.items():
-            for episode_uid in feed["items"]:
-                if not self.download_item(cast_uid, episode_uid, force, overwrite):
-                    ignored.append((cast_uid, episode_uid))
+        with self.lock.read():
+            keys = [(cast_uid, episode_uid) for cast_uid, feed in self.db.items() for episode_uid in feed["items"]]
+
+        for cast_uid, episode_uid in keys:
+            try:
+                queued = self.download_item(cast_uid, episode_uid, force, overwrite, PRIORITY_BULK)
+            except KeyError:  # removed in the meantime
+                queued = None
+            if not queued:
+                ignored.append((cast_uid, episode_uid))
 
         return ignored
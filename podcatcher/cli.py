@@ -1,46 +1,62 @@
 """This is the CLI entrypoint to PodCatcher"""
 
 import logging
-import time
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from typing import TYPE_CHECKING
 
 from genutility.args import is_dir
-from genutility.rich import Progress
-from rich.logging import RichHandler
-from rich.progress import Progress as RichProgress
-from rich.table import Table
 
 from .catcher import Catcher
+from .events import DownloadState
+from .journal import STATE_DONE, STATE_FAILED, STATE_QUEUED, STATE_RUNNING
 from .utils import DEFAULT_APPDATA_DIR
 
+# rich is slow to import and only needed for the progress display of downloads
+if TYPE_CHECKING:
+    from genutility.rich import Progress
+    from rich.table import Table
+
+
+def make_table_for_status(state: DownloadState) -> "Table":
+    from rich.table import Table
 
-def make_table_for_status(queued, active, completed, failed) -> Table:
     grid = Table.grid(expand=True)
     grid.add_column()
-    for dl in active:
-        grid.add_row(f"Downloaded {dl[1]}/{dl[2]} of {dl[0][0]}")
-    grid.add_row(f"queued: {len(queued)}, active: {len(active)}, completed: {len(completed)}, failed: {len(failed)}")
+    for info in state.with_state(STATE_RUNNING):
+        done, total, resumed, url = info.get("done"), info.get("total"), info.get("resumed"), info.get("url")
+        if resumed:
+            grid.add_row(f"Downloaded {done}/{total} (resumed at {resumed}) of {url}")
+        else:
+            grid.add_row(f"Downloaded {done}/{total} of {url}")
+    queued, active, completed, failed = (
+        len(state.with_state(s)) for s in (STATE_QUEUED, STATE_RUNNING, STATE_DONE, STATE_FAILED)
+    )
+    grid.add_row(f"queued: {queued}, active: {active}, completed: {completed}, failed: {failed}")
     return grid
 
 
-def wait_for_downloads(c: Catcher, progress: Progress, poll: float = 1.0) -> None:
-    while True:
-        queued, active, completed, failed = c.get_download_status()
-        grid = make_table_for_status(queued, active, completed, failed)
-        progress.set_epilog(grid)
+def wait_for_downloads(c: Catcher, progress: "Progress", timeout: float = 1.0) -> None:
+    state = DownloadState()
+    subscription = c.subscribe()
 
-        if not queued and not active:
-            progress.print("completed")
-            for _url, localname, length in completed:
-                progress.print(f"DONE {localname} {length}")
-            progress.print("failed")
-            for status, (url, _localname, _length) in failed:
-                progress.print(f"FAILED {url} {status}")
+    try:
+        while True:
+            for event in subscription.get(timeout):
+                state.apply(event)
 
-            break
+            progress.set_epilog(make_table_for_status(state))
+            if not state.is_active():
+                break
+            progress.refresh()
+    finally:
+        c.unsubscribe(subscription)
 
-        progress.refresh()
-        time.sleep(poll)
+    progress.print("completed")
+    for info in state.with_state(STATE_DONE):
+        progress.print(f"DONE {info['localname']} {info['length']}")
+    progress.print("failed")
+    for info in state.with_state(STATE_FAILED):
+        progress.print(f"FAILED {info.get('url')} {info['reason']}")
 
     progress.set_epilog()
 
@@ -56,9 +72,12 @@ def main():
     parser.add_argument("--url", help="Feed URL")
     parser.add_argument("--title", help="Feed title")
     parser.add_argument("--appdata-dir", type=is_dir, default=DEFAULT_APPDATA_DIR, help="Path to appdata directory")
+    parser.add_argument("--force", action="store_true", help="Refresh all feeds, even if they are not due yet")
     parser.add_argument("-v", "--verbose", action="store_true")
     args = parser.parse_args()
 
+    from rich.logging import RichHandler
+
     handler = RichHandler(log_time_format="%Y-%m-%d %H-%M-%S%Z")
     FORMAT = "%(message)s"
 
@@ -68,14 +87,27 @@ def main():
         logging.basicConfig(level=logging.INFO, format=FORMAT, handlers=[handler])
 
     c = Catcher(args.appdata_dir)
+
+    if args.action == "update-feed-url":
+        # only changes casts.json, so the feeds database isn't loaded
+        if not args.url or not args.title:
+            parser.error("update-feed-url requires --url and --title")
+        c.update_feed_url(args.title, args.url)
+        c.save_roaming()
+        return
+
     feeds_updated = c.load_feeds()
 
     if args.action == "download":
+        from genutility.rich import Progress
+        from rich.progress import Progress as RichProgress
+
         if not feeds_updated:
-            c.update_feeds()
+            c.update_feeds(args.force)
             feeds_updated = True
         with RichProgress(auto_refresh=False) as p:
             progress = Progress(p)
+            c.resume_downloads()
             c.download_items()
             wait_for_downloads(c, progress)
             c.save_local()
@@ -103,14 +135,9 @@ def main():
 
     elif args.action == "update-feeds":
         if not feeds_updated:
-            c.update_feeds()
+            c.update_feeds(args.force)
             feeds_updated = True
 
-    elif args.action == "update-feed-url":
-        if not args.url or not args.title:
-            parser.error("update-feed-url requires --url and --title")
-        c.update_feed_url(args.title, args.url)
-
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,753 @@
+"""HTTP downloads of episode files.
+
+Unfinished downloads are kept as partial files and resumed with range requests.
+"""
+
+import bisect
+import concurrent.futures
+import errno
+import heapq
+import itertools
+import logging
+import os
+import os.path
+import random
+import re
+import socket
+import ssl
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from email.message import Message
+from functools import partial
+from typing import Any, Callable, DefaultDict, Dict, Hashable, List, Optional, Sequence, Tuple
+from urllib.error import HTTPError, URLError
+
+from genutility.concurrency import TaskT
+from genutility.file import copyfilelike
+from genutility.filesystem import safe_filename
+from genutility.http import ContentInvalidLength, DownloadInterrupted, TimeOut, URLRequest, parsedate_to_timestamp
+from genutility.iter import first_not_none
+from genutility.url import get_filename_from_url
+
+logger = logging.getLogger(__name__)
+
+ETAG_SUFFIX = ".etag"  # sidecar file of partial downloads which stores the ETag used to validate resumes
+
+EntryT = Tuple[int, int, Optional[str], Optional[Hashable], TaskT, int]  # -priority, seq, host, key, task, attempt
+
+contentrangep = re.compile(r"bytes ([0-9]+)-([0-9]+)/([0-9]+|\*)")
+
+
+def predict_filename(url: str, filename: Optional[str], fn_prio: Sequence[int]) -> Optional[str]:
+    """Returns the filename `download()` will use, if it doesn't depend on the response.
+    See `download()` for the meaning of `fn_prio`.
+    """
+
+    known = {0: filename, 3: get_filename_from_url(url)}
+    for prio in fn_prio:
+        try:
+            candidate = known[prio]
+        except KeyError:
+            return None  # depends on the response headers or redirects
+        if candidate is not None:
+            return safe_filename(candidate) or None
+
+    return None
+
+
+def response_filename(url: str, r: URLRequest, filename: Optional[str], fn_prio: Sequence[int]) -> str:
+    filenames_ = {
+        0: filename,
+        1: r.headers.get_filename(),
+        2: get_filename_from_url(r.response.geturl()),  # url after redirect
+        3: get_filename_from_url(url),
+    }
+    filename = first_not_none(filenames_[p] for p in fn_prio)
+    if not filename:
+        raise ValueError("Please provide a filename")
+
+    return safe_filename(filename)
+
+
+def get_content_length(headers: Message) -> Optional[int]:
+    try:
+        return int(headers["Content-Length"])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def get_content_range(headers: Message) -> Optional[Tuple[int, int, Optional[int]]]:
+    """Returns start, end (inclusive) and total size of a `Content-Range` header."""
+
+    m = contentrangep.fullmatch((headers.get("Content-Range") or "").strip())
+    if m:
+        start, end, size = m.groups()
+        return int(start), int(end), None if size == "*" else int(size)
+    return None
+
+
+def get_range_start(headers: Message) -> Optional[int]:
+    content_range = get_content_range(headers)
+    if content_range:
+        return content_range[0]
+    return None
+
+
+def read_partial(tmppath: str) -> Tuple[int, Optional[str]]:
+    """Returns the size of the partial file at `tmppath` and its ETag."""
+
+    try:
+        size = os.stat(tmppath).st_size
+        with open(tmppath + ETAG_SUFFIX, encoding="utf-8") as fr:
+            return size, fr.read().strip() or None
+    except FileNotFoundError:
+        return 0, None
+
+
+def write_partial_etag(tmppath: str, etag: Optional[str]) -> None:
+    # weak validators cannot be used with If-Range
+    if etag and not etag.startswith("W/"):
+        with open(tmppath + ETAG_SUFFIX, "w", encoding="utf-8") as fw:
+            fw.write(etag)
+    else:
+        remove_file(tmppath + ETAG_SUFFIX)
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def download(
+    url: str,
+    basepath: str,
+    filename: Optional[str] = None,
+    fn_prio: Optional[Sequence[int]] = None,
+    overwrite: bool = False,
+    suffix: str = ".partial",
+    report: Optional[Callable[[int, int], None]] = None,
+    timeout: float = 5 * 60,
+    headers: Optional[Dict[str, str]] = None,
+    context: Optional[ssl.SSLContext] = None,
+    resumed: Optional[Callable[[int], None]] = None,
+) -> Tuple[Optional[int], str]:
+    """Downloads `url` to directory `basepath` and returns the file size and the filename.
+
+    The filename is chosen in order of `fn_prio` from 0: `filename`, 1: the Content-Disposition header,
+    2: the url after redirects, 3: `url`.
+    The file is written to `filename + suffix` first. If the download is interrupted, a later call resumes
+    from the partial file using a range request validated with `If-Range` against the ETag of the first response.
+    If the server ignores the range, the file is downloaded completely again.
+    `resumed` is called with the number of bytes which didn't have to be transferred again.
+    """
+
+    if fn_prio is None:
+        fn_prio = (0, 1, 2, 3)
+
+    request_headers = dict(headers or {})
+    offset = 0
+    tmppath: Optional[str] = None
+
+    predicted = predict_filename(url, filename, fn_prio)
+    if predicted:
+        fullpath = os.path.join(basepath, predicted)
+        if not overwrite and os.path.exists(fullpath):
+            raise FileExistsError(errno.EEXIST, "File already exists", fullpath)
+
+        tmppath = fullpath + suffix
+        offset, etag = read_partial(tmppath)
+        if offset and etag:
+            request_headers["Range"] = f"bytes={offset}-"
+            request_headers["If-Range"] = etag
+        else:
+            offset = 0
+
+    try:
+        r = URLRequest(url, request_headers, timeout, context)
+    except HTTPError as e:
+        if e.code == 416 and offset and tmppath:
+            logger.info("Range of partial file %s not satisfiable, starting again", tmppath)
+            remove_file(tmppath)
+            remove_file(tmppath + ETAG_SUFFIX)
+            return download(
+                url, basepath, filename, fn_prio, overwrite, suffix, report, timeout, headers, context, resumed
+            )
+        raise
+
+    with r:
+        if offset:
+            if r.response.status != 206:
+                logger.info("Server ignored range request for <%s>, downloading complete file", url)
+                offset = 0
+            elif get_range_start(r.headers) != offset:
+                raise DownloadInterrupted(f"Server returned an unexpected range: {r.headers.get('Content-Range')}")
+            else:
+                logger.info("Resuming download of <%s> at byte %d", url, offset)
+
+        if predicted:
+            filename = predicted
+        else:
+            filename = response_filename(url, r, filename, fn_prio)
+            fullpath = os.path.join(basepath, filename)
+            if not overwrite and os.path.exists(fullpath):
+                raise FileExistsError(errno.EEXIST, "File already exists", fullpath)
+            tmppath = fullpath + suffix
+
+        assert tmppath is not None  # nosec
+
+        os.makedirs(basepath, exist_ok=True)
+
+        content_length = get_content_length(r.headers)
+        total = None if content_length is None else offset + content_length
+
+        if not offset:
+            write_partial_etag(tmppath, r.headers.get("ETag"))
+
+        if resumed:
+            resumed(offset)
+
+        def _report(done: int, size: int) -> None:
+            if report:
+                report(offset + done, offset + size)
+
+        try:
+            with open(tmppath, "ab" if offset else "wb") as out:
+                transferred = copyfilelike(r.response, out, content_length, report=_report)
+        except (socket.timeout, URLError):
+            logger.warning("Timeout after %ss at %s", timeout, r.response.geturl())
+            raise TimeOut(f"Timed out after {timeout}s", response=r.response)
+        except ConnectionResetError as e:
+            logger.warning("Connection was reset during download: %s", e)
+            raise DownloadInterrupted("Connection was reset during download")
+
+        if content_length is not None and content_length != transferred:
+            raise ContentInvalidLength(tmppath, total, offset + transferred)
+
+        last_modified = r.headers.get("Last-Modified")
+        if last_modified:
+            try:
+                mtime = parsedate_to_timestamp(last_modified)
+                os.utime(tmppath, (mtime, mtime))
+            except (TypeError, ValueError):
+                pass
+
+    os.replace(tmppath, fullpath)
+    remove_file(tmppath + ETAG_SUFFIX)
+
+    return total, filename
+
+
+def split_ranges(size: int, segments: int) -> List[Tuple[int, int]]:
+    """Splits `size` bytes into `segments` ranges of (start, end) with inclusive end."""
+
+    step = -(-size // segments)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def download_segment(
+    url: str,
+    tmppath: str,
+    start: int,
+    end: int,
+    validator: str,
+    report: Callable[[int], None],
+    timeout: float,
+    headers: Dict[str, str],
+    context: Optional[ssl.SSLContext],
+) -> int:
+    """Downloads bytes `start` to `end` (inclusive) of `url` into the same range of the existing file `tmppath`."""
+
+    request_headers = dict(headers)
+    request_headers["Range"] = f"bytes={start}-{end}"
+    request_headers["If-Range"] = validator
+
+    with URLRequest(url, request_headers, timeout, context) as r:
+        if r.response.status != 206 or get_range_start(r.headers) != start:
+            raise DownloadInterrupted(f"Server didn't return range {start}-{end} of <{url}>")
+
+        try:
+            with open(tmppath, "r+b") as out:
+                out.seek(start)
+                transferred = copyfilelike(r.response, out, end - start + 1, report=lambda done, total: report(done))
+        except (socket.timeout, URLError):
+            raise TimeOut(f"Timed out after {timeout}s", response=r.response)
+        except ConnectionResetError:
+            raise DownloadInterrupted("Connection was reset during download")
+
+    report(transferred)  # `copyfilelike` only reports before each chunk
+    return transferred
+
+
+def download_segmented(
+    url: str,
+    basepath: str,
+    filename: Optional[str] = None,
+    fn_prio: Optional[Sequence[int]] = None,
+    overwrite: bool = False,
+    suffix: str = ".partial",
+    report: Optional[Callable[[int, int], None]] = None,
+    timeout: float = 5 * 60,
+    headers: Optional[Dict[str, str]] = None,
+    context: Optional[ssl.SSLContext] = None,
+    resumed: Optional[Callable[[int], None]] = None,
+    segments: int = 4,
+    threshold: int = 100 * 1024 * 1024,
+) -> Tuple[Optional[int], str]:
+    """Like `download()`, but files larger than `threshold` bytes are split into `segments` byte ranges
+    which are downloaded concurrently into the partial file.
+    Falls back to `download()` for smaller files or if the server doesn't support validated range requests.
+    Segmented downloads are not resumed, an interrupted download starts again.
+    """
+
+    if fn_prio is None:
+        fn_prio = (0, 1, 2, 3)
+
+    headers = dict(headers or {})
+    probe_headers = dict(headers)
+    probe_headers["Range"] = "bytes=0-0"
+
+    with URLRequest(url, probe_headers, timeout, context) as r:
+        content_range = get_content_range(r.headers) if r.response.status == 206 else None
+        etag = r.headers.get("ETag")
+        size = content_range[2] if content_range else None
+
+        if size is None or size < threshold or not etag or etag.startswith("W/"):
+            r.response.close()
+            return download(
+                url, basepath, filename, fn_prio, overwrite, suffix, report, timeout, headers, context, resumed
+            )
+
+        filename = predict_filename(url, filename, fn_prio) or response_filename(url, r, filename, fn_prio)
+
+    fullpath = os.path.join(basepath, filename)
+    if not overwrite and os.path.exists(fullpath):
+        raise FileExistsError(errno.EEXIST, "File already exists", fullpath)
+
+    tmppath = fullpath + suffix
+    os.makedirs(basepath, exist_ok=True)
+
+    # the partial file of a segmented download has holes, so it must not be resumed by `download()`
+    remove_file(tmppath + ETAG_SUFFIX)
+    with open(tmppath, "wb") as fw:
+        fw.truncate(size)
+
+    ranges = split_ranges(size, segments)
+    progress = [0] * len(ranges)
+    lock = threading.Lock()
+
+    if resumed:
+        resumed(0)
+
+    def _report(i: int, done: int) -> None:
+        with lock:
+            progress[i] = done
+            if report:
+                report(sum(progress), size)
+
+    logger.info("Downloading <%s> in %d segments", url, len(ranges))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(
+                download_segment, url, tmppath, start, end, etag, partial(_report, i), timeout, headers, context
+            )
+            for i, (start, end) in enumerate(ranges)
+        ]
+        transferred = sum(future.result() for future in futures)
+
+    if transferred != size:
+        raise ContentInvalidLength(tmppath, size, transferred)
+
+    os.replace(tmppath, fullpath)
+
+    return size, filename
+
+
+class TokenBucket:
+    """Limits throughput to `rate` units per second with bursts of up to `capacity` units."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: float) -> None:
+        """Blocks until `amount` tokens are available. Amounts larger than the capacity are borrowed
+        and paid back by waiting, so callers can consume whole chunks at once.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_retry_after(status: Exception) -> Optional[float]:
+    """Returns the seconds to wait according to the `Retry-After` header of a HTTP error response."""
+
+    headers = getattr(status, "headers", None)
+    if not isinstance(status, HTTPError) or headers is None:
+        return None
+
+    value = (headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+
+    if value.isdigit():
+        return float(value)
+
+    try:
+        return max(0.0, parsedate_to_timestamp(value) - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Decides if and when failed downloads are retried.
+
+    Transient failures (timeouts, truncated transfers, connection errors and HTTP 408, 425, 429 and 5xx)
+    are retried up to `attempts` times in total with exponential backoff and random jitter, starting at `delay`
+    seconds and limited to `max_delay` seconds. A `Retry-After` header is honored, unless it asks to wait longer
+    than `max_delay`. All other failures, like HTTP 404, are permanent.
+
+    Downloads which failed in earlier runs are retried after `run_delay`, doubled for every further failure
+    up to `max_run_delay`.
+    """
+
+    TRANSIENT_CODES = (408, 425, 429)
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        delay: float = 10.0,
+        max_delay: float = 600.0,
+        factor: float = 2.0,
+        jitter: float = 0.5,
+        run_delay: timedelta = timedelta(hours=1),
+        max_run_delay: timedelta = timedelta(days=7),
+    ) -> None:
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.run_delay = run_delay
+        self.max_run_delay = max_run_delay
+
+    @classmethod
+    def is_transient(cls, status: Exception) -> bool:
+        if isinstance(status, HTTPError):  # must be checked before `URLError`
+            return status.code in cls.TRANSIENT_CODES or status.code >= 500
+        elif isinstance(status, (ContentInvalidLength, DownloadInterrupted, TimeOut, socket.timeout, ConnectionError)):
+            return True
+        elif isinstance(status, URLError):
+            return isinstance(status.reason, OSError)  # otherwise the url is invalid
+        return False
+
+    def backoff(self, attempt: int) -> float:
+        """Returns the seconds to wait after `attempt` failed attempts."""
+
+        delay = min(self.delay * self.factor ** (attempt - 1), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)  # nosec
+
+    def retry_delay(self, attempt: int, status: Exception) -> Optional[float]:
+        """Returns the seconds to wait before the next attempt after `attempt` failed attempts,
+        or None if the download shouldn't be retried.
+        """
+
+        if attempt >= self.attempts or not self.is_transient(status):
+            return None
+
+        delay = self.backoff(attempt)
+        retry_after = get_retry_after(status)
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                return None
+            delay = max(delay, retry_after)
+
+        return delay
+
+    def next_run(self, failures: int, failed: datetime) -> datetime:
+        """Returns the time after which a download which failed `failures` times, the last time at `failed`,
+        should be tried again.
+        """
+
+        return failed + min(self.run_delay * self.factor ** (failures - 1), self.max_run_delay)
+
+
+class DownloadListener:
+    """Listener interface of `DownloadScheduler`. `key` is the identifier passed to `DownloadScheduler.start()`."""
+
+    def queued(self, key: Any, task: TaskT) -> None:
+        pass
+
+    def started(self, key: Any) -> None:
+        pass
+
+    def progress(self, key: Any, done: int, total: int) -> None:
+        pass
+
+    def retrying(self, key: Any, status: Exception, delay: float) -> None:
+        pass
+
+    def finished(self, key: Any, status: Optional[Exception], ret: Any) -> None:
+        pass
+
+
+class DownloadScheduler:
+    """Thread pool for download tasks with the same interface as `genutility.concurrency.ProgressThreadPool`.
+
+    At most `concurrent` tasks run at the same time and at most `per_host` tasks for the same host.
+    Waiting tasks with higher priority are started first. Optionally the bandwidth in bytes per second
+    is limited globally (`bandwidth`) and per host (`host_bandwidth`). The limits are applied
+    in the progress reports of the tasks, which are called between the chunks of a transfer.
+
+    Tasks which fail are retried according to `retry_policy` (if given). They are delayed without
+    blocking a worker.
+
+    Listeners can be added to observe the tasks, see `DownloadListener`.
+    """
+
+    completed: List[Any]
+    failed: List[Tuple[Exception, Any]]
+
+    def __init__(
+        self,
+        concurrent: int = 1,
+        per_host: Optional[int] = None,
+        bandwidth: Optional[float] = None,
+        host_bandwidth: Optional[float] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        self.per_host = per_host
+        self.retry_policy = retry_policy
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth else None
+        self.host_bandwidth = host_bandwidth
+        self.host_buckets: Dict[str, TokenBucket] = {}
+
+        self.cond = threading.Condition()
+        self.waiting: List[EntryT] = []  # sorted by -priority, seq
+        self.delayed: List[Tuple[float, EntryT]] = []  # heap of retries by monotonic time
+        self.counter = itertools.count()
+        self.host_running: DefaultDict[Optional[str], int] = defaultdict(int)
+        self.running: Dict[int, List[Any]] = {}  # worker index -> [task, done, total]
+        self.stopping = False
+
+        self.completed = []
+        self.failed = []
+        self.lock = threading.Lock()
+        self.listeners: List[Any] = []
+
+        self.workers = [threading.Thread(target=self._work, args=(i,), daemon=True) for i in range(concurrent)]
+        for w in self.workers:
+            w.start()
+
+    def stop(self) -> None:
+        """Workers exit after all waiting tasks are done. Retries which are delayed are dropped,
+        listeners were notified about them with `retrying` and can queue them again after a restart.
+        """
+
+        with self.cond:
+            self.stopping = True
+            self.delayed.clear()
+            self.cond.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Returns True if all workers were terminated, otherwise False"""
+
+        for worker in self.workers:
+            worker.join(timeout)
+
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+
+        return len(self.workers) == 0
+
+    def add_listener(self, listener: Any) -> None:
+        self.listeners.append(listener)
+
+    def _notify(self, event: str, *args: Any) -> None:
+        for listener in self.listeners:
+            method = getattr(listener, event, None)
+            if method is None:
+                continue
+            try:
+                method(*args)
+            except Exception:
+                logger.exception("Download listener %s failed", event)
+
+    def start(
+        self,
+        callable: Callable,
+        *args: Any,
+        priority: int = 0,
+        host: Optional[str] = None,
+        key: Optional[Hashable] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Queues `callable(report, *args, **kwargs)`. `host` is used for the per-host limits
+        and `key` identifies the task for listeners.
+        """
+
+        task = (callable, args, kwargs)
+        with self.cond:
+            bisect.insort(self.waiting, (-priority, next(self.counter), host, key, task, 1))
+            self.cond.notify()
+        self._notify("queued", key, task)
+
+    def _next_task(self) -> Optional[EntryT]:
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _due, entry = heapq.heappop(self.delayed)
+            bisect.insort(self.waiting, entry)
+
+        for i, entry in enumerate(self.waiting):
+            host = entry[2]
+            if self.per_host is None or host is None or self.host_running[host] < self.per_host:
+                del self.waiting[i]
+                return entry
+        return None
+
+    def _retry(self, entry: EntryT, status: Exception) -> bool:
+        """Delays `entry` for another attempt, if the retry policy allows it."""
+
+        if self.retry_policy is None:
+            return False
+
+        priority, _seq, host, key, task, attempt = entry
+        delay = self.retry_policy.retry_delay(attempt, status)
+        if delay is None:
+            return False
+
+        logger.info("Attempt %d of task %s failed (%s), retrying in %.1fs", attempt, key, status, delay)
+        with self.cond:
+            if not self.stopping:  # see `stop()`
+                retry = (priority, next(self.counter), host, key, task, attempt + 1)
+                heapq.heappush(self.delayed, (time.monotonic() + delay, retry))
+                self.cond.notify()
+        self._notify("retrying", key, status, delay)
+        return True
+
+    def _host_bucket(self, host: Optional[str]) -> Optional[TokenBucket]:
+        if not self.host_bandwidth or host is None:
+            return None
+
+        with self.lock:
+            try:
+                return self.host_buckets[host]
+            except KeyError:
+                bucket = self.host_buckets[host] = TokenBucket(self.host_bandwidth)
+                return bucket
+
+    def _work(self, index: int) -> None:
+        while True:
+            with self.cond:
+                while True:
+                    entry = self._next_task()
+                    if entry is not None:
+                        break
+                    if self.stopping and not self.waiting and not self.delayed:
+                        return
+                    if self.delayed:
+                        self.cond.wait(self.delayed[0][0] - time.monotonic())
+                    else:
+                        self.cond.wait()
+
+                _priority, _seq, host, key, task, _attempt = entry
+                self.host_running[host] += 1
+                state = self.running[index] = [task, None, None]
+
+            self._notify("started", key)
+            report = self._reporter(key, state, self._host_bucket(host))
+            func, args, kwargs = task
+            try:
+                result = func(report, *args, **kwargs)
+            except Exception:
+                logger.exception("Task failed")
+                result = None
+
+            with self.cond:
+                self.host_running[host] -= 1
+                del self.running[index]
+                self.cond.notify_all()
+
+            if result is not None:
+                _setter, status, ret = result
+                if status is not None and self._retry(entry, status):
+                    continue
+
+            self.finalize(result)
+            if result is not None:
+                self._notify("finished", key, status, ret)
+
+    def _reporter(
+        self, key: Optional[Hashable], state: List[Any], host_bucket: Optional[TokenBucket]
+    ) -> Callable[[int, int], None]:
+        buckets = [bucket for bucket in (self.bandwidth, host_bucket) if bucket is not None]
+        # the first report is sent before any data is transferred. Resumed downloads start at the offset
+        # of their partial file, which must not be charged to the bandwidth limits.
+        last: List[Optional[int]] = [None]
+        lock = threading.Lock()  # segmented downloads report from multiple threads
+
+        def report(done: int, total: int) -> None:
+            with lock:
+                delta = 0 if last[0] is None else done - last[0]
+                last[0] = done
+                state[1] = done
+                state[2] = total
+
+            if self.listeners:
+                self._notify("progress", key, done, total)
+
+            if delta > 0:
+                for bucket in buckets:
+                    bucket.consume(delta)
+
+        return report
+
+    def finalize(self, result: Optional[Tuple[Callable, Optional[Exception], Any]]) -> None:
+        if result is not None:
+            setter, status, ret = result
+            with self.lock:
+                if status:
+                    self.failed.append((status, ret))
+                else:
+                    self.completed.append(ret)
+                    setter(ret)
+
+    def clear_completed(self) -> None:
+        with self.lock:
+            self.completed = []
+
+    def cancel_pending(self) -> None:
+        with self.cond:
+            self.waiting.clear()
+            self.delayed.clear()
+
+    def get_waiting(self) -> List[TaskT]:
+        """Returns the waiting tasks, including the ones delayed for another attempt."""
+
+        with self.cond:
+            entries = self.waiting + [entry for _due, entry in sorted(self.delayed)]
+        return [task for _priority, _seq, _host, _key, task, _attempt in entries]
+
+    def get_completed(self) -> List[Any]:
+        return self.completed
+
+    def get_failed(self) -> List[Tuple[Exception, Any]]:
+        return self.failed
+
+    def get_running(self) -> List[Tuple[TaskT, int, int]]:
+        with self.cond:
+            states = list(self.running.values())
+        return [(task, done, total) for task, done, total in states if done and total]
@@ -0,0 +1,103 @@
+"""Compact episodes of the feeds database `Catcher.db`.
+
+The long-running web process keeps all episodes in memory. `Episode` stores the known fields in slots
+instead of a dict per episode and interns the strings which repeat across episodes. It's a mutable mapping,
+so it's used like the episode dicts of the database files, and `dict(episode)` converts it back.
+"""
+
+import sys
+from typing import Any, Dict, Iterator, MutableMapping
+
+# unset slots are missing keys
+FIELDS = (
+    "title",
+    "date",
+    "duration",
+    "href",
+    "length",
+    "mimetype",
+    "fingerprint",
+    "localname",
+    "listened",
+    "failures",
+    "failed",
+    "error",
+    "permanent",
+)
+FIELD_SET = frozenset(FIELDS)
+INTERNED_FIELDS = frozenset(("mimetype", "error"))
+
+
+class Episode(MutableMapping[str, Any]):
+    """Episode with the keys of `FIELDS` stored in slots. Other keys are stored in a dict,
+    which is only created when needed.
+    """
+
+    __slots__ = FIELDS + ("_extra",)
+
+    _extra: Dict[str, Any]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            if key in FIELD_SET:
+                return getattr(self, key)
+            return self._extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in FIELD_SET:
+            if key in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            try:
+                self._extra[key] = value
+            except AttributeError:
+                self._extra = {key: value}
+
+    def __delitem__(self, key: str) -> None:
+        try:
+            if key in FIELD_SET:
+                delattr(self, key)
+            else:
+                del self._extra[key]
+                if not self._extra:
+                    del self._extra
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: object) -> bool:
+        if key in FIELD_SET:
+            return hasattr(self, key)
+        return key in getattr(self, "_extra", ())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in FIELD_SET:
+            return getattr(self, key, default)
+        return getattr(self, "_extra", {}).get(key, default)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in FIELDS:
+            if hasattr(self, key):
+                yield key
+        yield from getattr(self, "_extra", ())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Episode({dict(self)!r})"
+
+
+def compact_episodes(db: Dict[str, Any]) -> None:
+    """Converts the episode dicts of the database `db` to `Episode`s in place."""
+
+    for cast in db.values():
+        cast["items"] = {
+            episode_uid: episode if isinstance(episode, Episode) else Episode(episode)
+            for episode_uid, episode in cast["items"].items()
+        }
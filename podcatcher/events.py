@@ -0,0 +1,201 @@
+"""Publishes changes of the download queue to subscribers, for example the event stream of the web app.
+
+Events are dicts with a "type" key. Downloads are identified by their "cast" and "episode" uids.
+
+- "snapshot": the current state of all downloads in "downloads", sent first to every subscriber
+- "queued", "started", "retrying", "completed" and "failed": state changes of a single download
+- "progress": the latest "done", "total" and "resumed" bytes of all downloads which made progress, in "downloads"
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from .downloader import DownloadListener
+from .journal import ACTIVE_STATES, STATE_DONE, STATE_FAILED, STATE_QUEUED, STATE_RUNNING
+
+KeyT = Tuple[str, str]  # cast_uid, episode_uid
+EventT = Dict[str, Any]
+
+EVENT_STATES = {
+    "queued": STATE_QUEUED,
+    "started": STATE_RUNNING,
+    "retrying": STATE_QUEUED,
+    "completed": STATE_DONE,
+    "failed": STATE_FAILED,
+}
+
+
+class DownloadState:
+    """The state of all downloads, built from events. Used by the publisher and can be used by subscribers
+    to mirror it.
+    """
+
+    def __init__(self) -> None:
+        self.downloads: Dict[KeyT, Dict[str, Any]] = {}
+
+    def apply(self, event: EventT) -> None:
+        type_ = event["type"]
+        if type_ == "snapshot":
+            self.downloads = {(info["cast"], info["episode"]): dict(info) for info in event["downloads"]}
+        elif type_ == "progress":
+            for info in event["downloads"]:
+                self._get(info).update(info)
+        else:
+            download = self._get(event)
+            download.update((k, v) for k, v in event.items() if k != "type")
+            download["state"] = EVENT_STATES[type_]
+
+    def _get(self, info: Dict[str, Any]) -> Dict[str, Any]:
+        key = (info["cast"], info["episode"])
+        try:
+            return self.downloads[key]
+        except KeyError:
+            download = self.downloads[key] = {"cast": key[0], "episode": key[1], "state": STATE_QUEUED}
+            return download
+
+    def with_state(self, *states: str) -> List[Dict[str, Any]]:
+        return [info for info in self.downloads.values() if info["state"] in states]
+
+    def is_active(self) -> bool:
+        return any(info["state"] in ACTIVE_STATES for info in self.downloads.values())
+
+    def snapshot(self) -> EventT:
+        return {"type": "snapshot", "downloads": [dict(info) for info in self.downloads.values()]}
+
+
+class Subscription:
+    """Queue of events for a single subscriber. If the subscriber falls behind by more than `maxsize` events,
+    the queued events are replaced by a snapshot.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.events: Deque[EventT] = deque()
+        self.cond = threading.Condition()
+
+    def put(self, event: EventT) -> bool:
+        """Returns False if the queue is full."""
+
+        with self.cond:
+            if len(self.events) >= self.maxsize:
+                return False
+            self.events.append(event)
+            self.cond.notify()
+        return True
+
+    def reset(self, snapshot: EventT) -> None:
+        with self.cond:
+            self.events.clear()
+            self.events.append(snapshot)
+            self.cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> List[EventT]:
+        """Waits up to `timeout` seconds for events and returns all queued events."""
+
+        with self.cond:
+            if not self.events:
+                self.cond.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+
+class DownloadEvents(DownloadListener):
+    """Turns the callbacks of `DownloadScheduler` into events for subscribers.
+    Progress is sent at most every `progress_interval` seconds, for all downloads at once.
+    `resumed` maps the urls of running downloads to the number of bytes resumed from partial files.
+    """
+
+    def __init__(
+        self, progress_interval: float = 1.0, resumed: Optional[Dict[str, int]] = None, maxsize: int = 1000
+    ) -> None:
+        self.progress_interval = progress_interval
+        self.resumed = resumed if resumed is not None else {}
+        self.maxsize = maxsize
+        self.state = DownloadState()
+        self.subscriptions: Set[Subscription] = set()
+        self.lock = threading.Lock()
+        self.progress_pending: Dict[KeyT, Dict[str, Any]] = {}
+        self.progress_sent = 0.0
+
+    def subscribe(self) -> Subscription:
+        """Returns a new subscription. Its first event is a snapshot of the current state."""
+
+        subscription = Subscription(self.maxsize)
+        with self.lock:
+            subscription.put(self.state.snapshot())
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def _publish(self, event: EventT) -> None:
+        """Must be called with `self.lock` held."""
+
+        self.state.apply(event)
+        for subscription in self.subscriptions:
+            if not subscription.put(event):
+                subscription.reset(self.state.snapshot())
+
+    def publish(self, event: EventT) -> None:
+        with self.lock:
+            self._publish(event)
+
+    def _flush_progress(self) -> None:
+        """Must be called with `self.lock` held."""
+
+        if self.progress_pending:
+            self._publish({"type": "progress", "downloads": list(self.progress_pending.values())})
+            self.progress_pending = {}
+        self.progress_sent = time.monotonic()
+
+    # listener interface of `DownloadScheduler`
+
+    def queued(self, key: Optional[KeyT], task: Any) -> None:
+        if key is None:
+            return
+
+        _callable, args, kwargs = task
+        url = args[1] if len(args) > 1 else None  # see `Catcher.download_item()`
+        self.publish({"type": "queued", "cast": key[0], "episode": key[1], "url": url, "done": 0, "total": None})
+
+    def started(self, key: Optional[KeyT]) -> None:
+        if key is not None:
+            self.publish({"type": "started", "cast": key[0], "episode": key[1]})
+
+    def progress(self, key: Optional[KeyT], done: int, total: int) -> None:
+        if key is None:
+            return
+
+        with self.lock:
+            url = self.state.downloads.get(key, {}).get("url", "")
+            self.progress_pending[key] = {
+                "cast": key[0],
+                "episode": key[1],
+                "done": done,
+                "total": total,
+                "resumed": self.resumed.get(url, 0),
+            }
+            if time.monotonic() - self.progress_sent >= self.progress_interval:
+                self._flush_progress()
+
+    def retrying(self, key: Optional[KeyT], status: Exception, delay: float) -> None:
+        if key is not None:
+            self.publish({"type": "retrying", "cast": key[0], "episode": key[1], "reason": str(status), "delay": delay})
+
+    def finished(self, key: Optional[KeyT], status: Optional[Exception], ret: Any) -> None:
+        if key is None:
+            return
+
+        _url, localname, length = ret
+        with self.lock:
+            self.progress_pending.pop(key, None)
+            if status is None:
+                event = {"type": "completed", "localname": localname, "length": length}
+            else:
+                event = {"type": "failed", "reason": str(status)}
+            self._publish({**event, "cast": key[0], "episode": key[1]})
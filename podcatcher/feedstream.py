@@ -0,0 +1,236 @@
+"""Incremental parsing of RSS and Atom feeds.
+
+`feedparser` needs the complete document and builds a tree of all its entries. `FeedStreamParser` is fed the
+document while it's downloaded and only keeps the current entry in memory. Entries which are known and unchanged
+are skipped, and as feeds list their newest entries first, parsing stops after `stop_after` of them in a row.
+
+Entries use the same keys as feedparser's, so `get_episode_uid()`, `get_entry_fingerprint()` and
+`normalize_entry()` work for both parsers. Unlike feedparser, HTML in descriptions isn't sanitized
+and documents which aren't well-formed XML raise `ParseError`.
+"""
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+# expat doesn't resolve external entities and limits entity expansion since 2.4.1
+from xml.etree.ElementTree import Element, XMLPullParser  # nosec B405
+
+if TYPE_CHECKING:
+    from feedparser import FeedParserDict
+
+DEFAULT_STOP_AFTER = 3  # known and unchanged entries in a row
+
+NS_ATOM = "http://www.w3.org/2005/Atom"
+NS_RSS1 = "http://purl.org/rss/1.0/"
+NS_RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+NS_DC = "http://purl.org/dc/elements/1.1/"
+NS_ITUNES = "http://www.itunes.com/dtds/podcast-1.0.dtd"
+NS_SY = "http://purl.org/rss/1.0/modules/syndication/"
+
+TagT = Tuple[str, str]  # namespace, local name
+
+ROOTS = {("", "rss"), (NS_RDF, "RDF"), (NS_ATOM, "feed")}
+CHANNELS = {("", "channel"), (NS_RSS1, "channel")}
+ITEMS = {("", "item"), (NS_RSS1, "item"), (NS_ATOM, "entry")}
+
+# element -> feedparser key, the first occurrence wins
+FEED_FIELDS: Dict[TagT, str] = {
+    ("", "title"): "title",
+    (NS_RSS1, "title"): "title",
+    (NS_ATOM, "title"): "title",
+    ("", "pubDate"): "published",
+    ("", "lastBuildDate"): "updated",
+    (NS_ATOM, "updated"): "updated",
+    (NS_DC, "date"): "updated",
+    ("", "ttl"): "ttl",
+    (NS_SY, "updatePeriod"): "sy_updateperiod",
+    (NS_SY, "updateFrequency"): "sy_updatefrequency",
+}
+
+ENTRY_FIELDS: Dict[TagT, str] = {
+    ("", "title"): "title",
+    (NS_RSS1, "title"): "title",
+    (NS_ATOM, "title"): "title",
+    ("", "guid"): "id",
+    (NS_ATOM, "id"): "id",
+    ("", "pubDate"): "published",
+    (NS_ATOM, "published"): "published",
+    (NS_ATOM, "updated"): "updated",
+    (NS_DC, "date"): "updated",
+    ("", "description"): "summary",
+    (NS_RSS1, "description"): "summary",
+    (NS_ATOM, "summary"): "summary",
+    (NS_ITUNES, "duration"): "itunes_duration",
+}
+
+# only used if the preferred element is missing
+ENTRY_FALLBACK_FIELDS: Dict[TagT, str] = {
+    (NS_ITUNES, "summary"): "summary",
+}
+
+
+class UnsupportedFeed(Exception):
+    pass
+
+
+def split_tag(tag: str) -> TagT:
+    if tag.startswith("{"):
+        namespace, _, name = tag[1:].partition("}")
+        return namespace, name
+    return "", tag
+
+
+def _text(elem: Element) -> str:
+    return (elem.text or "").strip()
+
+
+def parse_entry(elem: Element) -> "FeedParserDict":
+    """Converts an RSS `<item>` or Atom `<entry>` element to a feedparser entry."""
+
+    from feedparser import FeedParserDict
+
+    entry = FeedParserDict()
+    fallback: Dict[str, str] = {}
+    links = []
+    guidislink = False
+
+    for child in elem:
+        tag = split_tag(child.tag)
+        namespace, name = tag
+
+        if name == "link" and namespace in ("", NS_RSS1, NS_ATOM):
+            href = child.get("href")
+            if href is None:  # RSS
+                entry.setdefault("link", _text(child))
+                continue
+            rel = child.get("rel", "alternate")
+            link = {"rel": rel, "type": child.get("type"), "href": href}
+            if rel == "enclosure":
+                link["length"] = child.get("length")
+            elif rel == "alternate":
+                entry.setdefault("link", href)
+            links.append(link)
+        elif tag == ("", "enclosure"):
+            links.append(
+                {"rel": "enclosure", "type": child.get("type"), "href": child.get("url"), "length": child.get("length")}
+            )
+        elif tag in ENTRY_FIELDS:
+            key = ENTRY_FIELDS[tag]
+            if key not in entry:
+                entry[key] = _text(child)
+                if tag == ("", "guid"):
+                    guidislink = child.get("isPermaLink", "true").lower() != "false"
+        elif tag in ENTRY_FALLBACK_FIELDS:
+            fallback.setdefault(ENTRY_FALLBACK_FIELDS[tag], _text(child))
+
+    for key, value in fallback.items():
+        entry.setdefault(key, value)
+
+    # like feedparser, permalink guids are used as link
+    if guidislink and "link" not in entry:
+        entry["link"] = entry["id"]
+
+    # feedparser derives `entry.enclosures` from the links
+    entry["links"] = links
+    return entry
+
+
+class FeedStreamParser:
+    """Incremental feed parser. Call `feed()` with the data of the document until `done` is True or all data
+    was fed, then `close()` to get the result.
+
+    `unchanged(entry)` returns True for entries which are known and unchanged. Those entries are not included in
+    the result, but counted as "skipped". The result is "complete" unless parsing stopped early,
+    in which case feed level elements after the last parsed entry are missing as well.
+    """
+
+    def __init__(
+        self, unchanged: Optional[Callable[["FeedParserDict"], bool]] = None, stop_after: int = DEFAULT_STOP_AFTER
+    ) -> None:
+        from feedparser import FeedParserDict
+
+        self.unchanged = unchanged
+        self.stop_after = stop_after
+        self.done = False
+
+        self._parser: XMLPullParser = XMLPullParser(events=("start", "end"))
+        self._stack: List[Element] = []
+        self._container: Optional[Element] = None  # element with the feed level elements
+        self._feed = FeedParserDict()
+        self._skiphours: Optional[List[int]] = None
+        self._entries: List["FeedParserDict"] = []
+        self._skipped = 0
+        self._unchanged_run = 0
+
+    def feed(self, data: bytes) -> None:
+        self._parser.feed(data)
+        for event, elem in self._parser.read_events():  # type: ignore[misc]
+            if self.done:
+                break
+            if not isinstance(elem, Element):  # only start and end events are requested
+                continue
+            if event == "start":
+                self._start(elem)
+            else:
+                self._end(elem)
+
+    def _start(self, elem: Element) -> None:
+        tag = split_tag(elem.tag)
+        depth = len(self._stack)
+        self._stack.append(elem)
+
+        if depth == 0:
+            if tag not in ROOTS:
+                raise UnsupportedFeed(f"Unknown root element: {elem.tag}")
+            if tag == (NS_ATOM, "feed"):
+                self._container = elem
+        elif depth == 1 and tag in CHANNELS:
+            self._container = elem
+
+    def _end(self, elem: Element) -> None:
+        self._stack.pop()
+        if not self._stack:
+            return
+
+        parent = self._stack[-1]
+        tag = split_tag(elem.tag)
+
+        if tag in ITEMS:
+            self._entry(parse_entry(elem))
+        elif parent is self._container:
+            if tag in FEED_FIELDS:
+                self._feed.setdefault(FEED_FIELDS[tag], _text(elem))
+            elif tag == ("", "skipHours"):
+                self._skiphours = sorted({int(_text(hour)) % 24 for hour in elem if _text(hour).isdigit()})
+        else:
+            return
+
+        # processed elements are not needed anymore
+        parent.remove(elem)
+
+    def _entry(self, entry: "FeedParserDict") -> None:
+        if self.unchanged is not None and self.unchanged(entry):
+            self._skipped += 1
+            self._unchanged_run += 1
+            if self._unchanged_run >= self.stop_after:
+                self.done = True
+        else:
+            self._unchanged_run = 0
+            self._entries.append(entry)
+
+    def close(self) -> "FeedParserDict":
+        """Returns the parsed feed in the format of `feedparser.parse()`, with the additional keys
+        "complete" and "skipped". "skiphours" is only included if the feed specifies them.
+        """
+
+        complete = not self.done
+        if complete:
+            self._parser.close()  # raises if the document is truncated
+            if self._container is None:
+                raise UnsupportedFeed("Feed doesn't contain a channel")
+
+        result = type(self._feed)(
+            feed=self._feed, entries=self._entries, bozo=False, complete=complete, skipped=self._skipped
+        )
+        if self._skiphours is not None:
+            result["skiphours"] = self._skiphours
+        return result
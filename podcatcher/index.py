@@ -0,0 +1,149 @@
+"""Date ordered index of the episodes in the feeds database `Catcher.db`.
+
+The index is kept up to date incrementally, so episode lists can be paginated without sorting
+all episodes again for every page.
+"""
+
+import base64
+import bisect
+import json
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+EntryT = Tuple[float, str, str]  # timestamp, cast_uid, episode_uid
+PageT = Tuple[List[Tuple[str, str]], Optional[str]]  # (cast_uid, episode_uid) pairs, cursor of the next page
+
+NO_DATE = float("-inf")  # episodes without a date are sorted first
+
+
+def encode_cursor(entry: EntryT) -> str:
+    timestamp, cast_uid, episode_uid = entry
+    data = json.dumps([None if timestamp == NO_DATE else timestamp, cast_uid, episode_uid], ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> EntryT:
+    """Raises ValueError for invalid cursors."""
+
+    try:
+        timestamp, cast_uid, episode_uid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (NO_DATE if timestamp is None else float(timestamp), str(cast_uid), str(episode_uid))
+    except (TypeError, ValueError) as e:  # binascii.Error and JSONDecodeError are ValueErrors
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class EpisodeIndex:
+    """Sorted lists of the episodes of all casts and of every single cast.
+
+    Pages are addressed by cursors which point to the last episode of the previous page,
+    so they stay valid when episodes are added or removed in the meantime.
+    """
+
+    def __init__(self) -> None:
+        self.entries: List[EntryT] = []
+        self.cast_entries: Dict[str, List[EntryT]] = {}
+        self.keys: Dict[Tuple[str, str], EntryT] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _entry(cast_uid: str, episode_uid: str, date: Optional[datetime]) -> EntryT:
+        # the cast uid is shared by all entries of the cast
+        return (NO_DATE if date is None else date.timestamp(), sys.intern(cast_uid), episode_uid)
+
+    def build(self, db: Mapping[str, Any]) -> None:
+        """Indexes all episodes of `db`."""
+
+        self.build_dates(
+            (cast_uid, ((episode_uid, episode.get("date")) for episode_uid, episode in cast["items"].items()))
+            for cast_uid, cast in db.items()
+        )
+
+    def build_dates(self, casts: Iterable[Tuple[str, Iterable[Tuple[str, Optional[datetime]]]]]) -> None:
+        """Indexes the episodes given as `(cast_uid, [(episode_uid, date), ...])`, so casts which were
+        not loaded can be indexed from the dates stored by the storage engine.
+        """
+
+        keys: Dict[Tuple[str, str], EntryT] = {}
+        cast_entries: Dict[str, List[EntryT]] = {}
+        for cast_uid, dates in casts:
+            entries = [self._entry(cast_uid, episode_uid, date) for episode_uid, date in dates]
+            entries.sort()
+            cast_entries[cast_uid] = entries
+            keys.update(((cast_uid, entry[2]), entry) for entry in entries)
+
+        with self.lock:
+            self.keys = keys
+            self.cast_entries = cast_entries
+            self.entries = sorted(keys.values())
+
+    def _insert(self, entry: EntryT) -> None:
+        bisect.insort(self.entries, entry)
+        bisect.insort(self.cast_entries.setdefault(entry[1], []), entry)
+        self.keys[(entry[1], entry[2])] = entry
+
+    def _remove(self, entry: EntryT) -> None:
+        del self.entries[bisect.bisect_left(self.entries, entry)]
+        entries = self.cast_entries[entry[1]]
+        del entries[bisect.bisect_left(entries, entry)]
+        del self.keys[(entry[1], entry[2])]
+
+    def update(self, db: Mapping[str, Any], cast_uid: str, episode_uid: Optional[str] = None) -> None:
+        """Updates the index with the current state of the episode (or the cast, if `episode_uid` is None) in `db`."""
+
+        cast = db.get(cast_uid)
+
+        with self.lock:
+            if episode_uid is None:
+                if cast is None and cast_uid in self.cast_entries:  # cast was removed
+                    for entry in self.cast_entries.pop(cast_uid):
+                        del self.keys[(cast_uid, entry[2])]
+                    self.entries = [entry for entry in self.entries if entry[1] != cast_uid]
+                return
+
+            old = self.keys.get((cast_uid, episode_uid))
+            episode = None if cast is None else cast["items"].get(episode_uid)
+            new = None if episode is None else self._entry(cast_uid, episode_uid, episode.get("date"))
+
+            if old == new:
+                return
+            if old is not None:
+                self._remove(old)
+            if new is not None:
+                self._insert(new)
+
+    def count(self, cast_uid: Optional[str] = None) -> int:
+        with self.lock:
+            if cast_uid is None:
+                return len(self.entries)
+            return len(self.cast_entries.get(cast_uid, []))
+
+    def page(
+        self, cast_uid: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100, descending: bool = True
+    ) -> PageT:
+        """Returns up to `limit` episodes (of `cast_uid` or of all casts) after `cursor` in date order
+        and the cursor of the next page, which is None for the last page.
+        """
+
+        after = None if cursor is None else decode_cursor(cursor)
+
+        with self.lock:
+            if cast_uid is None:
+                entries = self.entries
+            else:
+                entries = self.cast_entries.get(cast_uid, [])
+
+            if descending:
+                end = len(entries) if after is None else bisect.bisect_left(entries, after)
+                start = max(0, end - limit)
+                selected = entries[start:end][::-1]
+                more = start > 0
+            else:
+                start = 0 if after is None else bisect.bisect_right(entries, after)
+                end = start + limit
+                selected = entries[start:end]
+                more = end < len(entries)
+
+        next_cursor = encode_cursor(selected[-1]) if more and selected else None
+        return [(entry[1], entry[2]) for entry in selected], next_cursor
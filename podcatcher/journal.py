@@ -0,0 +1,168 @@
+"""Crash-safe journal of the download queue.
+
+Every state change of a download is appended as a json line and flushed to disk, so the queue
+and finished downloads survive a crash of the process. The journal is compacted after the
+feeds database was saved.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, TextIO, Tuple
+
+from .downloader import DownloadListener
+
+logger = logging.getLogger(__name__)
+
+KeyT = Tuple[str, str]  # cast_uid, episode_uid
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+ACTIVE_STATES = (STATE_QUEUED, STATE_RUNNING)
+FINISHED_STATES = (STATE_DONE, STATE_FAILED)
+
+
+class DownloadJournal(DownloadListener):
+    """Append-only log of download states. Implements the listener interface of `DownloadScheduler`."""
+
+    def __init__(self, path: Path, progress_interval: float = 5.0) -> None:
+        self.path = path
+        self.progress_interval = progress_interval
+        self.items: Dict[KeyT, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.last_progress: Dict[KeyT, float] = {}
+        self.seq = 0
+        self.finished_seq: Dict[KeyT, int] = {}
+        self.active: Set[KeyT] = set()  # downloads queued or running in this process
+        self.fp: Optional[TextIO] = None
+
+    def load(self) -> Dict[KeyT, Dict[str, Any]]:
+        """Replays the journal and returns the latest state of every download."""
+
+        items: Dict[KeyT, Dict[str, Any]] = {}
+        try:
+            with open(self.path, encoding="utf-8") as fr:
+                for line in fr:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # the last line can be truncated after a crash
+                        logger.warning("Skipping invalid journal line: %r", line)
+                        continue
+                    key = (record.pop("cast"), record.pop("episode"))
+                    items.setdefault(key, {}).update(record)
+        except FileNotFoundError:
+            pass
+
+        with self.lock:
+            self.items = items
+            self.finished_seq = {key: 0 for key, info in items.items() if info.get("state") in FINISHED_STATES}
+        return items
+
+    def _append(self, key: KeyT, info: Dict[str, Any]) -> None:
+        """Must be called with `self.lock` held."""
+
+        self.items.setdefault(key, {}).update(info)
+        self.seq += 1
+        state = info.get("state")
+        if state in FINISHED_STATES:
+            self.finished_seq[key] = self.seq
+        if state in ACTIVE_STATES:
+            self.active.add(key)
+        elif state is not None:
+            self.active.discard(key)
+
+        fp = self.fp
+        if fp is None:
+            fp = self.fp = open(self.path, "a", encoding="utf-8")
+        fp.write(json.dumps({"cast": key[0], "episode": key[1], **info}, ensure_ascii=False) + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    def record(self, key: KeyT, state: str, **info: Any) -> None:
+        with self.lock:
+            self._append(key, {"state": state, **info})
+
+    def is_active(self, key: KeyT) -> bool:
+        """Returns True if the download was queued by this process and didn't finish yet."""
+
+        with self.lock:
+            return key in self.active
+
+    def mark(self) -> int:
+        """Returns the position of the last record. Used as argument to `compact()`."""
+
+        with self.lock:
+            return self.seq
+
+    def compact(self, mark: int) -> None:
+        """Rewrites the journal without the downloads which finished or failed before `mark`.
+        Should only be called after the feeds database which contains these downloads was saved.
+        Failures are stored in the episodes of the database as well.
+        """
+
+        with self.lock:
+            for key, seq in list(self.finished_seq.items()):
+                if seq <= mark and self.items.get(key, {}).get("state") in FINISHED_STATES:
+                    del self.items[key]
+                    del self.finished_seq[key]
+
+            tmppath = self.path.with_name(self.path.name + ".tmp")
+            with open(tmppath, "w", encoding="utf-8") as fw:
+                for (cast_uid, episode_uid), info in self.items.items():
+                    fw.write(json.dumps({"cast": cast_uid, "episode": episode_uid, **info}, ensure_ascii=False) + "\n")
+                fw.flush()
+                os.fsync(fw.fileno())
+
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+            os.replace(tmppath, self.path)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+
+    # listener interface of `DownloadScheduler`
+
+    def queued(self, key: Optional[KeyT], task: Any) -> None:
+        pass  # recorded by `Catcher.download_item()` which knows the download options
+
+    def started(self, key: Optional[KeyT]) -> None:
+        if key is not None:
+            self.record(key, STATE_RUNNING)
+
+    def progress(self, key: Optional[KeyT], done: int, total: int) -> None:
+        if key is None:
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_progress.get(key, 0.0) < self.progress_interval:
+                return
+            self.last_progress[key] = now
+            self._append(key, {"state": STATE_RUNNING, "done": done, "total": total})
+
+    def retrying(self, key: Optional[KeyT], status: Exception, delay: float) -> None:
+        if key is not None:
+            self.record(key, STATE_QUEUED, reason=str(status))
+
+    def finished(self, key: Optional[KeyT], status: Optional[Exception], ret: Any) -> None:
+        if key is None:
+            return
+
+        with self.lock:
+            self.last_progress.pop(key, None)
+
+        _url, localname, length = ret
+        if status is None:
+            self.record(key, STATE_DONE, localname=localname, length=length)
+        else:
+            self.record(key, STATE_FAILED, reason=str(status))
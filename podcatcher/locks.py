@@ -0,0 +1,97 @@
+"""Locks which allow concurrent readers of the feeds database `Catcher.db`."""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, Optional
+
+
+class RWLock:
+    """Readers-writer lock. Many threads can hold the read lock at the same time, the write lock is exclusive.
+
+    Both locks are reentrant and the thread which holds the write lock can acquire the read lock as well.
+    Upgrading a read lock to a write lock is not possible. Waiting writers block new readers,
+    so writers don't starve.
+    """
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer: Optional[int] = None
+        self.writer_depth = 0
+        self.writers_waiting = 0
+        self.local = threading.local()
+
+    def _read_depth(self) -> int:
+        return getattr(self.local, "depth", 0)
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        depth = self._read_depth()
+        if depth or self.writer == threading.get_ident():
+            self.local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self.local.depth = depth
+            return
+
+        with self.cond:
+            while self.writer is not None or self.writers_waiting:
+                self.cond.wait()
+            self.readers += 1
+
+        self.local.depth = 1
+        try:
+            yield
+        finally:
+            self.local.depth = 0
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        ident = threading.get_ident()
+        if self.writer == ident:
+            self.writer_depth += 1
+            try:
+                yield
+            finally:
+                self.writer_depth -= 1
+            return
+
+        if self._read_depth():
+            raise RuntimeError("Cannot upgrade a read lock to a write lock")
+
+        with self.cond:
+            self.writers_waiting += 1
+            try:
+                while self.writer is not None or self.readers:
+                    self.cond.wait()
+            finally:
+                self.writers_waiting -= 1
+            self.writer = ident
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer = None
+                self.cond.notify_all()
+
+
+class KeyLocks:
+    """Reentrant locks created on demand for every key, for example one per cast."""
+
+    def __init__(self) -> None:
+        self.locks: Dict[Hashable, threading.RLock] = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key: Hashable) -> threading.RLock:
+        with self.lock:
+            try:
+                return self.locks[key]
+            except KeyError:
+                lock = self.locks[key] = threading.RLock()
+                return lock
@@ -0,0 +1,261 @@
+"""Serving of downloaded episodes to media players, which request many byte ranges while seeking."""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from flask import Request, Response
+from werkzeug.http import quote_header_value
+
+BUFFER_SIZE = 64 * 1024
+MAX_RANGES = 16  # requests for more ranges get the complete file
+DEFAULT_MAX_AGE = 24 * 60 * 60  # seconds
+
+RangeT = Tuple[int, int]  # start, stop (exclusive)
+
+
+class MediaFile(NamedTuple):
+    path: Path
+    mimetype: Optional[str]
+
+
+class PathCache:
+    """Least recently used cache of the files of episodes. Entries expire after `ttl` seconds,
+    so changes to the database are picked up eventually even if `invalidate()` isn't called.
+    Episodes without a file are not cached. Files which were deleted, possibly by another process
+    which doesn't share this cache, are resolved again.
+    """
+
+    def __init__(
+        self, resolve: Callable[[Hashable], Optional[MediaFile]], ttl: float = 60.0, maxsize: int = 1024
+    ) -> None:
+        self.resolve = resolve
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Hashable, Tuple[float, Optional[MediaFile]]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[MediaFile]:
+        now = time.monotonic()
+        with self.lock:
+            try:
+                expires, media = self.entries[key]
+            except KeyError:
+                media = None
+            else:
+                if expires > now and media is not None and media.path.is_file():
+                    self.entries.move_to_end(key)
+                    return media
+                del self.entries[key]
+
+        media = self.resolve(key)
+        if media is None:
+            return None
+
+        with self.lock:
+            self.entries[key] = (now + self.ttl, media)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return media
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class FileRange:
+    """File-like object for `length` bytes of the file `fp` starting at `start`.
+
+    It's passed to `wsgi.file_wrapper`. Servers which support zero-copy transfers, like gunicorn, use `fileno()`
+    with the current file position and the Content-Length of the response. Other servers call `read()`.
+    """
+
+    def __init__(self, fp: Any, start: int, length: int) -> None:
+        self.fp = fp
+        self.remaining = length
+        fp.seek(start)
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.fp.fileno()
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+def iter_file_range(fp: Any, start: int, length: int) -> Iterator[bytes]:
+    reader = FileRange(fp, start, length)
+    while True:
+        data = reader.read(BUFFER_SIZE)
+        if not data:
+            break
+        yield data
+
+
+def parse_ranges(header: str, size: int) -> Optional[List[RangeT]]:
+    """Parses the byte ranges of a Range header for a file of `size` bytes. Unsatisfiable ranges are dropped,
+    overlapping ranges are merged. Returns None if the header is invalid.
+    Unlike `werkzeug.http.parse_range_header()` unordered and overlapping ranges are accepted.
+    """
+
+    units, _, specs = header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+
+    specs_list = specs.split(",")
+    if len(specs_list) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs_list:
+        first, sep, last = spec.strip().partition("-")
+        if not sep or not (first.isdigit() or last.isdigit()) or (first and not first.isdigit()):
+            return None
+        if last and not last.isdigit():
+            return None
+
+        if not first:  # suffix range
+            start = max(size - int(last), 0)
+            stop = size
+        else:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+            if last and int(last) < start:
+                return None
+        if start < stop:
+            ranges.append((start, stop))
+
+    merged: List[RangeT] = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def content_disposition(filename: str) -> str:
+    """Returns a Content-Disposition header which lets browsers play the file instead of downloading it."""
+
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        return f"inline; filename*=UTF-8''{quote(filename)}"
+    return f"inline; filename={quote_header_value(filename)}"
+
+
+def _is_fresh(request: Request, etag: str, mtime: int) -> bool:
+    """Returns True if the client has the current version of the file."""
+
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return int(request.if_modified_since.timestamp()) >= mtime
+    return False
+
+
+def _if_range_matches(request: Request, etag: str, mtime: int) -> bool:
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(if_range.date.timestamp()) >= mtime
+    return True  # no If-Range header
+
+
+def send_media(request: Request, media: MediaFile, max_age: int = DEFAULT_MAX_AGE) -> Response:
+    """Sends `media` with support for conditional and (multiple) range requests.
+    Raises FileNotFoundError if the file doesn't exist.
+    """
+
+    fp = open(media.path, "rb")
+    try:
+        stat = os.fstat(fp.fileno())
+        size = stat.st_size
+        mtime = int(stat.st_mtime)
+        etag = f"{size:x}-{stat.st_mtime_ns:x}"
+        mimetype = media.mimetype or "application/octet-stream"
+
+        headers: Dict[str, str] = {
+            "ETag": quote_header_value(etag),
+            "Last-Modified": formatdate(mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"private, max-age={max_age}",
+            "Content-Disposition": content_disposition(media.path.name),
+        }
+
+        if _is_fresh(request, etag, mtime):
+            fp.close()
+            return Response(status=304, headers=headers)
+
+        range_header = request.headers.get("Range")
+        if range_header and _if_range_matches(request, etag, mtime):
+            ranges = parse_ranges(range_header, size)
+        else:
+            ranges = None
+
+        if ranges == []:
+            fp.close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+        if ranges is None or len(ranges) == 1:
+            start, stop = ranges[0] if ranges else (0, size)
+            file_wrapper = request.environ.get("wsgi.file_wrapper")
+            if file_wrapper is not None:
+                body = file_wrapper(FileRange(fp, start, stop - start), BUFFER_SIZE)
+            else:
+                body = iter_file_range(fp, start, stop - start)
+            response = Response(body, headers=headers, content_type=mimetype, direct_passthrough=True)
+            response.call_on_close(fp.close)
+            response.content_length = stop - start
+            if ranges:
+                response.status_code = 206
+                response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            return response
+
+        return _multipart_response(fp, ranges, size, mimetype, headers)
+    except BaseException:
+        fp.close()
+        raise
+
+
+def _multipart_response(fp: Any, ranges: List[RangeT], size: int, mimetype: str, headers: Dict[str, str]) -> Response:
+    boundary = os.urandom(16).hex()
+    parts = [
+        (
+            f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+        ).encode("ascii")
+        for start, stop in ranges
+    ]
+    end = f"\r\n--{boundary}--\r\n".encode("ascii")
+    length = sum(len(part) for part in parts) + sum(stop - start for start, stop in ranges) + len(end)
+
+    def generate() -> Iterator[bytes]:
+        for part, (start, stop) in zip(parts, ranges):
+            yield part
+            yield from iter_file_range(fp, start, stop - start)
+        yield end
+
+    response = Response(
+        generate(),
+        status=206,
+        headers=headers,
+        content_type=f"multipart/byteranges; boundary={boundary}",
+        direct_passthrough=True,
+    )
+    response.call_on_close(fp.close)
+    response.content_length = length
+    return response
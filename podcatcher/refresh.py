@@ -0,0 +1,308 @@
+"""Asyncio based feed fetching with global and per-host concurrency limits.
+
+The HTTP requests themselves are made with `http.client` in a thread pool. Connections are kept alive
+and reused for further feeds on the same host.
+
+`RefreshWorker` runs refreshes in a background thread.
+"""
+
+import concurrent.futures
+import gzip
+import logging
+import socket
+import ssl
+import threading
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from http.client import HTTPConnection, HTTPException, HTTPMessage, HTTPSConnection, IncompleteRead, InvalidURL
+from typing import TYPE_CHECKING, Any, Callable, DefaultDict, Dict, List, Optional, Tuple, TypeVar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from genutility.datetime import now
+from genutility.http import ContentInvalidLength
+
+if TYPE_CHECKING:
+    import asyncio  # only imported for async refreshes
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_REFRESH_CONCURRENCY = 10
+DEFAULT_REFRESH_CONCURRENCY_PER_HOST = 2
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+HostT = Tuple[str, str]  # scheme, netloc
+ResponseT = Tuple[str, int, HTTPMessage, bytes]  # final url, status, headers, body
+
+
+class ConnectionPool:
+    """Thread-safe pool of idle keep-alive connections per host."""
+
+    def __init__(self, timeout: float, context: Optional[ssl.SSLContext] = None, maxsize: int = 2) -> None:
+        self.timeout = timeout
+        self.context = context
+        self.maxsize = maxsize
+        self.idle: DefaultDict[HostT, List[HTTPConnection]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def acquire(self, host: HostT) -> Tuple[HTTPConnection, bool]:
+        """Returns a connection to `host` and whether it was reused."""
+
+        with self.lock:
+            connections = self.idle[host]
+            if connections:
+                return connections.pop(), True
+
+        scheme, netloc = host
+        if scheme == "https":
+            return HTTPSConnection(netloc, timeout=self.timeout, context=self.context), False
+        elif scheme == "http":
+            return HTTPConnection(netloc, timeout=self.timeout), False
+        else:
+            raise InvalidURL(f"Unsupported URL scheme: {scheme}")
+
+    def release(self, host: HostT, conn: HTTPConnection) -> None:
+        with self.lock:
+            connections = self.idle[host]
+            if len(connections) < self.maxsize:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self.lock:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+            self.idle.clear()
+
+
+def decode_body(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    elif encoding == "deflate":
+        return zlib.decompress(body)
+    return body
+
+
+class AsyncFeedFetcher:
+    """Fetches feeds concurrently. At most `concurrency` requests are made at the same time
+    and at most `per_host` to the same host.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_REFRESH_CONCURRENCY,
+        per_host: int = DEFAULT_REFRESH_CONCURRENCY_PER_HOST,
+        timeout: float = 60,
+        headers: Optional[Dict[str, str]] = None,
+        context: Optional[ssl.SSLContext] = None,
+        max_redirects: int = 5,
+    ) -> None:
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.headers = headers or {}
+        self.max_redirects = max_redirects
+
+        self.pool = ConnectionPool(timeout, context, maxsize=per_host)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.limit: Optional["asyncio.Semaphore"] = None
+        self.host_limits: Dict[str, "asyncio.Semaphore"] = {}
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.pool.close()
+
+    async def run_in_executor(self, func: Callable[..., T], *args: Any) -> T:
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _host_limit(self, netloc: str) -> "asyncio.Semaphore":
+        import asyncio
+
+        try:
+            return self.host_limits[netloc]
+        except KeyError:
+            host_limit = self.host_limits[netloc] = asyncio.Semaphore(self.per_host)
+            return host_limit
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None) -> ResponseT:
+        """Fetches `url` and returns the final url after redirects, the status code, the response headers
+        and the decoded body. Raises `HTTPError` for error status codes.
+        Every redirect is requested within the limits of its own host.
+        """
+
+        import asyncio
+
+        # semaphores must be created inside the running event loop for Python < 3.10
+        if self.limit is None:
+            self.limit = asyncio.Semaphore(self.concurrency)
+
+        headers = {**self.headers, **(headers or {})}
+        headers.setdefault("Accept-Encoding", "gzip, deflate")
+
+        for _ in range(self.max_redirects + 1):
+            async with self._host_limit(urlsplit(url).netloc), self.limit:
+                status, reason, msg, body = await self.run_in_executor(self._fetch, url, headers)
+
+            if status in REDIRECT_CODES and msg.get("Location"):
+                url = urljoin(url, msg["Location"])
+                continue
+
+            if status >= 400:
+                raise HTTPError(url, status, reason, msg, None)
+
+            return url, status, msg, body
+
+        raise URLError(f"Too many redirects: <{url}>")
+
+    def _fetch(self, url: str, headers: Dict[str, str]) -> Tuple[int, str, HTTPMessage, bytes]:
+        split = urlsplit(url)
+        path = urlunsplit(("", "", split.path or "/", split.query, ""))
+        status, reason, msg, body = self._request((split.scheme, split.netloc), path, headers)
+        if status < 300:
+            body = decode_body(body, msg.get("Content-Encoding"))
+        return status, reason, msg, body
+
+    def _request(self, host: HostT, path: str, headers: Dict[str, str]) -> Tuple[int, str, HTTPMessage, bytes]:
+        while True:
+            conn, reused = self.pool.acquire(host)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except IncompleteRead as e:
+                conn.close()
+                raise ContentInvalidLength(path, len(e.partial) + (e.expected or 0), len(e.partial))
+            except (HTTPException, ConnectionError) as e:
+                conn.close()
+                if reused:  # the server closed the idle connection, try again with a new one
+                    logger.debug("Reused connection to %s failed: %s", host[1], e)
+                    continue
+                raise URLError(e)
+            except socket.timeout:
+                conn.close()
+                raise
+            except OSError as e:
+                conn.close()
+                raise URLError(e)
+
+            if response.will_close:
+                conn.close()
+            else:
+                self.pool.release(host, conn)
+
+            return response.status, response.reason, response.msg, body
+
+
+class RefreshWorker:
+    """Runs `refresh(force, progress)` in a background thread, one refresh at a time.
+
+    Refreshes which are triggered while a refresh is running are coalesced into a single further refresh,
+    which starts when the running one finished. `progress(done, total)` should be called by `refresh`
+    for every refreshed feed, `refresh` should return a dict of statistics.
+    """
+
+    def __init__(self, refresh: Callable[[bool, Callable[[int, int], None]], Dict[str, int]]) -> None:
+        self.refresh = refresh
+        self.cond = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = False
+
+        self.requested = False  # a refresh is waiting to be started
+        self.force = False
+        self.running = False
+        self.done = 0
+        self.total = 0
+        self.started: Optional[datetime] = None
+        self.finished: Optional[datetime] = None
+        self.stats: Optional[Dict[str, int]] = None
+        self.error: Optional[str] = None
+
+    def trigger(self, force: bool = False) -> bool:
+        """Requests a refresh. Returns False if it was coalesced with an already requested refresh."""
+
+        with self.cond:
+            if self.stopping:
+                raise RuntimeError("Refresh worker was stopped")
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._work, name="refresh-worker", daemon=True)
+                self.thread.start()
+
+            coalesced = self.requested
+            self.requested = True
+            self.force = self.force or force
+            self.cond.notify()
+            return not coalesced
+
+    def status(self) -> Dict[str, Any]:
+        """Returns the progress of the running refresh and the time, statistics and error of the last one."""
+
+        with self.cond:
+            return {
+                "running": self.running,
+                "requested": self.requested,
+                "done": self.done,
+                "total": self.total,
+                "started": self.started,
+                "finished": self.finished,
+                "stats": self.stats,
+                "error": self.error,
+            }
+
+    def stop(self) -> None:
+        """The worker exits after the running and requested refreshes are done."""
+
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Returns True if the worker was terminated, otherwise False"""
+
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def _progress(self, done: int, total: int) -> None:
+        with self.cond:
+            self.done = done
+            self.total = total
+
+    def _work(self) -> None:
+        while True:
+            with self.cond:
+                while not self.requested:
+                    if self.stopping:
+                        return
+                    self.cond.wait()
+
+                force, self.force = self.force, False
+                self.requested = False
+                self.running = True
+                self.done = self.total = 0
+                self.started = now()
+
+            stats = None
+            error = None
+            try:
+                stats = self.refresh(force, self._progress)
+            except Exception as e:
+                logger.exception("Refreshing feeds failed")
+                error = str(e)
+
+            with self.cond:
+                self.running = False
+                self.finished = now()
+                self.stats = stats
+                self.error = error
+                self.cond.notify_all()
@@ -0,0 +1,119 @@
+"""Computes when a feed should be refreshed next.
+
+The interval is derived from the publisher hints (RSS `<ttl>`, `sy:updatePeriod`/`sy:updateFrequency`)
+and the observed publishing cadence of the feed. RSS `<skipHours>` are honored as well.
+"""
+
+import heapq
+import re
+import statistics
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+from genutility.string import toint
+
+if TYPE_CHECKING:
+    from feedparser import FeedParserDict
+
+UPDATE_PERIODS = {
+    "hourly": timedelta(hours=1),
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "monthly": timedelta(days=30),
+    "yearly": timedelta(days=365),
+}
+
+MAX_REFRESH_INTERVAL = timedelta(days=1)
+CADENCE_FRACTION = 0.25  # refresh this many times per observed publishing interval
+CADENCE_EPISODES = 10  # number of recent episodes used to estimate the publishing interval
+
+skiphoursp = re.compile(rb"<skipHours>(.*?)</skipHours>", re.DOTALL | re.IGNORECASE)
+hourp = re.compile(rb"<hour>\s*([0-9]{1,2})\s*</hour>", re.IGNORECASE)
+
+
+def parse_skip_hours(data: bytes) -> List[int]:
+    """Extracts the RSS `<skipHours>` from the raw feed document.
+    feedparser only keeps the last `<hour>` element, so the raw data is used instead.
+    """
+
+    m = skiphoursp.search(data)
+    if not m:
+        return []
+
+    return sorted({int(hour) % 24 for hour in hourp.findall(m.group(1))})
+
+
+def publisher_interval(feed: "FeedParserDict") -> Optional[timedelta]:
+    """Returns the minimum refresh interval requested by the publisher, if any."""
+
+    intervals = []
+
+    ttl = toint(feed.feed.get("ttl"), None)
+    if ttl:
+        intervals.append(timedelta(minutes=ttl))
+
+    period = UPDATE_PERIODS.get((feed.feed.get("sy_updateperiod") or "").strip().lower())
+    if period:
+        frequency = toint(feed.feed.get("sy_updatefrequency"), 1) or 1
+        intervals.append(period / frequency)
+
+    if not intervals:
+        return None
+
+    return max(intervals)
+
+
+def publishing_interval(dates: Iterable[Optional[datetime]], n: int = CADENCE_EPISODES) -> Optional[timedelta]:
+    """Returns the median time between the `n` most recent episodes."""
+
+    recent = heapq.nlargest(n, (date for date in dates if date is not None))
+    if len(recent) < 2:
+        return None
+
+    return timedelta(seconds=statistics.median((a - b).total_seconds() for a, b in zip(recent, recent[1:])))
+
+
+def refresh_interval(
+    minimum: timedelta,
+    publisher: Optional[timedelta] = None,
+    cadence: Optional[timedelta] = None,
+    maximum: timedelta = MAX_REFRESH_INTERVAL,
+) -> timedelta:
+    """Feeds are refreshed at a fraction of their publishing cadence, but not more often than `minimum`
+    or the interval requested by the publisher and not less often than `maximum`.
+    """
+
+    if cadence is None:
+        interval = minimum
+    else:
+        interval = min(max(cadence * CADENCE_FRACTION, minimum), max(maximum, minimum))
+
+    if publisher is not None:
+        interval = max(interval, publisher)
+
+    return interval
+
+
+def failure_interval(interval: timedelta, failures: int, maximum: timedelta = MAX_REFRESH_INTERVAL) -> timedelta:
+    """Feeds which failed to refresh `failures` times in a row back off by doubling `interval` for every failure,
+    up to `maximum` or `interval` if it is longer.
+    """
+
+    if interval >= maximum:
+        return interval
+    return min(interval * 2**failures, maximum)
+
+
+def next_due(last: datetime, interval: timedelta, skiphours: Iterable[int] = ()) -> datetime:
+    """Returns the time of the next refresh after `last`, moved out of `skiphours` (which are in GMT)."""
+
+    due = last + interval
+    skip = set(skiphours)
+
+    if len(skip) < 24:
+        due_utc = due.astimezone(timezone.utc)
+        while due_utc.hour in skip:
+            due_utc = due_utc.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        due = due_utc.astimezone(due.tzinfo)
+
+    return due
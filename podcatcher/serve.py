@@ -0,0 +1,126 @@
+"""Serves the web app with the waitress WSGI server (`pip install podcatcher[production]`).
+
+The process which starts serving owns the `Catcher`: it loads the feeds, runs the downloads and refreshes
+and is the only process which modifies the database. With more than one process, the other processes
+accept requests on the same listening socket and use the Catcher of the owner through a `multiprocessing` manager,
+so all processes see the same state.
+"""
+
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .catcher import Catcher
+from .web import DEFAULT_THREADS, create_app
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+AddressT = Tuple[str, int]
+
+_catcher: Optional[Catcher] = None  # the Catcher of the owner process
+
+
+def _get_catcher() -> Optional[Catcher]:
+    return _catcher
+
+
+class CatcherManager(BaseManager):
+    pass
+
+
+CatcherManager.register("catcher", callable=_get_catcher, method_to_typeid={"subscribe": "Subscription"})
+CatcherManager.register("Subscription", create_method=False)
+
+
+def share_catcher(catcher: Catcher) -> Tuple[AddressT, bytes]:
+    """Makes `catcher` available to other processes. Returns the address and key they need to connect,
+    see `connect_catcher()`.
+    """
+
+    global _catcher
+
+    _catcher = catcher
+    authkey = os.urandom(32)
+    server = CatcherManager(address=("127.0.0.1", 0), authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, name="catcher-manager", daemon=True).start()
+    address: AddressT = server.address  # type: ignore[assignment]
+    return address, authkey
+
+
+def connect_catcher(address: AddressT, authkey: bytes) -> Catcher:
+    """Returns a proxy of the Catcher shared by `share_catcher()`. Methods of the proxy are called in the owner
+    process, their arguments and return values are copied.
+    """
+
+    manager = CatcherManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.catcher()  # type: ignore[attr-defined]
+
+
+def _serve(app, sock: socket.socket, threads: int) -> None:
+    waitress.serve(app, sockets=[sock], threads=threads)
+
+
+def _worker(
+    appdata_dir: Path,
+    address: AddressT,
+    authkey: bytes,
+    secret_key: bytes,
+    sock: socket.socket,
+    threads: int,
+    level: int,
+) -> None:
+    logging.basicConfig(level=level)
+    app = create_app(appdata_dir, connect_catcher(address, authkey), secret_key)
+    _serve(app, sock, threads)
+
+
+def serve(
+    appdata_dir: Path, host: str = "127.0.0.1", port: int = 8000, threads: int = DEFAULT_THREADS, processes: int = 1
+) -> None:
+    """Serves the web app for `appdata_dir` on `host:port` with `threads` threads in each of `processes` processes.
+    Blocks until interrupted.
+    """
+
+    if waitress is None:
+        raise RuntimeError("Production serving requires waitress: pip install podcatcher[production]")
+
+    catcher = Catcher(appdata_dir)
+    catcher.load_feeds()
+    catcher.resume_downloads()
+
+    secret_key = os.urandom(24)  # shared, so sessions are valid in all processes
+    sock = socket.create_server((host, port))
+    workers: List[multiprocessing.process.BaseProcess] = []
+
+    try:
+        if processes > 1:
+            address, authkey = share_catcher(catcher)
+            ctx = multiprocessing.get_context("spawn")  # don't fork the download and refresh threads
+            level = logging.getLogger().getEffectiveLevel()
+            for _ in range(processes - 1):
+                worker = ctx.Process(
+                    target=_worker,
+                    args=(appdata_dir, address, authkey, secret_key, sock, threads, level),
+                    daemon=True,
+                )
+                worker.start()
+                workers.append(worker)
+            logging.info("Started %d worker processes", len(workers))
+
+        _serve(create_app(appdata_dir, catcher, secret_key), sock, threads)
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        sock.close()
+        catcher.close()
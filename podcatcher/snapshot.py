@@ -0,0 +1,330 @@
+"""Binary snapshot of the feeds database `Catcher.db`, which is read through `mmap`.
+
+Loading the json database has to rebuild every datetime and timedelta object with `BuiltinRoundtripDecoder`.
+The snapshot stores the episode fields in fixed-width rows instead: datetimes as microseconds since
+the epoch and their utc offset, timedeltas as microseconds and strings as indices into a table of unique strings.
+Opening a snapshot only decodes the cast table, the episodes of a cast are decoded when the cast is loaded.
+
+Layout (little-endian): header, cast rows, episode rows ordered by cast, string offsets, utf-8 string data.
+Values which don't fit their column and other keys are stored in a json string per episode.
+The snapshot records size and modification time of the json database it was written along with,
+so a snapshot which is out of date is ignored. Its own size and a crc32 of everything after the header
+are checked before any of the offsets are used, so truncated or corrupt snapshots are ignored as well.
+"""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from genutility.json import BuiltinRoundtripDecoder, BuiltinRoundtripEncoder
+
+MAGIC = b"PODSNAP\x00"
+VERSION = 2
+
+# magic, version, json size, json mtime, snapshot size, crc32 of the data after the header,
+# number of casts, episodes and strings, offsets of the cast rows, episode rows, string offsets and string data
+HEADER = struct.Struct("<8sIqqQIIIIQQQQ")
+CAST = struct.Struct("<IIII")  # cast uid, json of the other fields, first episode, number of episodes
+
+STR, INT, BOOL, TIMEDELTA, DATETIME = range(5)
+COLUMN_FORMATS = {STR: "I", INT: "q", BOOL: "?", TIMEDELTA: "q", DATETIME: "qi"}
+# the fields of `episode.Episode`
+COLUMNS: Dict[str, int] = {
+    "title": STR,
+    "date": DATETIME,
+    "duration": TIMEDELTA,
+    "href": STR,
+    "length": INT,
+    "mimetype": STR,
+    "fingerprint": STR,
+    "localname": STR,
+    "listened": DATETIME,
+    "failures": INT,
+    "failed": DATETIME,
+    "error": STR,
+    "permanent": BOOL,
+}
+
+# episode uid, json of the other fields, bitmask of the set columns, bitmask of the columns which are None
+EPISODE = struct.Struct("<IIII" + "".join(COLUMN_FORMATS[kind] for kind in COLUMNS.values()))
+
+# index of the first value of every column in the unpacked rows
+POSITIONS = dict(zip(COLUMNS, accumulate((len(COLUMN_FORMATS[kind]) for kind in COLUMNS.values()), initial=4)))
+DATE_BIT = 1 << list(COLUMNS).index("date")
+
+NO_STRING = 0xFFFFFFFF
+NAIVE = -(2**31)  # utc offset of naive datetimes
+INT_MIN, INT_MAX = -(2**63), 2**63 - 1
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def json_stat(json_path: Path) -> Tuple[int, int]:
+    stat = json_path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+class _Strings:
+    def __init__(self) -> None:
+        self.indices: Dict[str, int] = {}
+
+    def add(self, s: Optional[str]) -> int:
+        if s is None:
+            return NO_STRING
+        try:
+            return self.indices[s]
+        except KeyError:
+            index = self.indices[s] = len(self.indices)
+            return index
+
+
+def _dumps(obj: Dict[str, Any]) -> Optional[str]:
+    if not obj:
+        return None
+    return json.dumps(obj, ensure_ascii=False, cls=BuiltinRoundtripEncoder)
+
+
+def _encode_value(kind: int, value: Any, strings: _Strings) -> Optional[Tuple[Any, ...]]:
+    """Returns the column values or None if `value` doesn't fit the column."""
+
+    if kind == STR:
+        if isinstance(value, str):
+            return (strings.add(value),)
+    elif kind == INT:
+        if type(value) is int and INT_MIN <= value <= INT_MAX:
+            return (value,)
+    elif kind == BOOL:
+        if type(value) is bool:
+            return (value,)
+    elif kind == TIMEDELTA:
+        if isinstance(value, timedelta):
+            return (value // MICROSECOND,)
+    elif kind == DATETIME:
+        if isinstance(value, datetime):
+            offset = value.utcoffset()
+            if offset is None:
+                return ((value - EPOCH) // MICROSECOND, NAIVE)
+            elif offset % timedelta(seconds=1) == timedelta(0):
+                return ((value - EPOCH_UTC) // MICROSECOND, offset // timedelta(seconds=1))
+    return None
+
+
+def _decode_datetime(value: int, offset: int) -> datetime:
+    if offset == NAIVE:
+        return EPOCH + value * MICROSECOND
+    tz = timezone.utc if offset == 0 else timezone(timedelta(seconds=offset))
+    return (EPOCH_UTC + value * MICROSECOND).astimezone(tz)
+
+
+def _null(kind: int) -> Tuple[Any, ...]:
+    return (0, 0) if kind == DATETIME else (0,)
+
+
+def _encode_episode(episode_uid: str, episode: Dict[str, Any], strings: _Strings) -> bytes:
+    values: List[Any] = []
+    extra = {key: value for key, value in episode.items() if key not in COLUMNS}
+    present = 0
+    null = 0
+    for i, (key, kind) in enumerate(COLUMNS.items()):
+        encoded = None
+        if key in episode:
+            value = episode[key]
+            if value is None:
+                present |= 1 << i
+                null |= 1 << i
+            else:
+                encoded = _encode_value(kind, value, strings)
+                if encoded is None:
+                    extra[key] = value
+                else:
+                    present |= 1 << i
+        values.extend(_null(kind) if encoded is None else encoded)
+
+    return EPISODE.pack(strings.add(episode_uid), strings.add(_dumps(extra)), present, null, *values)
+
+
+def write_snapshot(db: Dict[str, Any], path: Path, json_path: Path) -> None:
+    """Writes `db` to `path` atomically. `json_path` is the json database which was saved with the same contents."""
+
+    strings = _Strings()
+    casts: List[bytes] = []
+    episodes: List[bytes] = []
+    for cast_uid, cast in db.items():
+        fields = {key: value for key, value in cast.items() if key != "items"}
+        casts.append(CAST.pack(strings.add(cast_uid), strings.add(_dumps(fields)), len(episodes), len(cast["items"])))
+        episodes.extend(
+            _encode_episode(episode_uid, episode, strings) for episode_uid, episode in cast["items"].items()
+        )
+
+    data = [s.encode("utf-8") for s in strings.indices]  # in index order
+    offsets = [0]
+    for b in data:
+        offsets.append(offsets[-1] + len(b))
+
+    casts_offset = HEADER.size
+    episodes_offset = casts_offset + CAST.size * len(casts)
+    string_offsets_offset = episodes_offset + EPISODE.size * len(episodes)
+    strings_offset = string_offsets_offset + 8 * len(offsets)
+
+    body = [*casts, *episodes, struct.pack(f"<{len(offsets)}Q", *offsets), *data]
+    checksum = 0
+    for b in body:
+        checksum = zlib.crc32(b, checksum)
+
+    json_size, json_mtime = json_stat(json_path)
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        json_size,
+        json_mtime,
+        strings_offset + offsets[-1],
+        checksum,
+        len(casts),
+        len(episodes),
+        len(data),
+        casts_offset,
+        episodes_offset,
+        string_offsets_offset,
+        strings_offset,
+    )
+
+    tmppath = path.with_name(path.name + ".tmp")
+    with tmppath.open("wb") as fw:
+        fw.write(header)
+        fw.writelines(body)
+        fw.flush()
+        os.fsync(fw.fileno())
+    os.replace(tmppath, path)
+
+
+class Snapshot:
+    """Read access to a snapshot written by `write_snapshot()`. Raises `SnapshotError` if the file is invalid
+    or doesn't match the json database at `json_path`.
+    """
+
+    def __init__(self, path: Path, json_path: Path) -> None:
+        with path.open("rb") as fr:
+            try:
+                self.map = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise SnapshotError(f"Invalid snapshot: {path}") from None
+
+        try:
+            self._read_header(path, json_path)
+        except SnapshotError:
+            self.map.close()
+            raise
+        except struct.error:
+            self.map.close()
+            raise SnapshotError(f"Truncated snapshot: {path}") from None
+
+    def _read_header(self, path: Path, json_path: Path) -> None:
+        (
+            magic,
+            version,
+            json_size,
+            json_mtime,
+            size,
+            checksum,
+            num_casts,
+            num_episodes,
+            self.num_strings,
+            casts_offset,
+            self.episodes_offset,
+            self.string_offsets_offset,
+            self.strings_offset,
+        ) = HEADER.unpack_from(self.map)
+
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"Invalid snapshot: {path}")
+        if (json_size, json_mtime) != json_stat(json_path):
+            raise SnapshotError(f"Snapshot {path} is older than {json_path}")
+        if len(self.map) != size:
+            raise SnapshotError(f"Truncated snapshot: {path}")
+        with memoryview(self.map) as view, view[HEADER.size :] as body:
+            if zlib.crc32(body) != checksum:
+                raise SnapshotError(f"Corrupt snapshot: {path}")
+
+        # cast uid -> first episode, number of episodes, json of the other fields
+        self.casts: Dict[str, Tuple[int, int, int]] = {}
+        for cast_uid, fields, first, count in CAST.iter_unpack(
+            self.map[casts_offset : casts_offset + CAST.size * num_casts]
+        ):
+            self.casts[self._string(cast_uid)] = (first, count, fields)
+
+    def close(self) -> None:
+        self.map.close()
+
+    def _string(self, index: int) -> str:
+        start, end = struct.unpack_from("<2Q", self.map, self.string_offsets_offset + 8 * index)
+        return self.map[self.strings_offset + start : self.strings_offset + end].decode("utf-8")
+
+    def _loads(self, index: int) -> Dict[str, Any]:
+        if index == NO_STRING:
+            return {}
+        return json.loads(self._string(index), cls=BuiltinRoundtripDecoder)
+
+    def cast_uids(self) -> List[str]:
+        return list(self.casts)
+
+    def load_cast(self, cast_uid: str) -> Dict[str, Any]:
+        first, count, fields = self.casts[cast_uid]
+        cast = self._loads(fields)
+
+        start = self.episodes_offset + EPISODE.size * first
+        cache: Dict[int, str] = {}  # strings like the mimetype repeat within a cast
+        items = {}
+        for row in EPISODE.iter_unpack(self.map[start : start + EPISODE.size * count]):
+            episode_uid, extra, present, null, *values = row
+            episode = self._loads(extra)
+            pos = 0
+            for i, (key, kind) in enumerate(COLUMNS.items()):
+                value = values[pos]
+                pos += 2 if kind == DATETIME else 1
+                if not present & (1 << i):
+                    continue
+                if null & (1 << i):
+                    episode[key] = None
+                elif kind == STR:
+                    try:
+                        episode[key] = cache[value]
+                    except KeyError:
+                        episode[key] = cache[value] = self._string(value)
+                elif kind == TIMEDELTA:
+                    episode[key] = value * MICROSECOND
+                elif kind == DATETIME:
+                    episode[key] = _decode_datetime(value, values[pos - 1])
+                else:
+                    episode[key] = value
+            items[self._string(episode_uid)] = episode
+
+        cast["items"] = items
+        return cast
+
+    def episode_dates(self, cast_uid: str) -> List[Tuple[str, Optional[datetime]]]:
+        """Returns the uids and dates of the episodes of a cast without decoding the other fields."""
+
+        first, count, _fields = self.casts[cast_uid]
+        start = self.episodes_offset + EPISODE.size * first
+        pos = POSITIONS["date"]
+        dates = []
+        for row in EPISODE.iter_unpack(self.map[start : start + EPISODE.size * count]):
+            date: Optional[datetime]
+            if row[2] & DATE_BIT:
+                date = None if row[3] & DATE_BIT else _decode_datetime(row[pos], row[pos + 1])
+            else:  # missing or in the json of the other fields
+                date = self._loads(row[1]).get("date")
+            dates.append((self._string(row[0]), date))
+        return dates
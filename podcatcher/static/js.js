@@ -22,3 +22,83 @@ $.fn.shiftSelectable = function() {
 		lastChecked = $(this);
 	});
 };
+
+$.fn.loadDescriptions = function() {
+	this.one('mouseenter', function() {
+		var $description = $(this).find('.description').first();
+
+		$.getJSON($description.data('url'), function(episode) {
+			$description.text(episode.description || '');
+		});
+	});
+};
+
+$.downloadStatus = function(url) {
+	var downloads = {},
+		scheduled = false,
+		states = {started: 'running', queued: 'queued', retrying: 'queued', completed: 'done', failed: 'failed'};
+
+	function key(info) {
+		return info.cast + '|' + info.episode;
+	}
+
+	function update(info) {
+		var k = key(info);
+		downloads[k] = $.extend(downloads[k] || {state: 'queued'}, info);
+		return downloads[k];
+	}
+
+	function describe(info) {
+		if (info.state === 'running' && info.total) {
+			var text = info.url + ' is ' + (info.done / info.total * 100).toFixed(1) + '% done';
+			if (info.resumed) {
+				text += ' (resumed at ' + (info.resumed / info.total * 100).toFixed(1) + '%)';
+			}
+			return text;
+		} else if (info.state === 'done') {
+			return info.localname;
+		} else if (info.state === 'failed') {
+			return info.url + ' (' + info.reason + ')';
+		}
+		return info.url;
+	}
+
+	function render() {
+		scheduled = false;
+		var lists = {queued: [], running: [], done: [], failed: []};
+		$.each(downloads, function(k, info) {
+			lists[info.state].push($('<li>').text(describe(info)));
+		});
+		$.each(lists, function(state, items) {
+			$('#' + state).empty().append(items);
+		});
+	}
+
+	function handle(type, apply) {
+		source.addEventListener(type, function(e) {
+			apply(JSON.parse(e.data));
+			if (!scheduled) {  // render at most once per frame
+				scheduled = true;
+				window.requestAnimationFrame(render);
+			}
+		});
+	}
+
+	var source = new EventSource(url);
+	handle('snapshot', function(event) {
+		downloads = {};
+		$.each(event.downloads, function(i, info) {
+			downloads[key(info)] = info;
+		});
+	});
+	handle('progress', function(event) {
+		$.each(event.downloads, function(i, info) {
+			update(info);
+		});
+	});
+	$.each(states, function(type, state) {
+		handle(type, function(event) {
+			update(event).state = state;
+		});
+	});
+};
@@ -0,0 +1,548 @@
+"""Storage engines for the local feeds database `Catcher.db`.
+
+The database is a dict which maps cast uids to a dict of cast information.
+The episodes of a cast are stored as a dict under the key "items". `Catcher` keeps them in memory as
+`episode.Episode` mappings, the storage engines read and write plain dicts.
+Episode descriptions are large and rarely needed, so they are stored separately and loaded on demand.
+Casts can be loaded on first access with `LazyDatabase`, using `cast_uids()` and `load_cast()` of the engines.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional, Set, Tuple
+
+from genutility.json import BuiltinRoundtripDecoder, BuiltinRoundtripEncoder, read_json, write_json
+
+from .snapshot import Snapshot, SnapshotError, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+# (cast_uid, None) marks a changed cast, (cast_uid, episode_uid) a changed episode
+ChangesT = Set[Tuple[str, Optional[str]]]
+# maps (cast_uid, episode_uid) to the new description, None removes it
+DescriptionsT = Dict[Tuple[str, str], Optional[str]]
+
+
+def split_descriptions(db: Dict[str, Any]) -> DescriptionsT:
+    """Removes the descriptions from the episodes of `db` (as stored by older versions) and returns them."""
+
+    descriptions: DescriptionsT = {}
+    for cast_uid, cast in db.items():
+        for episode_uid, episode in cast["items"].items():
+            if "description" in episode:
+                descriptions[(cast_uid, episode_uid)] = episode.pop("description")
+    return descriptions
+
+
+_roundtrip_decoder = BuiltinRoundtripDecoder()
+
+
+def decode_roundtrip(obj: Any) -> Any:
+    """Decodes the datetimes and timedeltas of json data which was decoded without `BuiltinRoundtripDecoder`."""
+
+    if isinstance(obj, dict):
+        return _roundtrip_decoder.object_hook({key: decode_roundtrip(value) for key, value in obj.items()})
+    elif isinstance(obj, list):
+        return [decode_roundtrip(value) for value in obj]
+    return obj
+
+
+class LazyDatabase(MutableMapping[str, Any]):
+    """Feeds database which loads a cast with `load(cast_uid)` when it's accessed the first time.
+    Iterating over the cast uids and membership tests don't load any casts.
+    """
+
+    def __init__(self, cast_uids: Iterable[str], load: Callable[[str], Dict[str, Any]]) -> None:
+        self.casts: Dict[str, Optional[Dict[str, Any]]] = dict.fromkeys(cast_uids)  # None if not loaded yet
+        self.load = load
+        self.lock = threading.Lock()
+
+    def __getitem__(self, cast_uid: str) -> Dict[str, Any]:
+        cast = self.casts[cast_uid]
+        if cast is None:
+            with self.lock:
+                cast = self.casts[cast_uid]
+                if cast is None:
+                    cast = self.casts[cast_uid] = self.load(cast_uid)
+        return cast
+
+    def __setitem__(self, cast_uid: str, cast: Dict[str, Any]) -> None:
+        self.casts[cast_uid] = cast
+
+    def __delitem__(self, cast_uid: str) -> None:
+        del self.casts[cast_uid]
+
+    def __contains__(self, cast_uid: object) -> bool:
+        return cast_uid in self.casts
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.casts)
+
+    def __len__(self) -> int:
+        return len(self.casts)
+
+    def loaded(self, cast_uid: str) -> bool:
+        return self.casts.get(cast_uid) is not None
+
+
+class JsonStorage:
+    """Stores the whole database in a single json file. Every save rewrites the complete file.
+    Descriptions are stored in the directory `descriptions_path` with one json file per cast. Only the file of
+    the requested cast is read when a description is requested and only the files of changed casts are written.
+    If `snapshot_path` is given, every save also writes a binary snapshot (see `snapshot.py`),
+    which is used by `cast_uids()` and `load_cast()` instead of the json file while it's up to date.
+    """
+
+    incremental = False  # `save()` needs the complete database
+
+    def __init__(
+        self, path: Path, descriptions_path: Optional[Path] = None, snapshot_path: Optional[Path] = None
+    ) -> None:
+        self.path = path
+        self.descriptions_path = descriptions_path or path.with_suffix(".descriptions")
+        self.legacy_descriptions_path = path.with_suffix(".descriptions.json")  # single file of older versions
+        self.snapshot_path = snapshot_path
+        self.descriptions_migrated = False
+        self.raw: Dict[str, Any] = {}  # casts which were not decoded by `load_cast()` yet
+        self.snapshot: Optional[Snapshot] = None
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        return read_json(self.path, cls=BuiltinRoundtripDecoder)
+
+    def _open_snapshot(self) -> Optional[Snapshot]:
+        """Must be called with `self.lock` held."""
+
+        if self.snapshot is None and self.snapshot_path is not None:
+            try:
+                self.snapshot = Snapshot(self.snapshot_path, self.path)
+            except FileNotFoundError:
+                pass
+            except SnapshotError as e:
+                logger.warning("Ignoring snapshot: %s", e)
+        return self.snapshot
+
+    def _close_snapshot(self) -> None:
+        """Must be called with `self.lock` held."""
+
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def cast_uids(self) -> List[str]:
+        with self.lock:
+            self._close_snapshot()  # the json file could have changed
+            snapshot = self._open_snapshot()
+            if snapshot is not None:
+                self.raw = {}
+                return snapshot.cast_uids()
+
+        # the json decoder is fast without the object hook, datetimes are decoded in `load_cast()`
+        raw = read_json(self.path)
+        with self.lock:
+            self.raw = raw
+        return list(raw)
+
+    def load_cast(self, cast_uid: str) -> Dict[str, Any]:
+        """Returns a cast of the database read by `cast_uids()`. The raw json of the cast is released,
+        casts which are loaded again are read from the snapshot or the json database.
+        """
+
+        with self.lock:
+            raw = self.raw.pop(cast_uid, None)
+            if raw is None:
+                return self._stored_cast(cast_uid)
+        return decode_roundtrip(raw)
+
+    def _stored_cast(self, cast_uid: str) -> Dict[str, Any]:
+        """Must be called with `self.lock` held. Decodes a stored cast without removing it.
+        Raises KeyError if the cast doesn't exist.
+        """
+
+        raw = self.raw.get(cast_uid)
+        if raw is not None:
+            return decode_roundtrip(raw)
+        snapshot = self._open_snapshot()
+        if snapshot is not None and cast_uid in snapshot.casts:
+            return snapshot.load_cast(cast_uid)
+        # loaded before
+        try:
+            stored = read_json(self.path)
+        except FileNotFoundError:
+            raise KeyError(cast_uid) from None
+        if cast_uid not in stored:
+            raise KeyError(cast_uid)
+        return decode_roundtrip(stored[cast_uid])
+
+    def episode_dates(self, cast_uid: str) -> List[Tuple[str, Optional[datetime]]]:
+        """Returns the uids and dates of the episodes of a cast which wasn't loaded by `load_cast()`."""
+
+        with self.lock:
+            raw = self.raw.get(cast_uid)
+            if raw is not None:
+                return [
+                    (episode_uid, decode_roundtrip(episode.get("date")))
+                    for episode_uid, episode in raw["items"].items()
+                ]
+            snapshot = self._open_snapshot()
+            if snapshot is not None and cast_uid in snapshot.casts:
+                return snapshot.episode_dates(cast_uid)
+        raise KeyError(cast_uid)
+
+    def _descriptions_file(self, cast_uid: str) -> Path:
+        # cast uids can contain any characters
+        name = hashlib.blake2b(cast_uid.encode("utf-8"), digest_size=16).hexdigest()
+        return self.descriptions_path / f"{name}.json"
+
+    def _read_descriptions(self, cast_uid: str) -> Dict[str, str]:
+        """Must be called with `self.lock` held."""
+
+        self._migrate_descriptions()
+        try:
+            return read_json(self._descriptions_file(cast_uid))["descriptions"]
+        except FileNotFoundError:
+            return {}
+
+    def _write_descriptions(self, cast_uid: str, descriptions: Dict[str, str]) -> None:
+        """Must be called with `self.lock` held."""
+
+        path = self._descriptions_file(cast_uid)
+        if descriptions:
+            self.descriptions_path.mkdir(exist_ok=True)
+            write_json({"cast": cast_uid, "descriptions": descriptions}, path, ensure_ascii=False, safe=True)
+        elif path.exists():
+            path.unlink()
+
+    def _migrate_descriptions(self) -> None:
+        """Must be called with `self.lock` held. Splits the descriptions file of older versions by cast."""
+
+        if self.descriptions_migrated:
+            return
+        self.descriptions_migrated = True
+
+        try:
+            stored: Dict[str, Dict[str, str]] = read_json(self.legacy_descriptions_path)
+        except FileNotFoundError:
+            return
+
+        for cast_uid, descriptions in stored.items():
+            self._write_descriptions(cast_uid, {**self._read_descriptions(cast_uid), **descriptions})
+        path = self.legacy_descriptions_path
+        path.rename(path.with_name(path.name + ".migrated"))
+        logger.info("Migrated the descriptions of %d casts from %s", len(stored), path)
+
+    def load_descriptions(self) -> DescriptionsT:
+        """Reads the descriptions of all casts."""
+
+        with self.lock:
+            self._migrate_descriptions()
+            descriptions: DescriptionsT = {}
+            for path in self.descriptions_path.glob("*.json"):
+                stored = read_json(path)
+                for episode_uid, description in stored["descriptions"].items():
+                    descriptions[(stored["cast"], episode_uid)] = description
+            return descriptions
+
+    def load_description(self, cast_uid: str, episode_uid: str) -> Optional[str]:
+        with self.lock:
+            return self._read_descriptions(cast_uid).get(episode_uid)
+
+    def save(self, db: Dict[str, Any], changes: ChangesT, descriptions: Optional[DescriptionsT] = None) -> None:
+        """Casts which were not loaded can be given as None, they are saved as they were stored."""
+
+        with self.lock:
+            db = {cast_uid: self._stored_cast(cast_uid) if cast is None else cast for cast_uid, cast in db.items()}
+            # some platforms can't replace files which are mapped, the new snapshot is opened when needed
+            self._close_snapshot()
+            write_json(db, self.path, indent="\t", cls=BuiltinRoundtripEncoder, safe=True)
+            if self.snapshot_path is not None:
+                write_snapshot(db, self.snapshot_path, self.path)
+
+        removed_casts = {cast_uid for cast_uid, episode_uid in changes if episode_uid is None and cast_uid not in db}
+        if not descriptions and not removed_casts:
+            return
+
+        by_cast: Dict[str, Dict[str, Optional[str]]] = {}
+        for (cast_uid, episode_uid), description in (descriptions or {}).items():
+            by_cast.setdefault(cast_uid, {})[episode_uid] = description
+
+        with self.lock:
+            for cast_uid, changed in by_cast.items():
+                stored = self._read_descriptions(cast_uid)
+                for episode_uid, description in changed.items():
+                    if description is None:
+                        stored.pop(episode_uid, None)
+                    else:
+                        stored[episode_uid] = description
+                self._write_descriptions(cast_uid, stored)
+            for cast_uid in removed_casts:
+                self._migrate_descriptions()
+                self._write_descriptions(cast_uid, {})
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_snapshot()
+
+
+class SqliteStorage:
+    """Stores casts and episodes in indexed sqlite tables. Saves only write the rows which changed,
+    inside a single transaction. Descriptions are stored in their own column, which is not read by `load()`.
+    If the database file doesn't exist yet, it is created from the json database at `json_path` (if given).
+    """
+
+    incremental = True  # `save()` only needs the changed casts and episodes
+
+    EPISODE_COLUMNS = (
+        "title",
+        "date",
+        "duration",
+        "href",
+        "length",
+        "mimetype",
+        "localname",
+        "listened",
+    )
+    OPTIONAL_COLUMNS = ("localname", "listened")  # keys which are not set if the episode doesn't have them
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS casts (
+        cast_uid TEXT PRIMARY KEY,
+        date TEXT,
+        extra TEXT
+    );
+    CREATE TABLE IF NOT EXISTS episodes (
+        cast_uid TEXT NOT NULL REFERENCES casts (cast_uid) ON DELETE CASCADE,
+        episode_uid TEXT NOT NULL,
+        title TEXT,
+        date TEXT,
+        duration REAL,
+        description TEXT,
+        href TEXT,
+        length INTEGER,
+        mimetype TEXT,
+        localname TEXT,
+        listened TEXT,
+        extra TEXT,
+        PRIMARY KEY (cast_uid, episode_uid)
+    );
+    CREATE INDEX IF NOT EXISTS episodes_date ON episodes (date);
+    """
+
+    def __init__(self, path: Path, json_path: Optional[Path] = None) -> None:
+        self.path = path
+        self.json_path = json_path
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            # the connection is shared between threads, access is serialized by `self.lock`
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA foreign_keys = ON")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.executescript(self.SCHEMA)
+        return self.conn
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @staticmethod
+    def _encode_value(value: Any) -> Any:
+        if isinstance(value, datetime):
+            return value.isoformat()
+        elif isinstance(value, timedelta):
+            return value.total_seconds()
+        return value
+
+    @staticmethod
+    def _decode_datetime(value: Optional[str]) -> Optional[datetime]:
+        if value is None:
+            return None
+        return datetime.fromisoformat(value)
+
+    @staticmethod
+    def _decode_timedelta(value: Optional[float]) -> Optional[timedelta]:
+        if value is None:
+            return None
+        return timedelta(seconds=value)
+
+    @staticmethod
+    def _encode_extra(d: Dict[str, Any], exclude: Iterable[str]) -> Optional[str]:
+        extra = {k: v for k, v in d.items() if k not in exclude}
+        if not extra:
+            return None
+        return json.dumps(extra, ensure_ascii=False, cls=BuiltinRoundtripEncoder)
+
+    @staticmethod
+    def _decode_extra(extra: Optional[str]) -> Dict[str, Any]:
+        if extra is None:
+            return {}
+        return json.loads(extra, cls=BuiltinRoundtripDecoder)
+
+    def load(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            if self.json_path is None:
+                raise FileNotFoundError(self.path)
+            self.migrate(self.json_path)
+
+        with self.lock:
+            conn = self._connect()
+            db: Dict[str, Any] = {}
+
+            for cast_uid, date, extra in conn.execute("SELECT cast_uid, date, extra FROM casts"):
+                db[cast_uid] = self._decode_cast(date, extra)
+
+            columns = ", ".join(self.EPISODE_COLUMNS)
+            for row in conn.execute(f"SELECT cast_uid, episode_uid, {columns}, extra FROM episodes"):  # nosec
+                cast_uid, episode_uid, *values, extra = row
+                db[cast_uid]["items"][episode_uid] = self._decode_episode(values, extra)
+
+        return db
+
+    def cast_uids(self) -> List[str]:
+        if not self.path.exists():
+            if self.json_path is None:
+                raise FileNotFoundError(self.path)
+            self.migrate(self.json_path)
+
+        with self.lock:
+            conn = self._connect()
+            return [cast_uid for (cast_uid,) in conn.execute("SELECT cast_uid FROM casts")]
+
+    def load_cast(self, cast_uid: str) -> Dict[str, Any]:
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT date, extra FROM casts WHERE cast_uid=?", (cast_uid,)).fetchone()
+            if row is None:
+                raise KeyError(cast_uid)
+            cast = self._decode_cast(*row)
+
+            columns = ", ".join(self.EPISODE_COLUMNS)
+            query = f"SELECT episode_uid, {columns}, extra FROM episodes WHERE cast_uid=?"  # nosec
+            for episode_uid, *values, extra in conn.execute(query, (cast_uid,)):
+                cast["items"][episode_uid] = self._decode_episode(values, extra)
+
+        return cast
+
+    def episode_dates(self, cast_uid: str) -> List[Tuple[str, Optional[datetime]]]:
+        with self.lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT episode_uid, date FROM episodes WHERE cast_uid=?", (cast_uid,)).fetchall()
+        return [(episode_uid, self._decode_datetime(date)) for episode_uid, date in rows]
+
+    def _decode_cast(self, date: Optional[str], extra: Optional[str]) -> Dict[str, Any]:
+        cast = self._decode_extra(extra)
+        cast["date"] = self._decode_datetime(date)
+        cast["items"] = {}
+        return cast
+
+    def _decode_episode(self, values: List[Any], extra: Optional[str]) -> Dict[str, Any]:
+        episode = self._decode_extra(extra)
+        for key, value in zip(self.EPISODE_COLUMNS, values):
+            if value is None and key in self.OPTIONAL_COLUMNS:
+                continue
+            if key in ("date", "listened"):
+                value = self._decode_datetime(value)
+            elif key == "duration":
+                value = self._decode_timedelta(value)
+            episode[key] = value
+        return episode
+
+    def _write_cast(self, conn: sqlite3.Connection, cast_uid: str, cast: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT INTO casts (cast_uid, date, extra) VALUES (?, ?, ?) "
+            "ON CONFLICT (cast_uid) DO UPDATE SET date=excluded.date, extra=excluded.extra",
+            (cast_uid, self._encode_value(cast.get("date")), self._encode_extra(cast, ("date", "items"))),
+        )
+
+    def _write_episode(self, conn: sqlite3.Connection, cast_uid: str, episode_uid: str, episode: dict) -> None:
+        values = tuple(self._encode_value(episode.get(key)) for key in self.EPISODE_COLUMNS)
+        extra = self._encode_extra(episode, self.EPISODE_COLUMNS)
+        placeholders = ", ".join("?" * (len(self.EPISODE_COLUMNS) + 3))
+        columns = ", ".join(self.EPISODE_COLUMNS)
+        # upsert instead of replace, so the description column is kept
+        updates = ", ".join(f"{column}=excluded.{column}" for column in self.EPISODE_COLUMNS + ("extra",))
+        conn.execute(
+            f"INSERT INTO episodes (cast_uid, episode_uid, {columns}, extra) VALUES ({placeholders}) "  # nosec
+            f"ON CONFLICT (cast_uid, episode_uid) DO UPDATE SET {updates}",
+            (cast_uid, episode_uid) + values + (extra,),
+        )
+
+    def load_description(self, cast_uid: str, episode_uid: str) -> Optional[str]:
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT description FROM episodes WHERE cast_uid=? AND episode_uid=?", (cast_uid, episode_uid)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return row[0]
+
+    def save(self, db: Dict[str, Any], changes: ChangesT, descriptions: Optional[DescriptionsT] = None) -> None:
+        # casts first, so the foreign key constraints of new episodes are satisfied
+        ordered = sorted(changes, key=lambda change: change[1] is not None)
+
+        with self.lock:
+            conn = self._connect()
+            with conn:  # transaction
+                for cast_uid, episode_uid in ordered:
+                    cast = db.get(cast_uid)
+                    if episode_uid is None:
+                        if cast is None:
+                            conn.execute("DELETE FROM casts WHERE cast_uid=?", (cast_uid,))
+                        else:
+                            self._write_cast(conn, cast_uid, cast)
+                    elif cast is not None:
+                        episode = cast["items"].get(episode_uid)
+                        if episode is None:
+                            conn.execute(
+                                "DELETE FROM episodes WHERE cast_uid=? AND episode_uid=?", (cast_uid, episode_uid)
+                            )
+                        else:
+                            self._write_episode(conn, cast_uid, episode_uid, episode)
+
+                # after the episodes, so the rows exist
+                conn.executemany(
+                    "UPDATE episodes SET description=? WHERE cast_uid=? AND episode_uid=?",
+                    (
+                        (description, cast_uid, episode_uid)
+                        for (cast_uid, episode_uid), description in (descriptions or {}).items()
+                    ),
+                )
+
+        logger.debug("Saved %d changes to %s", len(changes), self.path)
+
+    def migrate(self, json_path: Path) -> None:
+        """Imports the json database at `json_path`. The json files are renamed afterwards, so they are only used once."""
+
+        json_storage = JsonStorage(json_path)
+        db = json_storage.load()
+        descriptions = json_storage.load_descriptions()
+        descriptions.update(split_descriptions(db))
+
+        changes: ChangesT = set()
+        for cast_uid, cast in db.items():
+            changes.add((cast_uid, None))
+            changes.update((cast_uid, episode_uid) for episode_uid in cast["items"])
+
+        try:
+            self.save(db, changes, descriptions)
+        except Exception:
+            # don't leave an empty database behind which would prevent a later migration
+            self.close()
+            self.path.unlink()
+            raise
+
+        for path in (json_path, json_storage.descriptions_path, json_storage.legacy_descriptions_path):
+            if path.exists():
+                path.rename(path.with_name(path.name + ".migrated"))
+        logger.info("Migrated %d casts from %s to %s", len(db), json_path, self.path)
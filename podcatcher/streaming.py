@@ -1,90 +1,389 @@
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+import gzip
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from pathlib import Path
+from typing import Container, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 
-import pafy
 from feedgen.feed import FeedGenerator
-from genutility.datetime import datetime_from_utc_timestamp, now
-from genutility.pickle import read_pickle, write_pickle
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .youtube import VIDEO_URL, PafyClient, Video, VideoUnavailable, YoutubeClient
+
+DEFAULT_CACHE_SIZE = 50 * 1024 * 1024  # bytes
+DEFAULT_CACHE_TTL = timedelta(days=1)
+DEFAULT_VIDEO_TTL = timedelta(days=7)
+DEFAULT_CONCURRENCY = 8  # videos which are resolved at the same time
+EXPIRY_MARGIN = 30 * 60  # seconds before a stream url expires, which clients have to start the download
+
+FEED_FORMATS = ("rss", "atom")
+# in order of preference
+ENCODINGS: Tuple[str, ...] = ("gzip", "identity") if brotli is None else ("br", "gzip", "identity")
+
+
+class SqliteCache:
+    """Base class of caches which are stored in the sqlite database at `path`."""
+
+    SCHEMA = ""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            # the connection is shared between threads, access is serialized by `self.lock`
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA foreign_keys = ON")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.executescript(self.SCHEMA)
+        return self.conn
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+def url_expires(url: str) -> Optional[float]:
+    """Returns the time when the signed stream `url` expires or None if it doesn't expire."""
+
+    try:
+        return float(parse_qs(urlsplit(url).query)["expire"][0]) - EXPIRY_MARGIN
+    except (KeyError, ValueError):
+        return None
+
+
+def _expires(now: float, ttl: float, *expires: Optional[float]) -> float:
+    return min((e for e in expires if e is not None), default=now + ttl)
+
+
+class CachedFeed(NamedTuple):
+    etag: str
+    data: Optional[bytes]  # None if the client has the current version already
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    elif encoding == "gzip":
+        return gzip.compress(data, 9, mtime=0)
+    elif encoding == "identity":
+        return data
+    else:
+        raise ValueError(f"Invalid encoding: {encoding}")
+
+
+class FeedCache(SqliteCache):
+    """Rendered feeds stored in the sqlite database at `path`. Every format is stored uncompressed
+    and precompressed with all `ENCODINGS`, so requests don't need to render or compress anything.
+    Entries expire after `ttl` or when the first stream url in the feed expires. If the feeds exceed `max_size` bytes,
+    the least recently used ones are removed. Every `put()` only writes a single playlist.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS feeds (
+        playlist TEXT PRIMARY KEY,
+        expires REAL NOT NULL,
+        accessed REAL NOT NULL,
+        size INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS feeds_accessed ON feeds (accessed);
+    CREATE TABLE IF NOT EXISTS feed_data (
+        playlist TEXT NOT NULL REFERENCES feeds (playlist) ON DELETE CASCADE,
+        format TEXT NOT NULL,
+        encoding TEXT NOT NULL,
+        etag TEXT NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (playlist, format, encoding)
+    );
+    """
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_CACHE_SIZE, ttl: timedelta = DEFAULT_CACHE_TTL) -> None:
+        super().__init__(path)
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(
+        self, playlist: str, format: str, encoding: str = "identity", etags: Container[str] = ()
+    ) -> Optional[CachedFeed]:
+        """Returns the feed of `playlist` in `format` (see `FEED_FORMATS`) compressed with `encoding`
+        or None if it's not cached. If its etag is in `etags`, the data is not loaded.
+        """
+
+        if format not in FEED_FORMATS:
+            raise ValueError(f"Invalid format: {format}")
+
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute(
+                    "SELECT etag FROM feed_data JOIN feeds USING (playlist) "
+                    "WHERE playlist=? AND format=? AND encoding=? AND expires>?",
+                    (playlist, format, encoding, now),
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE feeds SET accessed=? WHERE playlist=?", (now, playlist))
+
+            self.hits += 1
+            etag = row[0]
+            if etag in etags:
+                self.not_modified += 1
+                return CachedFeed(etag, None)
+
+            (data,) = conn.execute(
+                "SELECT data FROM feed_data WHERE playlist=? AND format=? AND encoding=?", (playlist, format, encoding)
+            ).fetchone()
+        return CachedFeed(etag, data)
+
+    def put(
+        self, playlist: str, feeds: Dict[str, bytes], expires: Optional[float] = None
+    ) -> Dict[Tuple[str, str], CachedFeed]:
+        """Stores the rendered `feeds` of `playlist`, which maps the formats to the feeds.
+        They expire after `ttl` or at the timestamp `expires` if it is earlier.
+        Returns the stored feeds for every format and encoding.
+        """
+
+        now = time.time()
+        entries = {}
+        for format, data in feeds.items():
+            etag = hashlib.sha256(data).hexdigest()[:32]
+            for encoding in ENCODINGS:
+                # representations with different encodings need different strong etags
+                entries[(format, encoding)] = CachedFeed(
+                    etag if encoding == "identity" else f"{etag}-{encoding}", compress(data, encoding)
+                )
+        size = sum(len(entry.data) for entry in entries.values() if entry.data)
+
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO feeds (playlist, expires, accessed, size) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (playlist) DO UPDATE SET expires=excluded.expires, accessed=excluded.accessed, "
+                    "size=excluded.size",
+                    (playlist, _expires(now, self.ttl, expires), now, size),
+                )
+                conn.execute("DELETE FROM feed_data WHERE playlist=?", (playlist,))
+                conn.executemany(
+                    "INSERT INTO feed_data (playlist, format, encoding, etag, data) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (playlist, format, encoding, entry.etag, entry.data)
+                        for (format, encoding), entry in entries.items()
+                    ),
+                )
+                self._evict(conn)
+
+        return entries
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Removes expired entries and the least recently used entries above the size limit.
+        Must be called with `self.lock` held.
+        """
+
+        cursor = conn.execute("DELETE FROM feeds WHERE expires<=?", (time.time(),))
+        self.evictions += cursor.rowcount
+
+        total = 0
+        evict = []
+        for playlist, size in conn.execute("SELECT playlist, size FROM feeds ORDER BY accessed DESC"):
+            total += size
+            if total > self.max_size:
+                evict.append((playlist,))
+        if evict:
+            conn.executemany("DELETE FROM feeds WHERE playlist=?", evict)
+            self.evictions += len(evict)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hits, misses and evictions of this process and the number of entries and bytes
+        in the cache.
+        """
+
+        with self.lock:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM feeds").fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size": size,
+            }
+
+
+class VideoCache(SqliteCache):
+    """Resolved videos stored in the sqlite database at `path`. Entries expire after `ttl`
+    or shortly before their signed stream url does, whichever is earlier.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS videos (
+        video_id TEXT PRIMARY KEY,
+        expires REAL NOT NULL,
+        video TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path: Path, ttl: timedelta = DEFAULT_VIDEO_TTL) -> None:
+        super().__init__(path)
+        self.ttl = ttl.total_seconds()
+
+    def get_many(self, video_ids: Iterable[str]) -> Dict[str, Video]:
+        """Returns the cached videos of `video_ids`. Missing and expired videos are not included."""
+
+        video_ids = list(video_ids)
+        videos: Dict[str, Video] = {}
+        now = time.time()
+
+        with self.lock:
+            conn = self._connect()
+            for i in range(0, len(video_ids), 500):  # stay below the maximum number of sql variables
+                chunk = video_ids[i : i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT video FROM videos WHERE video_id IN ({placeholders}) AND expires>?",  # nosec
+                    (*chunk, now),
+                )
+                for (data,) in rows:
+                    video = Video(*json.loads(data))
+                    videos[video.video_id] = video
+        return videos
+
+    def put_many(self, videos: Iterable[Video]) -> None:
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO videos (video_id, expires, video) VALUES (?, ?, ?)",
+                    (
+                        (video.video_id, _expires(now, self.ttl, url_expires(video.url)), json.dumps(video))
+                        for video in videos
+                    ),
+                )
+                conn.execute("DELETE FROM videos WHERE expires<=?", (now,))
 
 
 class YoutubeToFeed:
-    video_url = "https://www.youtube.com/watch?v={}"
-
-    def __init__(self) -> None:
-        self.cachefile = "tmp/youtube-cache.p"
-
-        try:
-            self.cache: Dict[str, Tuple[datetime, FeedGenerator]] = read_pickle(self.cachefile)
-            self.updated = False
-        except FileNotFoundError:
-            self.cache = dict()
-            self.updated = True
-
-    def save_cache(self, force: bool = False) -> None:
-        if self.updated or force:
-            write_pickle(self.cache, self.cachefile)
-
-    def get_feed(self, playlist: str, max_age: Optional[timedelta] = None) -> FeedGenerator:
-        try:
-            dt, feed = self.cache[playlist]
-            if max_age and now() - dt > max_age:
-                raise KeyError
-            else:
-                return feed
-        except KeyError:
-            feed = self.create_feed(playlist)
-            self.cache[playlist] = (now(), feed)
-            self.updated = True
-        return feed
+    """Converts youtube playlists to podcast feeds. Resolved videos are cached, so feeds of playlists
+    which changed only need to resolve the new videos. They are resolved concurrently with `concurrency` threads.
+    """
+
+    def __init__(
+        self,
+        cachefile: Path,
+        max_cache_size: int = DEFAULT_CACHE_SIZE,
+        cache_ttl: timedelta = DEFAULT_CACHE_TTL,
+        video_ttl: timedelta = DEFAULT_VIDEO_TTL,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        client: Optional[YoutubeClient] = None,
+    ) -> None:
+        self.cache = FeedCache(cachefile, max_cache_size, cache_ttl)
+        self.videos = VideoCache(cachefile, video_ttl)
+        self.concurrency = concurrency
+        self.client = client or PafyClient()
+
+    def close(self) -> None:
+        self.cache.close()
+        self.videos.close()
+
+    def get_feed(
+        self, playlist: str, format: str = "rss", encoding: str = "identity", etags: Container[str] = ()
+    ) -> CachedFeed:
+        """Returns the feed of the youtube `playlist` url in `format` (see `FEED_FORMATS`) compressed with `encoding`
+        (see `ENCODINGS`). If the etag of the feed is in `etags`, the data of the returned feed is None.
+        Feeds are created once for all formats and encodings and cached until the first stream url expires.
+        """
+
+        cached = self.cache.get(playlist, format, encoding, etags)
+        if cached is not None:
+            return cached
+
+        feed = self.create_feed(playlist)
+        expires = _expires(time.time(), self.cache.ttl, *(url_expires(fe.enclosure()["url"]) for fe in feed.entry()))
+        feeds = {"rss": feed.rss_str(pretty=True), "atom": feed.atom_str(pretty=True)}
+        cached = self.cache.put(playlist, feeds, expires)[(format, encoding)]
+        if cached.etag in etags:
+            return CachedFeed(cached.etag, None)
+        return cached
+
+    def resolve_videos(self, video_ids: List[str]) -> Dict[str, Video]:
+        """Returns the videos of `video_ids` from the cache and resolves the missing ones.
+        Videos which are unavailable are not included.
+        """
+
+        videos = self.videos.get_many(video_ids)
+        missing = [video_id for video_id in video_ids if video_id not in videos]
+        if not missing:
+            return videos
+
+        resolved = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.client.video, video_id): video_id for video_id in missing}
+            for future in as_completed(futures):
+                try:
+                    resolved.append(future.result())
+                except VideoUnavailable as e:
+                    logging.warning("Skipping unavailable video %s: %s", futures[future], e.__cause__ or e)
+
+        logging.debug("Resolved %d of %d new videos", len(resolved), len(missing))
+        self.videos.put_many(resolved)
+        videos.update((video.video_id, video) for video in resolved)
+        return videos
 
     def create_feed(self, playlist: str, start: Optional[int] = None, end: Optional[int] = None) -> FeedGenerator:
         """playlist must be a youtube playlist url"""
 
-        pl = pafy.get_playlist(playlist, gdata=False)
+        info, entries = self.client.playlist(playlist)
+        entries = entries[start:end]
+        videos = self.resolve_videos([entry.video_id for entry in entries])
         location = "http://localhost/yt.atom"  # request.url
 
         fg = FeedGenerator()
         fg.load_extension("podcast")
         fg.id(playlist)
-        fg.title(pl.get("title"))
-        fg.author(name=pl.get("author"))
-        fg.subtitle(pl.get("description"))
+        fg.title(info.title)
+        fg.author(name=info.author)
+        fg.subtitle(info.description)
         fg.link(href=location, rel="self")
         # set updated to latest entry
 
-        for item in pl.get("items")[start:end]:
-            m = item.get("playlist_meta")
-            p = item.get("pafy")
+        for entry in entries:
+            try:
+                video = videos[entry.video_id]
+            except KeyError:
+                continue
             size = 0
 
-            stream = p.getbestaudio("ogg")
-            mimetype = "audio/webm"  # audio/ogg
-            if not stream:
-                stream = p.getbestaudio("m4a")
-                mimetype = "audio/mp4"
-            if not stream:
-                raise
-
-            created = m.get("time_created")
-            if created:
-                created = datetime_from_utc_timestamp(created)
-
-            updated = m.get("time_updated")
-            if updated:
-                updated = datetime_from_utc_timestamp(updated)
-            else:
-                updated = created
-
             fe = fg.add_entry()
-            fe.id(self.video_url.format(p.videoid))
-            fe.title(p.title)
-            fe.author({"name": p.author})
-            fe.content(p.description, type="text")
+            fe.id(VIDEO_URL.format(video.video_id))
+            fe.title(video.title)
+            fe.author({"name": video.author})
+            fe.content(video.description, type="text")
             # fe.description(p.description, type="text")
-            fe.enclosure(stream.url, size, mimetype)
-            fe.updated(updated)
-            fe.published(created)
-            fe.podcast.itunes_duration(p.duration)
+            fe.enclosure(video.url, size, video.mimetype)
+            fe.updated(entry.updated)
+            fe.published(entry.created)
+            fe.podcast.itunes_duration(video.duration)
 
         return fg
 
@@ -93,10 +392,9 @@ if __name__ == "__main__":
     gametwo = "https://www.youtube.com/playlist?list=PLztfM9GoCIGrhVwCfF6jsCxCteShsSjXw"
     almost_daily = "https://www.youtube.com/playlist?list=PLsksxTH4pR3I6-7OYZ0GigNnc7KI5S0OK"
 
-    yt = YoutubeToFeed()
-    fg = yt.get_feed(playlist=gametwo)
-    yt.save_cache()
+    yt = YoutubeToFeed(Path("youtube-cache.sqlite"))
     with open("gametwo.rss.xml", "wb") as fw:
-        fw.write(fg.rss_str(pretty=True))
+        fw.write(yt.get_feed(gametwo, "rss").data or b"")
     with open("gametwo.atom.xml", "wb") as fw:
-        fw.write(fg.atom_str(pretty=True))
+        fw.write(yt.get_feed(gametwo, "atom").data or b"")
+    yt.close()
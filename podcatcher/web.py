@@ -1,18 +1,44 @@
 """This is the Web entrypoint to PodCatcher"""
 
+import json
 import locale
 import logging
 import os
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
-from typing import Tuple
-
-from flask import Flask, Response, abort, flash, make_response, redirect, render_template, request, send_file, url_for
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from typing import Optional, Tuple
+
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    abort,
+    current_app,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
 from genutility.args import is_dir
 from genutility.flask import Base64Converter
+from werkzeug.local import LocalProxy
 from wtforms import Form, IntegerField, StringField, validators
 
 from .catcher import Catcher, InvalidFeed
-from .streaming import YoutubeToFeed
+from .media import DEFAULT_MAX_AGE, MediaFile, PathCache, send_media
+from .streaming import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_VIDEO_TTL,
+    ENCODINGS,
+    YoutubeToFeed,
+)
 from .utils import DEFAULT_APPDATA_DIR
 
 """
@@ -37,27 +63,59 @@ item id order: guid, link, title, description, pubDate
 
 """
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
+DEFAULT_PAGE_SIZE = 100
+FILENAME_YOUTUBE_CACHE = "youtube-cache.sqlite"
+EVENTS_KEEPALIVE = 15.0  # seconds
+DEFAULT_THREADS = 32  # every open status page holds a thread for its events
+
+# the `Catcher` and `YoutubeToFeed` of the current app, see `create_app()`
+c: Catcher = LocalProxy(lambda: current_app.extensions["podcatcher"])  # type: ignore[assignment]
+yt: YoutubeToFeed = LocalProxy(lambda: current_app.extensions["youtube"])  # type: ignore[assignment]
+
+media_files: PathCache = LocalProxy(lambda: current_app.extensions["media"])  # type: ignore[assignment]
+
+bp = Blueprint("podcatcher", __name__)
 
-parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
-parser.add_argument("--appdata-dir", type=is_dir, default=DEFAULT_APPDATA_DIR, help="Path to appdata directory")
-parser.add_argument("--quiet", action="store_true", help="don't show debug output")
-args = parser.parse_args()
 
-if args.quiet:
-    logging.basicConfig(level=logging.INFO)
-else:
-    logging.basicConfig(level=logging.DEBUG)
+def _resolve_media(catcher: Catcher, key: Tuple[str, str]) -> Optional[MediaFile]:
+    file = catcher.episode_file(*key)
+    if file is None:
+        return None
+    return MediaFile(*file)
 
-c = Catcher(args.appdata_dir)
-c.load_feeds()
-yt = YoutubeToFeed()
 
-app.url_map.converters["binary"] = Base64Converter
+def create_app(
+    appdata_dir: Path = DEFAULT_APPDATA_DIR, catcher: Optional[Catcher] = None, secret_key: Optional[bytes] = None
+) -> Flask:
+    """Creates the web app. If no `catcher` is given, the feeds of `appdata_dir` are loaded
+    and unfinished downloads are resumed. `catcher` can also be a proxy of a Catcher in another process,
+    see `podcatcher.serve`. All processes which serve the same app must use the same `secret_key`.
+    """
+
+    if catcher is None:
+        catcher = Catcher(appdata_dir)
+        catcher.load_feeds()
+        catcher.resume_downloads()
+
+    app = Flask(__name__)
+    app.secret_key = secret_key or os.urandom(24)
+    app.url_map.converters["binary"] = Base64Converter
+    app.extensions["podcatcher"] = catcher
+    config = catcher.get_config()
+    app.extensions["youtube"] = YoutubeToFeed(
+        appdata_dir / FILENAME_YOUTUBE_CACHE,
+        config.get("youtube-cache-size", DEFAULT_CACHE_SIZE),  # bytes
+        timedelta(seconds=config.get("youtube-cache-ttl", DEFAULT_CACHE_TTL.total_seconds())),
+        timedelta(seconds=config.get("youtube-video-ttl", DEFAULT_VIDEO_TTL.total_seconds())),
+        config.get("youtube-concurrency", DEFAULT_CONCURRENCY),
+    )
+    app.extensions["media"] = PathCache(partial(_resolve_media, catcher))
+    app.config["MEDIA_MAX_AGE"] = config.get("media-max-age", DEFAULT_MAX_AGE)
+    app.register_blueprint(bp)
+    return app
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e: Exception) -> Tuple[str, int]:
     logging.info(f"404: {request.url}")
     return ("Not Found", 404)
@@ -76,57 +134,68 @@ def redirect_to_cast():
     if request.referrer:  # is valid url test missing
         return redirect(request.referrer)
     else:
-        return redirect(url_for("casts"))
+        return redirect(url_for(".casts"))
 
 
-@app.route("/", methods=["GET"])
-@app.route("/cast/<binary:cast_uid>", methods=["GET"])
+@bp.route("/", methods=["GET"])
+@bp.route("/cast/<binary:cast_uid>", methods=["GET"])
 def casts(cast_uid=None):
     # cast_uid == cast_title
 
     # fixme: there can be episodes in "all" which are from casts not in the cast list
 
-    episodes = list()
-
     if cast_uid is None:
-        for cast_uid, feed in c.db.items():
-            for episode_uid in feed["items"]:
-                info = c.episode(cast_uid, episode_uid)
-                episodes.append((cast_uid, episode_uid, cast_uid, info["title"], info, is_downloaded(info)))
         cast_title = "All"
+    elif c.has_cast(cast_uid):
+        cast_title = cast_uid
     else:
-        try:
-            feed = c.db[cast_uid]
-        except KeyError:
-            flash("Invalid Cast", "error")
-            return redirect(url_for("casts"))
+        flash("Invalid Cast", "error")
+        return redirect(url_for(".casts"))
 
-        for episode_uid in feed["items"]:
-            info = c.episode(cast_uid, episode_uid)
-            episodes.append((cast_uid, episode_uid, cast_uid, info["title"], info, is_downloaded(info)))
+    config = c.get_config()
+    order = request.args.get("order")
+    if order not in ("asc", "desc"):
+        order = "desc" if config.get("descending", True) else "asc"
 
-        cast_title = cast_uid
+    try:
+        limit = max(1, int(request.args.get("limit", config.get("page-size", DEFAULT_PAGE_SIZE))))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+
+    try:
+        page, next_cursor = c.episodes(cast_uid, request.args.get("cursor"), limit, order == "desc")
+    except ValueError:
+        flash("Invalid page", "error")
+        return redirect(url_for(".casts", cast_uid=cast_uid))
+
+    episodes = [(uid, episode_uid, uid, info["title"], info, is_downloaded(info)) for uid, episode_uid, info in page]
 
     casts = list()
-    for cast_uid, info in c.casts.items():
-        casts.append((cast_uid, cast_uid, info["url"]))
+    for uid, info in c.get_casts():
+        casts.append((uid, uid, info["url"]))
 
-    if c.config["descending"]:
-        episodes = sorted(episodes, key=lambda x: x[4]["date"], reverse=True)
-    else:
-        episodes = sorted(episodes, key=lambda x: x[4]["date"], reverse=False)
-    return render_template("casts.html", cast_title=cast_title, casts=casts, episodes=episodes)
+    return render_template(
+        "casts.html",
+        cast_uid=cast_uid,
+        cast_title=cast_title,
+        casts=casts,
+        episodes=episodes,
+        total=c.count_episodes(cast_uid),
+        order=order,
+        limit=limit,
+        next_cursor=next_cursor,
+    )
 
 
-@app.route("/save", methods=["GET"])
+@bp.route("/save", methods=["GET"])
 def save():
     flash("Podcasts database saved")
     c.save_roaming()
     c.save_local()
-    return redirect(url_for("casts"))
+    return redirect(url_for(".casts"))
 
 
-@app.route("/massedit", methods=["POST"])
+@bp.route("/massedit", methods=["POST"])
 def massedit():
     episodes = request.form.getlist("episode")
     action = request.form.get("action")
@@ -137,6 +206,7 @@ def massedit():
         if action == "delete":
             for cast_uid, episode_uid in episodes:
                 c.remove_episode(cast_uid, episode_uid)
+                media_files.invalidate((cast_uid, episode_uid))
             flash("Removed episodes", "info")
         elif action == "download":
             for cast_uid, episode_uid in episodes:
@@ -155,9 +225,10 @@ def massedit():
     return redirect_to_cast()
 
 
-@app.route("/removeepisode/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
+@bp.route("/removeepisode/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
 def removeepisode(cast_uid, episode_uid):
     localname = c.remove_episode(cast_uid, episode_uid)
+    media_files.invalidate((cast_uid, episode_uid))
     if localname:
         flash(f"Removed episode: {cast_uid}/{localname}", "info")
     else:
@@ -165,10 +236,18 @@ def removeepisode(cast_uid, episode_uid):
     return redirect_to_cast()
 
 
-@app.route("/downloadepisode/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
+@bp.route("/downloadepisode/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
 def downloadepisode(cast_uid, episode_uid):
-    ep = c.download_item(cast_uid, episode_uid)  # is async now
-    flash("Started downloading episode: {} / {}".format(cast_uid, ep["title"]), "info")
+    try:
+        ep = c.download_item(cast_uid, episode_uid)  # is async now
+    except KeyError:
+        flash("Invalid episode", "error")
+        return redirect_to_cast()
+
+    if ep is None:  # already downloaded or queued, failed permanently or no url
+        flash(f"Episode was not queued for download: {cast_uid} / {episode_uid}", "warning")
+    else:
+        flash("Started downloading episode: {} / {}".format(cast_uid, ep["title"]), "info")
     """
 	if is_downloaded(ep):
 		flash("Downloaded episode: {} / {}".format(cast_uid, ep["title"]), "info")
@@ -178,37 +257,50 @@ def downloadepisode(cast_uid, episode_uid):
     return redirect_to_cast()
 
 
-@app.route("/playepisode/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
+@bp.route("/playepisode/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
 def playepisode(cast_uid, episode_uid):
-    info = c.episode(cast_uid, episode_uid)
-    if info:
-        try:
-            filename = info["localname"]
-        except KeyError:
+    key = (cast_uid, episode_uid)
+    media = media_files.get(key)
+    if media is None:
+        if c.episode(cast_uid, episode_uid):
             flash("Episode not downloaded yet", "error")
-            return redirect_to_cast()
-        try:
-            sf = send_file(
-                os.path.join(c.casts_dir, cast_uid, info["localname"]),
-                download_name=filename,
-                mimetype=info["mimetype"],
-                conditional=True,
-                last_modified=info["date"],
-            )
-        except FileNotFoundError:
-            logging.warning("Tried to play file: %s", filename)
-            abort(404)
-        response = make_response(sf)
-        response.headers["Content-Disposition"] = 'inline; filename="{}"'.format(
-            filename
-        )  # flask doesn't support inline filename. encoding?
-        return response
-    else:
-        flash("Invalid episode", "error")
+        else:
+            flash("Invalid episode", "error")
         return redirect_to_cast()
 
+    try:
+        return send_media(request, media, current_app.config["MEDIA_MAX_AGE"])
+    except FileNotFoundError:
+        logging.warning("Tried to play file: %s", media.path)
+        media_files.invalidate(key)
+        abort(404)
+
+
+@bp.route("/episode/<binary:cast_uid>/<binary:episode_uid>.json", methods=["GET"])
+def episode_json(cast_uid, episode_uid):
+    info = c.episode(cast_uid, episode_uid)
+    if info is None:
+        abort(404)
+
+    def isoformat(date):
+        return date.isoformat() if date else None
+
+    return jsonify(
+        {
+            "title": info.get("title"),
+            "date": isoformat(info.get("date")),
+            "duration": info["duration"].total_seconds() if info.get("duration") else None,
+            "description": c.description(cast_uid, episode_uid),
+            "href": info.get("href"),
+            "length": info.get("length"),
+            "mimetype": info.get("mimetype"),
+            "localname": info.get("localname"),
+            "listened": isoformat(info.get("listened")),
+        }
+    )
+
 
-@app.route("/listento/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
+@bp.route("/listento/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
 def listento(cast_uid, episode_uid):
     try:
         c.listenedto(cast_uid, episode_uid)
@@ -217,7 +309,7 @@ def listento(cast_uid, episode_uid):
     return redirect_to_cast()
 
 
-@app.route("/unhear/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
+@bp.route("/unhear/<binary:cast_uid>/<binary:episode_uid>", methods=["GET"])
 def unhear(cast_uid, episode_uid):
     try:
         c.forget_episode(cast_uid, episode_uid)
@@ -226,21 +318,21 @@ def unhear(cast_uid, episode_uid):
     return redirect_to_cast()
 
 
-@app.route("/addcastc", methods=["POST"])
+@bp.route("/addcastc", methods=["POST"])
 def addcastc():
     url = request.form.get("url")
     if url.startswith("https://www.youtube.com/playlist"):
-        url = url_for("youtube_to_feed", format="rss", url=url, _external=True)
+        url = url_for(".youtube_to_feed", format="rss", url=url, _external=True)
     try:
         title, feed = c.get_feed(url)
     except InvalidFeed:
         flash("Parsing feed failed", "warning")
-        return redirect(url_for("casts"))
+        return redirect(url_for(".casts"))
 
     return render_template("addcast.html", title=title, url=url)
 
 
-@app.route("/addcast", methods=["POST"])
+@bp.route("/addcast", methods=["POST"])
 def addcast():
     title = request.form.get("title")
     url = request.form.get("url")
@@ -249,22 +341,22 @@ def addcast():
         flash("Directory exists already", "warning")
     c.save_local()
     flash(f"Added {title}", "info")
-    return redirect(url_for("casts"))
+    return redirect(url_for(".casts"))
 
 
-@app.route("/removecast/<binary:cast_uid>", methods=["GET"])
+@bp.route("/removecast/<binary:cast_uid>", methods=["GET"])
 def removecast(cast_uid):
     c.remove_cast(cast_uid)
     flash(f"Deleted {cast_uid}", "info")
-    return redirect(url_for("casts"))
+    return redirect(url_for(".casts"))
 
 
-@app.route("/renamecastc/<binary:cast_uid>", methods=["GET"])
+@bp.route("/renamecastc/<binary:cast_uid>", methods=["GET"])
 def renamecastc(cast_uid):
     return render_template("renamecast.html", cast_uid=cast_uid, title=cast_uid)
 
 
-@app.route("/renamecast/<binary:cast_uid>", methods=["POST"])
+@bp.route("/renamecast/<binary:cast_uid>", methods=["POST"])
 def renamecast(cast_uid):
     name = request.form.get("title")
     if name:
@@ -276,25 +368,37 @@ def renamecast(cast_uid):
             flash(str(e), "error")
     else:
         flash("Name missing", "error")
-    return redirect(url_for("casts"))
+    return redirect(url_for(".casts"))
 
 
-@app.route("/action/refresh", methods=["GET"])
+@bp.route("/action/refresh", methods=["GET"])
 def refresh():
-    c.update_feeds()
-    return redirect(url_for("casts"))
+    if c.trigger_refresh(force="force" in request.args):
+        flash("Refreshing feeds in the background", "info")
+    else:
+        flash("A refresh is already pending", "info")
+    return redirect_to_cast()
 
 
-@app.route("/refresher", methods=["GET"])
+@bp.route("/refresher", methods=["GET"])
 def refresher():
-    c.update_feeds()
-    return render_template("refresher.html", interval=c.interval)
+    c.trigger_refresh()
+    return render_template("refresher.html", interval=c.get_config()["refresh-interval"], status=c.refresh_status())
+
 
+@bp.route("/refresh/status", methods=["GET"])
+def refresh_status():
+    status = c.refresh_status()
+    for key in ("started", "finished"):
+        if status[key] is not None:
+            status[key] = status[key].isoformat()
+    return jsonify(status)
 
-@app.route("/action/download", methods=["GET"])
+
+@bp.route("/action/download", methods=["GET"])
 def download():
     c.download_items()
-    return redirect(url_for("casts"))
+    return redirect(url_for(".casts"))
 
 
 """
@@ -319,28 +423,33 @@ class ConfigForm(Form):
         "Network timeout", description="Network timeout in seconds", validators=[validators.input_required()]
     )
     refresh_interval = IntegerField(
-        "Refresh interval", description="Refresh interval of feeds in seconds", validators=[validators.input_required()]
+        "Refresh interval",
+        description="Minimum refresh interval of feeds in seconds",
+        validators=[validators.input_required()],
     )
 
 
-@app.route("/config", methods=["GET", "POST"])
+@bp.route("/config", methods=["GET", "POST"])
 def config():
     if request.method == "POST":
         form = ConfigForm(formdata=request.form)
         if form.validate():
             flash("Config changed and saved")
-            c.config["casts-directory"] = form.casts_directory.data
-            c.config["user-agent"] = form.user_agent.data
-            c.config["network-timeout"] = form.network_timeout.data
-            c.config["refresh-interval"] = form.refresh_interval.data
-            c.save_config()
+            c.update_config(
+                {
+                    "casts-directory": form.casts_directory.data,
+                    "user-agent": form.user_agent.data,
+                    "network-timeout": form.network_timeout.data,
+                    "refresh-interval": form.refresh_interval.data,
+                }
+            )
     else:
-        config = {k.replace("-", "_"): v for k, v in c.config.items()}
+        config = {k.replace("-", "_"): v for k, v in c.get_config().items()}
         form = ConfigForm(**config)
     return render_template("config.html", form=form)
 
 
-@app.route("/status", methods=["GET"])
+@bp.route("/status", methods=["GET"])
 def status():
     try:
         interval = int(request.args.get("interval"))
@@ -353,29 +462,98 @@ def status():
     )
 
 
-@app.route("/youtube/<format>/<path:url>", methods=["GET"])
+@bp.route("/status/events", methods=["GET"])
+def status_events():
+    """Server-sent events with the changes of the download queue, see `podcatcher.events`."""
+
+    def generate():
+        subscription = c.subscribe()
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                events = subscription.get(EVENTS_KEEPALIVE)
+                if not events:
+                    yield ": keepalive\n\n"  # detects closed connections
+                for event in events:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            c.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@bp.route("/youtube/stats", methods=["GET"])
+def youtube_cache_stats():
+    return jsonify(yt.cache.stats())
+
+
+@bp.route("/youtube/<format>/<path:url>", methods=["GET"])
 def youtube_to_feed(format, url):
-    formats = {"rss": ("rss_str", "application/rss+xml"), "atom": ("atom_str", "application/atom+xml")}
+    mimetypes = {"rss": "application/rss+xml", "atom": "application/atom+xml"}
 
-    if format not in formats:
+    if format not in mimetypes:
         return ("Invalid format", 400)
+    encoding = request.accept_encodings.best_match(ENCODINGS, "identity")
     try:
-        feed = yt.get_feed(url)
+        feed = yt.get_feed(url, format, encoding, request.if_none_match)
     except ValueError:
         logging.exception("Invalid playlist")
         return (f"Invalid playlist url: {url}", 400)
-    yt.save_cache()
 
-    format_str = formats[format][0]
-    return Response(getattr(feed, format_str)(pretty=True), mimetype=formats[format][1])
+    if feed.data is None:
+        response = Response(status=304)
+    else:
+        response = Response(feed.data, mimetype=mimetypes[format])
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(feed.etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"  # clients revalidate with the etag
+    return response
 
 
 def main():
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--appdata-dir", type=is_dir, default=DEFAULT_APPDATA_DIR, help="Path to appdata directory")
+    parser.add_argument("--quiet", action="store_true", help="don't show debug output")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="Serve with the waitress WSGI server instead of the Werkzeug development server",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=DEFAULT_THREADS,
+        help="Worker threads per process (production only). Every open status page uses one thread.",
+    )
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes (production only)")
+    args = parser.parse_args()
+
+    if args.quiet:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.DEBUG)
+
     locale.setlocale(
         locale.LC_TIME, ""
     )  # this sets it to the correct locale, it's unset otherwise. needed for strftime %x
 
-    app.run(host="127.0.0.1", port=8000, debug=True, threaded=True, use_reloader=False)  # nosec
+    if args.production:
+        from .serve import serve  # imports this module
+
+        try:
+            serve(args.appdata_dir, args.host, args.port, args.threads, args.processes)
+        except RuntimeError as e:
+            parser.error(str(e))
+    else:
+        app = create_app(args.appdata_dir)
+        app.run(host=args.host, port=args.port, debug=True, threaded=True, use_reloader=False)  # nosec
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""Network access to YouTube. `YoutubeToFeed` only uses the `YoutubeClient` interface,
+so a local stub can stand in for YouTube.
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+import pafy
+from genutility.datetime import datetime_from_utc_timestamp
+
+VIDEO_URL = "https://www.youtube.com/watch?v={}"
+
+
+class VideoUnavailable(Exception):
+    pass
+
+
+class Playlist(NamedTuple):
+    title: Optional[str]
+    author: Optional[str]
+    description: Optional[str]
+
+
+class PlaylistEntry(NamedTuple):
+    video_id: str
+    created: Optional[datetime]
+    updated: Optional[datetime]
+
+
+class Video(NamedTuple):
+    video_id: str
+    title: str
+    author: str
+    description: str
+    duration: str  # HH:MM:SS
+    url: str  # of the audio stream
+    mimetype: str
+
+
+class YoutubeClient(ABC):
+    @abstractmethod
+    def playlist(self, url: str) -> Tuple[Playlist, List[PlaylistEntry]]:
+        """Returns the information and the videos of the playlist at `url`, without resolving the videos."""
+
+    @abstractmethod
+    def video(self, video_id: str) -> Video:
+        """Resolves the information and audio stream of a video. Raises VideoUnavailable if this is not possible.
+        Called concurrently from multiple threads. The stream url may be signed with an `expire` timestamp.
+        """
+
+
+class PafyClient(YoutubeClient):
+    def playlist(self, url: str) -> Tuple[Playlist, List[PlaylistEntry]]:
+        pl = pafy.get_playlist(url, gdata=False)
+        entries = []
+        for item in pl.get("items"):
+            m = item.get("playlist_meta")
+
+            created = m.get("time_created")
+            if created:
+                created = datetime_from_utc_timestamp(created)
+
+            updated = m.get("time_updated")
+            if updated:
+                updated = datetime_from_utc_timestamp(updated)
+            else:
+                updated = created
+
+            entries.append(PlaylistEntry(item.get("pafy").videoid, created, updated))
+
+        return Playlist(pl.get("title"), pl.get("author"), pl.get("description")), entries
+
+    def video(self, video_id: str) -> Video:
+        try:
+            p = pafy.new(VIDEO_URL.format(video_id))
+            stream = p.getbestaudio("ogg")
+            mimetype = "audio/webm"  # audio/ogg
+            if not stream:
+                stream = p.getbestaudio("m4a")
+                mimetype = "audio/mp4"
+        except (OSError, ValueError) as e:
+            raise VideoUnavailable(video_id) from e
+
+        if not stream:
+            raise VideoUnavailable(video_id)
+
+        return Video(video_id, p.title, p.author, p.description, p.duration, stream.url, mimetype)
@@ -0,0 +1,93 @@
+"""Measures the startup time of the CLI: importing it and loading a feeds database,
+as done before the command is run.
+
+Usage: `python tests/benchmark_startup.py [--casts 200] [--episodes 500] [--repeat 5]`
+"""
+
+import subprocess  # nosec B404
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List
+
+from genutility.json import write_json
+
+from podcatcher.storage import JsonStorage
+
+IMPORT = "import podcatcher.cli"
+
+LOAD = """
+import sys
+from pathlib import Path
+from podcatcher.cli import Catcher
+
+c = Catcher(Path(sys.argv[1]))
+c.load_feeds()
+c.episode("cast0", "ep0")
+c.close()
+"""
+
+
+def make_appdata(appdatadir: Path, storage: str, casts: int, episodes: int) -> None:
+    date = datetime(2017, 3, 21, tzinfo=timezone.utc)
+    db = {
+        f"cast{i}": {
+            "date": date,
+            "items": {
+                f"ep{j}": {
+                    "title": f"Episode {j}",
+                    "date": date - timedelta(days=j),
+                    "duration": timedelta(minutes=30),
+                    "href": f"http://localhost/cast{i}/ep{j}.mp3",
+                    "length": 1234,
+                    "mimetype": "audio/mpeg",
+                }
+                for j in range(episodes)
+            },
+        }
+        for i in range(casts)
+    }
+    config = {"casts-directory": str(appdatadir), "refresh-interval": 3600}
+    if storage == "snapshot":
+        config["feeds-snapshot"] = True
+    else:
+        config["storage"] = storage
+    write_json(config, appdatadir / "config.json")
+    write_json({cast_uid: {"url": f"http://localhost/{cast_uid}"} for cast_uid in db}, appdatadir / "casts.json")
+
+    snapshot_path = appdatadir / "feeds.db.snapshot" if storage == "snapshot" else None
+    JsonStorage(appdatadir / "feeds.db.json", snapshot_path=snapshot_path).save(db, set())
+
+
+def measure(args: List[str], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run(args, check=True)  # nosec B603
+        times.append(perf_counter() - start)
+    return median(times)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--casts", type=int, default=200)
+    parser.add_argument("--episodes", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"python -c {IMPORT!r}: {measure([sys.executable, '-c', IMPORT], args.repeat):.3f}s")
+
+    for storage in ("json", "snapshot", "sqlite"):
+        with TemporaryDirectory() as tmpdir:
+            make_appdata(Path(tmpdir), storage, args.casts, args.episodes)
+            measure([sys.executable, "-c", LOAD, tmpdir], 1)  # migrates the json database to sqlite
+            seconds = measure([sys.executable, "-c", LOAD, tmpdir], args.repeat)
+            print(f"load {args.casts} casts with {args.episodes} episodes each ({storage}): {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,78 @@
+import threading
+import time
+from concurrent.futures import Future
+from copy import deepcopy
 from datetime import timedelta
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
+from urllib.error import HTTPError
 
-from podcatcher.catcher import Catcher, parse_itunes_duration
+import feedparser
+from genutility.datetime import now
+from genutility.http import TimeOut
+from genutility.json import write_json
+
+from podcatcher.catcher import PRIORITY_BULK, Catcher, NotModified, ParsedFeed, parse_itunes_duration
+from podcatcher.journal import STATE_QUEUED, DownloadJournal
+
+FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Test cast</title>
+<item><title>Episode 1</title><guid>ep1</guid><pubDate>Tue, 21 Mar 2017 00:00:00 GMT</pubDate>
+<enclosure url="http://localhost/ep1.mp3" length="1234" type="audio/mpeg"/></item>
+</channel></rss>
+"""
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    etag = '"v1"'
+
+    def do_GET(self):
+        if self.path == "/unavailable.mp3":
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path == "/invalid.rss":
+            self.send_response(200)
+            self.send_header("Content-Length", "7")
+            self.end_headers()
+            self.wfile.write(b"invalid")
+            return
+
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(FEED)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, format, *args):
+        pass
 
 
 class CatcherTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/feed.rss"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
     def test_init(self):
         c = Catcher(Path("tests/appdata-test"))
         try:
@@ -21,3 +88,244 @@ class CatcherTest(TestCase):
         result = parse_itunes_duration(None)
         truth = None
         self.assertEqual(truth, result)
+
+    def test_get_feed_conditional(self):
+        url = self.url
+        c = Catcher(Path("tests/appdata-test"))
+        c.db = {}
+        try:
+            title, feed = c.get_feed(url)
+            self.assertEqual("Test cast", title)
+            c.update_feed("Test cast", feed)
+            self.assertEqual('"v1"', c.db["Test cast"]["etag"])
+
+            with self.assertRaises(NotModified):
+                c.get_feed(url, c.db["Test cast"]["etag"])
+        finally:
+            c.close()
+
+    def test_update_feed_incremental(self):
+        feed = feedparser.parse(FEED)
+        c = Catcher(Path("tests/appdata-test"))
+        c.db = {}
+        try:
+            self.assertEqual({"added": 1, "changed": 0, "unchanged": 0}, c.update_feed("Test cast", feed))
+            self.assertEqual({"added": 0, "changed": 0, "unchanged": 1}, c.update_feed("Test cast", feed))
+
+            changed = deepcopy(feed)
+            changed.entries[0]["title"] = "Episode 1 (updated)"
+            self.assertEqual({"added": 0, "changed": 1, "unchanged": 0}, c.update_feed("Test cast", changed))
+            self.assertEqual("Episode 1 (updated)", c.episode("Test cast", "ep1")["title"])
+
+            changed.entries[0]["description"] = "The first episode"  # stored as "summary" by feedparser
+            self.assertEqual({"added": 0, "changed": 1, "unchanged": 0}, c.update_feed("Test cast", changed))
+        finally:
+            c.close()
+
+    def test_get_feed_stream(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json(
+                {"casts-directory": tmpdir, "refresh-interval": 3600, "feed-parser": "stream"},
+                appdatadir / "config.json",
+            )
+            write_json({}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            c.db = {}
+            try:
+                title, feed = c.get_feed(self.url)
+                self.assertEqual("Test cast", title)
+                self.assertEqual({"added": 1, "changed": 0, "unchanged": 0}, c.update_feed("Test cast", feed))
+
+                # known and unchanged entries are skipped
+                headers = Message()
+                _title, feed = c.parse_feed_stream(self.url, BytesIO(FEED), headers, c._fingerprints("Test cast"))
+                self.assertEqual([], feed.entries)
+                self.assertEqual({"added": 0, "changed": 0, "unchanged": 1}, c.update_feed("Test cast", feed))
+
+                # documents which are not well-formed are parsed by feedparser
+                malformed = FEED.replace(b"Episode 1", b"Episode&nbsp;1")
+                _title, feed = c.parse_feed_stream(self.url, BytesIO(malformed), headers)
+                self.assertEqual(1, len(feed.entries))
+            finally:
+                c.close()
+
+    def test_update_feeds_processes(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json(
+                {"casts-directory": tmpdir, "refresh-interval": 3600, "parse-processes": 2},
+                appdatadir / "config.json",
+            )
+            write_json({"Test cast": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                self.assertEqual("Episode 1", c.episode("Test cast", "ep1")["title"])
+                self.assertEqual(timedelta(seconds=3600), c.db["Test cast"]["interval"])
+
+                # only new and changed entries are sent back from the parse processes
+                _title, feed = c._refresh_feed(self.url, None, None, c._fingerprints("Test cast"))
+                self.assertIsInstance(feed, ParsedFeed)
+                self.assertEqual(([], 1), (feed.episodes, feed.unchanged))
+                self.assertEqual({"added": 0, "changed": 0, "unchanged": 1}, c.update_feed("Test cast", feed))
+            finally:
+                c.close()
+
+    def test_update_feeds_asyncio(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json(
+                {"casts-directory": tmpdir, "refresh-interval": 3600, "refresh-engine": "asyncio"},
+                appdatadir / "config.json",
+            )
+            write_json({"Test cast": {"url": self.url}, "Test cast 2": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                self.assertEqual("Episode 1", c.episode("Test cast 2", "ep1")["title"])
+                self.assertEqual({"hits": 0, "misses": 0, "failed": 0, "skipped": 2}, c.update_feeds())
+                self.assertEqual({"hits": 2, "misses": 0, "failed": 0, "skipped": 0}, c.update_feeds(force=True))
+            finally:
+                c.close()
+
+    def test_refresh_failures(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            write_json({"Test cast": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                c.casts["Test cast"]["url"] = self.url.replace("feed.rss", "invalid.rss")
+
+                start = now()
+                self.assertEqual(1, c.update_feeds(force=True)["failed"])
+                cast = c.db["Test cast"]
+                self.assertEqual(1, cast["refresh_failures"])
+                self.assertGreaterEqual(cast["due"], start + timedelta(hours=2))  # the interval is doubled
+                self.assertEqual(1, c.update_feeds()["skipped"])
+
+                c.update_feeds(force=True)
+                self.assertGreaterEqual(cast["due"], start + timedelta(hours=4))
+
+                c.casts["Test cast"]["url"] = self.url
+                self.assertEqual(1, c.update_feeds(force=True)["hits"])
+                self.assertNotIn("refresh_failures", cast)
+                self.assertLess(cast["due"], start + timedelta(hours=2))
+            finally:
+                c.close()
+
+    def test_apply_feed_result(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            write_json({"Test cast": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                stats = {"hits": 0, "misses": 0, "failed": 0, "skipped": 0}
+                cast = c.casts["Test cast"]
+
+                # errors which are not caused by the removal of the cast are not hidden
+                future = Future()
+                future.set_exception(KeyError("href"))
+                with self.assertRaises(KeyError):
+                    c._apply_feed_result("Test cast", cast, future, stats)
+
+                future = Future()
+                future.set_result(("Test cast", feedparser.parse(FEED)))
+                del c.casts["Test cast"]  # removed during the refresh
+                c._apply_feed_result("Test cast", cast, future, stats)
+                self.assertEqual({"hits": 0, "misses": 0, "failed": 0, "skipped": 1}, stats)
+            finally:
+                c.close()
+
+    def test_download_failures(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            write_json({"Test cast": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                episode = c.episode("Test cast", "ep1")
+
+                c._download_failed("Test cast", "ep1", TimeOut("timeout"))
+                self.assertEqual(1, episode["failures"])
+                self.assertFalse(episode["permanent"])
+                self.assertFalse(c.should_retry(episode))  # backing off
+                episode["failed"] -= timedelta(hours=2)
+                self.assertTrue(c.should_retry(episode))
+
+                c._download_failed("Test cast", "ep1", HTTPError(episode["href"], 404, "Not Found", Message(), None))
+                self.assertEqual(2, episode["failures"])
+                self.assertTrue(episode["permanent"])
+                self.assertIsNone(c.download_item("Test cast", "ep1", priority=PRIORITY_BULK))
+            finally:
+                c.close()
+
+    def test_close_pending_retry(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json(
+                {"casts-directory": tmpdir, "refresh-interval": 3600, "download-retry-delay": 600.0},
+                appdatadir / "config.json",
+            )
+            write_json({"Test cast": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                c.episode("Test cast", "ep1")["href"] = self.url.replace("feed.rss", "unavailable.mp3")
+                self.assertIsNotNone(c.download_item("Test cast", "ep1"))
+                deadline = time.monotonic() + 5
+                while not c.dl.delayed and time.monotonic() < deadline:  # the first attempt failed
+                    time.sleep(0.01)
+            finally:
+                start = time.monotonic()
+                c.close()
+            self.assertLess(time.monotonic() - start, 5)
+
+            # the retry is resumed by the next process
+            self.assertEqual(
+                STATE_QUEUED, DownloadJournal(appdatadir / "downloads.journal").load()[("Test cast", "ep1")]["state"]
+            )
+
+    def test_concurrent_save(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            write_json({"Test cast": {"url": self.url}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                self.assertTrue(c.load_feeds())
+                stop = threading.Event()
+
+                def save():
+                    while not stop.is_set():
+                        c.save_local()
+
+                thread = threading.Thread(target=save)
+                thread.start()
+                try:
+                    for _ in range(100):
+                        c.listenedto("Test cast", "ep1")
+                        c.forget_episode("Test cast", "ep1")
+                    c.listenedto("Test cast", "ep1")
+                finally:
+                    stop.set()
+                    thread.join(5)
+
+                c.save_local()
+                c.load_local()
+                self.assertIn("listened", c.episode("Test cast", "ep1"))
+            finally:
+                c.close()
@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from genutility.json import read_json, write_json
+
+from podcatcher.cli import main
+
+
+class CliTest(TestCase):
+    def test_update_feed_url(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            write_json({"Test cast": {"url": "http://localhost/old.xml"}}, appdatadir / "casts.json")
+
+            argv = ["podcatcher", "update-feed-url", "--appdata-dir", tmpdir]
+            with patch.object(sys, "argv", argv + ["--title", "Test cast", "--url", "http://localhost/new.xml"]):
+                main()
+
+            self.assertEqual({"Test cast": {"url": "http://localhost/new.xml"}}, read_json(appdatadir / "casts.json"))
+            self.assertFalse((appdatadir / "feeds.db.json").exists())  # the feeds database is not loaded or saved
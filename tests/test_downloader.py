@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+from urllib.error import HTTPError
+
+from genutility.http import TimeOut
+
+from podcatcher.downloader import (
+    ETAG_SUFFIX,
+    DownloadScheduler,
+    RetryPolicy,
+    download,
+    download_segmented,
+    split_ranges,
+)
+
+DATA = bytes(range(256)) * 1000
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+
+    def do_GET(self):
+        range_ = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_ and if_range in (None, self.etag):
+            start, end = range_[len("bytes=") :].split("-")
+            start, end = int(start), int(end or len(DATA) - 1)
+            body = DATA[start : end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            body = DATA
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloaderTest(TestCase):
+    url: str
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/episode.mp3"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _download_partial(self, tmpdir: str, etag: str) -> int:
+        tmppath = os.path.join(tmpdir, "episode.mp3.partial")
+        with open(tmppath, "wb") as fw:
+            fw.write(DATA[:1000])
+        with open(tmppath + ETAG_SUFFIX, "w", encoding="utf-8") as fw:
+            fw.write(etag)
+
+        resumed: List[int] = []
+        length, filename = download(self.url, tmpdir, "episode.mp3", resumed=resumed.append)
+        self.assertEqual((len(DATA), "episode.mp3"), (length, filename))
+
+        with open(os.path.join(tmpdir, filename), "rb") as fr:
+            self.assertEqual(DATA, fr.read())
+        self.assertEqual(["episode.mp3"], os.listdir(tmpdir))
+        return resumed[0]
+
+    def test_resume(self):
+        with TemporaryDirectory() as tmpdir:
+            self.assertEqual(1000, self._download_partial(tmpdir, RangeHandler.etag))
+
+    def test_resume_changed(self):
+        with TemporaryDirectory() as tmpdir:
+            self.assertEqual(0, self._download_partial(tmpdir, '"v0"'))
+
+    def test_split_ranges(self):
+        self.assertEqual([(0, 3), (4, 7), (8, 9)], split_ranges(10, 3))
+        self.assertEqual([(0, 0)], split_ranges(1, 4))
+
+    def test_download_segmented(self):
+        reports = []
+        with TemporaryDirectory() as tmpdir:
+            length, filename = download_segmented(
+                self.url, tmpdir, "episode.mp3", report=lambda done, total: reports.append(done), threshold=1000
+            )
+            self.assertEqual((len(DATA), "episode.mp3"), (length, filename))
+            with open(os.path.join(tmpdir, filename), "rb") as fr:
+                self.assertEqual(DATA, fr.read())
+            self.assertEqual(["episode.mp3"], os.listdir(tmpdir))
+        self.assertEqual(len(DATA), max(reports))
+
+
+def task(report, setter, name, event=None, log=None):
+    if event:
+        event.wait()
+    if log is not None:
+        log.append(name)
+    return setter, None, name
+
+
+class DownloadSchedulerTest(TestCase):
+    def test_priority(self):
+        event = threading.Event()
+        order = []
+        dl = DownloadScheduler(concurrent=1)
+        dl.start(task, order.append, "blocker", event)
+        while dl.get_waiting():  # wait until the blocker is running
+            time.sleep(0.01)
+        dl.start(task, order.append, "bulk", priority=0)
+        dl.start(task, order.append, "interactive", priority=10)
+        event.set()
+        dl.stop()
+        self.assertTrue(dl.join(5))
+        self.assertEqual(["blocker", "interactive", "bulk"], order)
+
+    def test_per_host(self):
+        event = threading.Event()
+        log = []
+        dl = DownloadScheduler(concurrent=2, per_host=1)
+        dl.start(task, lambda ret: None, "a1", event, log, host="a")
+        dl.start(task, lambda ret: None, "a2", None, log, host="a")
+        dl.start(task, lambda ret: None, "b1", None, log, host="b")
+        dl.stop()
+        self.assertFalse(dl.join(0.5))
+        self.assertEqual(["b1"], log)  # a2 has to wait for a1
+        event.set()
+        self.assertTrue(dl.join(5))
+        self.assertEqual(["b1", "a1", "a2"], log)
+        self.assertEqual(["a1", "a2", "b1"], sorted(dl.get_completed()))
+
+    def test_retry(self):
+        attempts = []
+
+        def flaky(report, setter):
+            attempts.append(time.monotonic())
+            status = TimeOut("timeout") if len(attempts) < 3 else None
+            return setter, status, "done"
+
+        dl = DownloadScheduler(concurrent=1, retry_policy=RetryPolicy(attempts=3, delay=0.05, jitter=0.0))
+        dl.start(flaky, lambda ret: None)
+        deadline = time.monotonic() + 5
+        while not dl.get_completed() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        dl.stop()
+        self.assertTrue(dl.join(5))
+        self.assertEqual(3, len(attempts))
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.1)  # backoff doubled
+        self.assertEqual(["done"], dl.get_completed())
+
+    def test_resume_bandwidth(self):
+        attempts = []
+
+        def resumed(report, setter):
+            attempts.append(None)
+            report(5_000_000, 6_000_000)  # resumed from a partial file
+            report(5_050_000, 6_000_000)
+            status = TimeOut("timeout") if len(attempts) < 2 else None
+            return setter, status, "done"
+
+        dl = DownloadScheduler(
+            concurrent=1, bandwidth=1_000_000, retry_policy=RetryPolicy(attempts=2, delay=0.01, jitter=0.0)
+        )
+        start = time.monotonic()
+        dl.start(resumed, lambda ret: None)
+        while not dl.get_completed() and time.monotonic() - start < 5:
+            time.sleep(0.01)
+        dl.stop()
+        self.assertTrue(dl.join(5))
+        self.assertEqual(["done"], dl.get_completed())
+        self.assertLess(time.monotonic() - start, 1.0)  # only the transferred bytes are charged
+
+
+class RetryPolicyTest(TestCase):
+    def test_retry_delay(self):
+        policy = RetryPolicy(attempts=3, delay=10.0, max_delay=100.0, jitter=0.0)
+
+        def http_error(code, retry_after=None):
+            headers = Message()
+            if retry_after is not None:
+                headers["Retry-After"] = retry_after
+            return HTTPError("http://example.com/", code, "", headers, None)
+
+        self.assertEqual(10.0, policy.retry_delay(1, TimeOut("timeout")))
+        self.assertEqual(20.0, policy.retry_delay(2, http_error(503)))
+        self.assertIsNone(policy.retry_delay(3, http_error(503)))  # out of attempts
+        self.assertIsNone(policy.retry_delay(1, http_error(404)))
+        self.assertEqual(30.0, policy.retry_delay(1, http_error(429, "30")))
+        self.assertIsNone(policy.retry_delay(1, http_error(429, "3600")))  # longer than max_delay
+        self.assertFalse(policy.is_transient(ValueError("Please provide a filename")))
@@ -0,0 +1,59 @@
+import pickle
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import feedparser
+from genutility.json import write_json
+from test_catcher import FEED
+
+from podcatcher.catcher import Catcher
+from podcatcher.episode import Episode
+
+
+class EpisodeTest(TestCase):
+    def test_mapping(self):
+        episode = Episode({"title": "Episode 1", "duration": timedelta(minutes=1), "custom": 1})
+        self.assertEqual({"title": "Episode 1", "duration": timedelta(minutes=1), "custom": 1}, dict(episode))
+        self.assertEqual(3, len(episode))
+
+        self.assertNotIn("localname", episode)
+        self.assertIsNone(episode.get("localname"))
+        with self.assertRaises(KeyError):
+            episode["localname"]
+        with self.assertRaises(KeyError):
+            del episode["error"]
+
+        episode.update(localname="ep1.mp3", failures=1)
+        self.assertEqual("ep1.mp3", episode["localname"])
+        self.assertEqual(1, episode.pop("failures"))
+        self.assertEqual(1, episode.pop("custom"))
+        self.assertEqual(["title", "duration", "localname"], list(episode))
+        self.assertEqual(episode, pickle.loads(pickle.dumps(episode)))
+
+    def test_interned(self):
+        a = Episode(mimetype="".join(["audio/", "mpeg"]))
+        b = Episode(mimetype="".join(["audio/", "mpeg"]))
+        self.assertIs(a["mimetype"], b["mimetype"])
+
+    def test_roundtrip(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            write_json({"Test cast": {"url": "http://localhost/feed.rss"}}, appdatadir / "casts.json")
+
+            c = Catcher(appdatadir)
+            try:
+                c.db = {}
+                c.update_feed("Test cast", feedparser.parse(FEED))
+                c.listenedto("Test cast", "ep1")
+                expected = dict(c.episode("Test cast", "ep1"))
+                c.save_local()
+
+                c.load_local()
+                episode = c.episode("Test cast", "ep1")
+                self.assertIsInstance(episode, Episode)
+                self.assertEqual(expected, dict(episode))
+            finally:
+                c.close()
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from podcatcher.downloader import DownloadScheduler
+from podcatcher.events import DownloadEvents, DownloadState
+from podcatcher.journal import STATE_DONE, STATE_FAILED
+
+
+def task(report, setter, url, fail=False):
+    for done in range(0, 1001, 100):
+        report(done, 1000)
+    return setter, ValueError("failed") if fail else None, (url, "episode.mp3", 1000)
+
+
+class DownloadEventsTest(TestCase):
+    def test_events(self):
+        events = DownloadEvents(progress_interval=60.0)
+        subscription = events.subscribe()
+
+        dl = DownloadScheduler(concurrent=1)
+        dl.add_listener(events)
+        dl.start(task, lambda ret: None, "http://localhost/1.mp3", key=("cast", "ep1"))
+        dl.start(task, lambda ret: None, "http://localhost/2.mp3", True, key=("cast", "ep2"))
+        dl.stop()
+        self.assertTrue(dl.join(5))
+
+        received = subscription.get(0)
+        types = [event["type"] for event in received]
+        self.assertEqual("snapshot", types[0])
+        self.assertEqual(2, types.count("queued"))
+        self.assertEqual(["completed", "failed"], [t for t in types if t in ("completed", "failed")])
+        self.assertLessEqual(types.count("progress"), 1)  # throttled
+
+        state = DownloadState()
+        for event in received:
+            state.apply(event)
+        self.assertFalse(state.is_active())
+        self.assertEqual(["episode.mp3"], [info["localname"] for info in state.with_state(STATE_DONE)])
+        self.assertEqual(["http://localhost/2.mp3"], [info["url"] for info in state.with_state(STATE_FAILED)])
+
+        # later subscribers start with the same state
+        snapshot = events.subscribe().get(0)
+        self.assertEqual(["snapshot"], [event["type"] for event in snapshot])
+        self.assertEqual(state.snapshot(), snapshot[0])
+
+    def test_overflow(self):
+        events = DownloadEvents(maxsize=2)
+        subscription = events.subscribe()
+        for i in range(5):
+            events.started(("cast", f"ep{i}"))
+
+        received = subscription.get(0)
+        self.assertEqual(["snapshot", "started"], [event["type"] for event in received])
+        self.assertEqual(4, len(received[0]["downloads"]))
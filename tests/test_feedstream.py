@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+import feedparser
+
+from podcatcher.catcher import get_entry_fingerprint, normalize_entry
+from podcatcher.feedstream import FeedStreamParser, UnsupportedFeed
+
+ITEM = """<item><title> Episode {0} </title><guid isPermaLink="false">ep{0}</guid>
+<pubDate>Tue, 21 Mar 2017 00:00:00 GMT</pubDate><itunes:duration>01:02:03</itunes:duration>
+<description>Episode &amp; number {0}</description>
+<enclosure url="http://localhost/ep{0}.mp3" length="1234" type="audio/mpeg"/></item>
+"""
+
+RSS = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"
+xmlns:sy="http://purl.org/rss/1.0/modules/syndication/"><channel><title>Test cast</title>
+<pubDate>Tue, 21 Mar 2017 00:00:00 GMT</pubDate><ttl>60</ttl><sy:updatePeriod>daily</sy:updatePeriod>
+{items}<skipHours><hour>1</hour><hour>2</hour></skipHours>
+</channel></rss>
+"""
+
+ATOM = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>Atom cast</title><updated>2017-03-21T00:00:00Z</updated>
+<entry><title>Episode 1</title><id>urn:ep1</id><link href="http://localhost/ep1"/>
+<link rel="enclosure" href="http://localhost/ep1.mp3" length="1234" type="audio/mpeg"/>
+<summary>The first episode</summary></entry>
+</feed>
+"""
+
+
+def rss(n: int) -> bytes:
+    items = "".join(ITEM.format(i) for i in range(n, 0, -1))  # newest first
+    return RSS.format(items=items).encode("utf-8")
+
+
+def parse(data: bytes, unchanged=None, chunk_size: int = 100) -> feedparser.FeedParserDict:
+    parser = FeedStreamParser(unchanged, stop_after=2)
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i : i + chunk_size])
+        if parser.done:
+            break
+    return parser.close()
+
+
+class FeedStreamParserTest(TestCase):
+    def test_same_as_feedparser(self):
+        for data in (rss(2), ATOM):
+            expected = feedparser.parse(data)
+            feed = parse(data)
+
+            self.assertEqual(len(expected.entries), len(feed.entries))
+            for truth, entry in zip(expected.entries, feed.entries):
+                self.assertEqual(truth.get("guid"), entry.get("guid"))
+                self.assertEqual(get_entry_fingerprint(truth), get_entry_fingerprint(entry))
+                self.assertEqual(normalize_entry(truth), normalize_entry(entry))
+
+            for key in ("title", "published", "ttl", "sy_updateperiod"):
+                self.assertEqual(expected.feed.get(key), feed.feed.get(key))
+
+    def test_feed_fields(self):
+        feed = parse(rss(1))
+        self.assertTrue(feed.complete)
+        self.assertEqual([1, 2], feed.skiphours)
+        self.assertEqual("Tue, 21 Mar 2017 00:00:00 GMT", feed.feed.published)
+
+    def test_stop_early(self):
+        known = {"ep3", "ep2", "ep1"}
+        feed = parse(rss(5), lambda entry: entry.get("guid") in known)
+
+        self.assertFalse(feed.complete)
+        self.assertEqual(["ep5", "ep4"], [entry.get("guid") for entry in feed.entries])
+        self.assertEqual(2, feed.skipped)
+        self.assertNotIn("skiphours", feed)  # after the entries
+
+    def test_unsupported(self):
+        with self.assertRaises(UnsupportedFeed):
+            parse(b"<html><body></body></html>")
@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+from unittest import TestCase
+
+from podcatcher.index import EpisodeIndex, decode_cursor
+
+
+def date(day):
+    return datetime(2020, 1, day, tzinfo=timezone.utc)
+
+
+class EpisodeIndexTest(TestCase):
+    def setUp(self):
+        self.db = {
+            "a": {"items": {"a1": {"date": date(1)}, "a3": {"date": date(3)}, "a0": {"date": None}}},
+            "b": {"items": {"b2": {"date": date(2)}, "b4": {"date": date(4)}}},
+        }
+        self.index = EpisodeIndex()
+        self.index.build(self.db)
+
+    def pages(self, **kwargs):
+        cursor = None
+        keys = []
+        while True:
+            page, cursor = self.index.page(cursor=cursor, limit=2, **kwargs)
+            keys.extend(episode_uid for _cast_uid, episode_uid in page)
+            if cursor is None:
+                return keys
+
+    def test_page(self):
+        self.assertEqual(["b4", "a3", "b2", "a1", "a0"], self.pages())
+        self.assertEqual(["a0", "a1", "b2", "a3", "b4"], self.pages(descending=False))
+        self.assertEqual(["a3", "a1", "a0"], self.pages(cast_uid="a"))
+        self.assertEqual(5, self.index.count())
+        self.assertEqual(2, self.index.count("b"))
+
+    def test_update(self):
+        page, cursor = self.index.page(limit=2)
+        self.assertEqual([("b", "b4"), ("a", "a3")], page)
+
+        self.db["b"]["items"]["b5"] = {"date": date(5)}
+        self.index.update(self.db, "b", "b5")
+        self.db["a"]["items"]["a1"]["date"] = date(6)
+        self.index.update(self.db, "a", "a1")
+        del self.db["b"]["items"]["b2"]
+        self.index.update(self.db, "b", "b2")
+
+        # the cursor stays valid
+        self.assertEqual([("a", "a0")], self.index.page(cursor=cursor, limit=2)[0])
+        self.assertEqual(["a1", "b5", "b4", "a3", "a0"], self.pages())
+
+        del self.db["a"]
+        self.index.update(self.db, "a")
+        self.assertEqual(["b5", "b4"], self.pages())
+        self.assertEqual(0, self.index.count("a"))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor("invalid")
@@ -0,0 +1,48 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from podcatcher.journal import STATE_DONE, STATE_FAILED, STATE_QUEUED, DownloadJournal
+
+
+class DownloadJournalTest(TestCase):
+    def test_replay(self):
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "downloads.journal"
+            journal = DownloadJournal(path, progress_interval=0)
+            journal.record(("cast", "ep1"), STATE_QUEUED, priority=10)
+            journal.started(("cast", "ep1"))
+            journal.progress(("cast", "ep1"), 100, 1000)
+            journal.record(("cast", "ep2"), STATE_QUEUED, priority=0)
+            journal.finished(("cast", "ep2"), None, ("http://localhost/ep2.mp3", "ep2.mp3", 1000))
+            self.assertTrue(journal.is_active(("cast", "ep1")))
+            self.assertFalse(journal.is_active(("cast", "ep2")))
+            journal.close()
+
+            with open(path, "a", encoding="utf-8") as fw:
+                fw.write('{"cast": "cast", "epi')  # truncated by a crash
+
+            journal = DownloadJournal(path)
+            items = journal.load()
+            self.assertEqual({"state": "running", "priority": 10, "done": 100, "total": 1000}, items[("cast", "ep1")])
+            self.assertEqual(STATE_DONE, items[("cast", "ep2")]["state"])
+            self.assertFalse(journal.is_active(("cast", "ep1")))  # not queued by this process
+
+            journal.compact(journal.mark())
+            self.assertEqual([("cast", "ep1")], list(DownloadJournal(path).load()))
+            journal.close()
+
+    def test_compact_failed(self):
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "downloads.journal"
+            journal = DownloadJournal(path)
+            journal.record(("cast", "ep1"), STATE_QUEUED)
+            journal.finished(("cast", "ep1"), OSError("failed"), ("http://localhost/ep1.mp3", None, None))
+            mark = journal.mark()
+            journal.record(("cast", "ep2"), STATE_FAILED, reason="Episode not found")
+
+            journal.compact(mark)
+            self.assertEqual([("cast", "ep2")], list(DownloadJournal(path).load()))  # failed after the mark
+            journal.compact(journal.mark())
+            self.assertEqual({}, DownloadJournal(path).load())
+            journal.close()
@@ -0,0 +1,57 @@
+import threading
+from unittest import TestCase
+
+from podcatcher.locks import KeyLocks, RWLock
+
+
+class RWLockTest(TestCase):
+    def test_reentrant(self):
+        lock = RWLock()
+        with lock.write():
+            with lock.write(), lock.read(), lock.read():
+                pass
+        with lock.read(), lock.read():
+            with self.assertRaises(RuntimeError):
+                with lock.write():
+                    pass
+        # released completely
+        with lock.write():
+            pass
+
+    def test_exclusive(self):
+        lock = RWLock()
+        readers = threading.Barrier(2, timeout=5)
+        writing = threading.Event()
+        log = []
+
+        def reader():
+            with lock.read():
+                readers.wait()  # both readers hold the lock at the same time
+                log.append("read")
+
+        def writer():
+            with lock.write():
+                writing.set()
+                log.append("write")
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        with lock.write():
+            for thread in threads:
+                thread.start()
+            writer_thread = threading.Thread(target=writer)
+            writer_thread.start()
+            self.assertFalse(writing.wait(0.1))
+            log.append("first")
+
+        for thread in threads + [writer_thread]:
+            thread.join(5)
+
+        self.assertEqual("first", log[0])
+        self.assertEqual(["read", "read", "write"], sorted(log[1:]))
+
+
+class KeyLocksTest(TestCase):
+    def test_locks(self):
+        locks = KeyLocks()
+        self.assertIs(locks("a"), locks("a"))
+        self.assertIsNot(locks("a"), locks("b"))
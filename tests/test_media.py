@@ -0,0 +1,109 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from flask import Flask, request
+
+from podcatcher.media import MediaFile, PathCache, parse_ranges, send_media
+
+DATA = bytes(range(256)) * 4
+
+
+class SendMediaTest(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        path = Path(self.tmpdir.name) / "episode.mp3"
+        path.write_bytes(DATA)
+
+        app = Flask(__name__)
+        app.add_url_rule("/media", "media", lambda: send_media(request, MediaFile(path, "audio/mpeg")))
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get(self, **headers):
+        response = self.client.get("/media", headers=headers)
+        response.get_data()
+        response.close()
+        return response
+
+    def test_complete(self):
+        response = self.get()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(DATA, response.data)
+        self.assertEqual("bytes", response.headers["Accept-Ranges"])
+        self.assertEqual("inline; filename=episode.mp3", response.headers["Content-Disposition"])
+        self.assertIn("max-age", response.headers["Cache-Control"])
+
+        self.assertEqual(304, self.get(**{"If-None-Match": response.headers["ETag"]}).status_code)
+        self.assertEqual(200, self.get(**{"If-None-Match": '"other"'}).status_code)
+
+    def test_single_range(self):
+        response = self.get(Range="bytes=10-19")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(DATA[10:20], response.data)
+        self.assertEqual(f"bytes 10-19/{len(DATA)}", response.headers["Content-Range"])
+
+        self.assertEqual(DATA[-5:], self.get(Range="bytes=-5").data)
+        self.assertEqual(DATA[1000:], self.get(Range="bytes=1000-").data)
+        self.assertEqual(416, self.get(Range="bytes=5000-").status_code)
+
+        # the file changed since the client got its first part
+        self.assertEqual(200, self.get(Range="bytes=10-19", **{"If-Range": '"other"'}).status_code)
+        etag = self.get().headers["ETag"]
+        self.assertEqual(206, self.get(Range="bytes=10-19", **{"If-Range": etag}).status_code)
+
+    def test_multiple_ranges(self):
+        response = self.get(Range="bytes=0-9,100-109,5-14")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual("multipart/byteranges", response.mimetype)
+        self.assertEqual(len(response.data), response.content_length)
+
+        boundary = response.mimetype_params["boundary"].encode("ascii")
+        parts = response.data.split(b"--" + boundary)[1:-1]
+        self.assertEqual(2, len(parts))  # overlapping ranges are merged
+        self.assertTrue(parts[0].endswith(b"\r\n\r\n" + DATA[0:15] + b"\r\n"))
+        self.assertIn(f"Content-Range: bytes 100-109/{len(DATA)}".encode("ascii"), parts[1])
+
+
+class PathCacheTest(TestCase):
+    def test_cache(self):
+        calls = []
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        for name in "abc":
+            (Path(tmpdir.name) / name).write_bytes(DATA)
+
+        def resolve(key):
+            calls.append(key)
+            return MediaFile(Path(tmpdir.name) / key, None) if key != "missing" else None
+
+        cache = PathCache(resolve, maxsize=2)
+        self.assertEqual(Path(tmpdir.name) / "a", cache.get("a").path)
+        cache.get("a")
+        self.assertIsNone(cache.get("missing"))
+        self.assertIsNone(cache.get("missing"))
+        cache.get("b")
+        cache.get("c")  # evicts "a"
+        cache.get("a")
+        cache.invalidate("a")
+        cache.get("a")
+        self.assertEqual(["a", "missing", "missing", "b", "c", "a", "a"], calls)
+
+        # deleted by another process
+        (Path(tmpdir.name) / "a").unlink()
+        cache.get("a")
+        self.assertEqual("a", calls[-1])
+        self.assertEqual(8, len(calls))
+
+
+class ParseRangesTest(TestCase):
+    def test_parse(self):
+        self.assertEqual([(0, 10), (90, 100)], parse_ranges("bytes=90-, 0-4,3-9", 100))
+        self.assertEqual([(50, 100)], parse_ranges("bytes=-50", 100))
+        self.assertEqual([(0, 100)], parse_ranges("bytes=-500", 100))
+        self.assertEqual([], parse_ranges("bytes=100-200", 100))
+        self.assertIsNone(parse_ranges("bytes=5-1", 100))
+        self.assertIsNone(parse_ranges("bytes=a-b", 100))
+        self.assertIsNone(parse_ranges("items=0-1", 100))
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from unittest import TestCase
+
+from podcatcher.refresh import AsyncFeedFetcher, RefreshWorker
+
+
+class CountingServer(ThreadingHTTPServer):
+    """Counts the TCP connections and the peak number of concurrent requests."""
+
+    daemon_threads = True
+
+    def __init__(self, redirect: Optional[str] = None) -> None:
+        super().__init__(("127.0.0.1", 0), CountingHandler)
+        self.redirect = redirect
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.active = 0
+        self.peak = 0
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: CountingServer
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        time.sleep(0.05)
+        with self.server.lock:
+            self.server.active -= 1
+
+        if self.server.redirect:
+            self.send_response(302)
+            self.send_header("Location", self.server.redirect + self.path)
+            body = b""
+        else:
+            self.send_response(200)
+            body = b"<rss/>"
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AsyncFeedFetcherTest(TestCase):
+    def fetch_all(self, fetcher, urls):
+        async def main():
+            return await asyncio.gather(*(fetcher.fetch(url) for url in urls))
+
+        try:
+            return asyncio.run(main())
+        finally:
+            fetcher.close()
+
+    def test_keep_alive(self):
+        server = CountingServer()
+        try:
+            fetcher = AsyncFeedFetcher(concurrency=10, per_host=2)
+            results = self.fetch_all(fetcher, [f"{server.url}/feed{i}.rss" for i in range(10)])
+            self.assertEqual([b"<rss/>"] * 10, [body for _url, _status, _headers, body in results])
+            self.assertLessEqual(server.peak, 2)
+            self.assertLessEqual(server.connections, 2)  # the connections are reused
+        finally:
+            server.close()
+
+    def test_redirect_host_limit(self):
+        target = CountingServer()
+        origins = [CountingServer(target.url), CountingServer(target.url)]
+        try:
+            fetcher = AsyncFeedFetcher(concurrency=10, per_host=1)
+            urls = [f"{origin.url}/feed{i}.rss" for origin in origins for i in range(3)]
+            results = self.fetch_all(fetcher, urls)
+            self.assertEqual(f"{target.url}/feed0.rss", results[0][0])
+            self.assertEqual(1, target.peak)  # redirects from both origins share the limit of the target
+        finally:
+            for server in [target, *origins]:
+                server.close()
+
+
+class RefreshWorkerTest(TestCase):
+    def test_coalesce(self):
+        event = threading.Event()
+        calls = []
+
+        def refresh(force, progress):
+            calls.append(force)
+            progress(1, 2)
+            event.wait()
+            return {"misses": len(calls)}
+
+        worker = RefreshWorker(refresh)
+        self.assertTrue(worker.trigger())
+        while not worker.status()["running"]:
+            time.sleep(0.01)
+        self.assertEqual((1, 2), (worker.status()["done"], worker.status()["total"]))
+
+        # requests during a refresh are coalesced into one more refresh
+        self.assertTrue(worker.trigger())
+        self.assertFalse(worker.trigger(force=True))
+        event.set()
+        worker.stop()
+        self.assertTrue(worker.join(5))
+
+        self.assertEqual([False, True], calls)
+        status = worker.status()
+        self.assertFalse(status["running"])
+        self.assertEqual({"misses": 2}, status["stats"])
+        self.assertIsNone(status["error"])
+
+    def test_error(self):
+        def refresh(force, progress):
+            raise ValueError("failed")
+
+        worker = RefreshWorker(refresh)
+        worker.trigger()
+        worker.stop()
+        self.assertTrue(worker.join(5))
+        self.assertEqual("failed", worker.status()["error"])
+        with self.assertRaises(RuntimeError):
+            worker.trigger()
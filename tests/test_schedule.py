@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+import feedparser
+
+from podcatcher.schedule import (
+    failure_interval,
+    next_due,
+    parse_skip_hours,
+    publisher_interval,
+    publishing_interval,
+    refresh_interval,
+)
+
+FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:sy="http://purl.org/rss/1.0/modules/syndication/"><channel><title>Test cast</title>
+<ttl>60</ttl><sy:updatePeriod>daily</sy:updatePeriod><sy:updateFrequency>2</sy:updateFrequency>
+<skipHours><hour>1</hour><hour>2</hour></skipHours>
+</channel></rss>
+"""
+
+
+class ScheduleTest(TestCase):
+    def test_feed_hints(self):
+        feed = feedparser.parse(FEED)
+        self.assertEqual(timedelta(hours=12), publisher_interval(feed))
+        self.assertEqual([1, 2], parse_skip_hours(FEED))
+
+    def test_publishing_interval(self):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        dates = [start + timedelta(days=7 * i) for i in range(20)] + [None]
+        self.assertEqual(timedelta(days=7), publishing_interval(dates))
+        self.assertIsNone(publishing_interval([start, None]))
+        # two intervals, the median is their mean
+        self.assertEqual(
+            timedelta(days=2), publishing_interval([start, start + timedelta(days=1), start + timedelta(days=4)])
+        )
+
+    def test_refresh_interval(self):
+        hour = timedelta(hours=1)
+        self.assertEqual(hour, refresh_interval(hour))
+        self.assertEqual(timedelta(hours=6), refresh_interval(hour, cadence=timedelta(days=1)))
+        self.assertEqual(timedelta(days=1), refresh_interval(hour, cadence=timedelta(days=30)))
+        self.assertEqual(timedelta(days=2), refresh_interval(hour, timedelta(days=2), timedelta(days=30)))
+
+    def test_failure_interval(self):
+        hour = timedelta(hours=1)
+        self.assertEqual(timedelta(hours=2), failure_interval(hour, 1))
+        self.assertEqual(timedelta(hours=8), failure_interval(hour, 3))
+        self.assertEqual(timedelta(days=1), failure_interval(hour, 10))
+        self.assertEqual(timedelta(days=2), failure_interval(timedelta(days=2), 3))
+
+    def test_next_due(self):
+        last = datetime(2024, 1, 1, 0, 30, tzinfo=timezone.utc)
+        self.assertEqual(datetime(2024, 1, 1, 1, 30, tzinfo=timezone.utc), next_due(last, timedelta(hours=1)))
+        self.assertEqual(datetime(2024, 1, 1, 3, tzinfo=timezone.utc), next_due(last, timedelta(hours=1), [1, 2]))
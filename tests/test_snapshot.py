@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from test_storage import make_db
+
+from podcatcher.snapshot import Snapshot, SnapshotError, write_snapshot
+from podcatcher.storage import JsonStorage
+
+
+class SnapshotTest(TestCase):
+    def test_roundtrip(self):
+        db = make_db()
+        db["cast"]["items"]["ep3"] = {
+            "title": "Episode 3",
+            "date": datetime(2017, 3, 21, 12, 30, tzinfo=timezone(timedelta(hours=-5))),
+            "listened": datetime(1960, 1, 1, 0, 0, 0, 1),  # naive
+            "length": "1234",  # doesn't fit the column
+            "failures": 2,
+            "permanent": False,
+            "custom": {"a": [1, 2]},
+        }
+        db["empty"] = {"date": None, "items": {}}
+
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "feeds.db.snapshot"
+            json_path = Path(tmpdir) / "feeds.db.json"
+            json_path.write_text("{}")
+            write_snapshot(db, path, json_path)
+
+            snapshot = Snapshot(path, json_path)
+            self.assertEqual(["cast", "empty"], snapshot.cast_uids())
+            for cast_uid in db:
+                self.assertEqual(db[cast_uid], snapshot.load_cast(cast_uid))
+            date = snapshot.load_cast("cast")["items"]["ep3"]["date"]
+            self.assertEqual(timedelta(hours=-5), date.utcoffset())
+            snapshot.close()
+
+            data = path.read_bytes()
+            path.write_bytes(data[:-1])
+            with self.assertRaises(SnapshotError):
+                Snapshot(path, json_path)
+
+            path.write_bytes(data[:-1] + bytes([data[-1] ^ 1]))  # same size, different string data
+            with self.assertRaises(SnapshotError):
+                Snapshot(path, json_path)
+
+            json_path.write_text("{} ")
+            with self.assertRaises(SnapshotError):
+                Snapshot(path, json_path)
+
+            path.write_bytes(b"invalid")
+            with self.assertRaises(SnapshotError):
+                Snapshot(path, json_path)
+
+    def test_json_storage(self):
+        db = make_db()
+        with TemporaryDirectory() as tmpdir:
+            json_path = Path(tmpdir) / "feeds.db.json"
+            snapshot_path = Path(tmpdir) / "feeds.db.snapshot"
+            storage = JsonStorage(json_path, snapshot_path=snapshot_path)
+            storage.save(db, {("cast", None)})
+            self.assertTrue(snapshot_path.exists())
+
+            storage = JsonStorage(json_path, snapshot_path=snapshot_path)
+            self.assertEqual(["cast"], storage.cast_uids())
+            self.assertIsNotNone(storage.snapshot)
+            self.assertEqual(db["cast"], storage.load_cast("cast"))
+            self.assertEqual(db["cast"], storage.load_cast("cast"))  # loaded again from the snapshot
+
+            # written by a version without snapshots
+            JsonStorage(json_path).save({}, {("cast", None)})
+            self.assertEqual([], storage.cast_uids())
+            self.assertIsNone(storage.snapshot)
+            storage.close()
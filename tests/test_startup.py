@@ -0,0 +1,74 @@
+import json
+import subprocess  # nosec B404
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from genutility.json import BuiltinRoundtripEncoder, write_json
+from test_storage import make_db
+
+from podcatcher.catcher import Catcher
+
+# imported when feeds are refreshed or downloads are shown
+DEFERRED_MODULES = ["asyncio", "certifi", "feedparser", "rich.progress", "rich.table"]
+
+STARTUP = """
+import json, sys
+preloaded = set(sys.modules)  # by .pth files of site-packages for example
+
+from pathlib import Path
+from podcatcher.cli import Catcher
+
+c = Catcher(Path(sys.argv[1]))
+c.load_feeds()
+c.episode("Test cast", "ep1")
+loaded = [cast_uid for cast_uid in c.db if c.db.loaded(cast_uid)]
+c.close()
+modules = [name for name in json.loads(sys.argv[2]) if name in sys.modules.keys() - preloaded]
+print(json.dumps({"modules": modules, "loaded": loaded}))
+"""
+
+
+class StartupTest(TestCase):
+    def test_deferred(self):
+        with TemporaryDirectory() as tmpdir:
+            appdatadir = Path(tmpdir)
+            write_json({"casts-directory": tmpdir, "refresh-interval": 3600}, appdatadir / "config.json")
+            casts = {"Test cast": {"url": "http://localhost/feed.rss"}, "Other cast": {"url": "http://localhost/other"}}
+            write_json(casts, appdatadir / "casts.json")
+            write_json({cast_uid: {"date": None, "items": {}} for cast_uid in casts}, appdatadir / "feeds.db.json")
+
+            args = [sys.executable, "-c", STARTUP, tmpdir, json.dumps(DEFERRED_MODULES)]
+            result = json.loads(subprocess.check_output(args))  # nosec B603
+
+        self.assertEqual([], result["modules"])
+        self.assertEqual(["Test cast"], result["loaded"])
+
+
+class LazyLoadTest(TestCase):
+    def test_index_and_save(self):
+        for config in ({}, {"feeds-snapshot": True}, {"storage": "sqlite"}):
+            with TemporaryDirectory() as tmpdir:
+                appdatadir = Path(tmpdir)
+                write_json({"casts-directory": tmpdir, "refresh-interval": 3600, **config}, appdatadir / "config.json")
+                write_json({"cast": {"url": "http://localhost/feed.rss"}}, appdatadir / "casts.json")
+                write_json(make_db(), appdatadir / "feeds.db.json", cls=BuiltinRoundtripEncoder)
+
+                c = Catcher(appdatadir)
+                try:
+                    c.load_local()
+                    c.save_local()  # writes the snapshot
+                    c.load_local()
+
+                    self.assertEqual(2, c.count_episodes())
+                    c.save_local()
+                    self.assertFalse(c.db.loaded("cast"), config)
+
+                    page, _ = c.episodes()  # loads the casts of the page
+                    self.assertEqual(["ep1", "ep2"], [episode_uid for _, episode_uid, _ in page])
+
+                    c.load_local()
+                    self.assertEqual(make_db()["cast"]["items"]["ep1"], dict(c.episode("cast", "ep1")))
+                finally:
+                    c.close()
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from genutility.json import BuiltinRoundtripEncoder, write_json
+
+from podcatcher.storage import JsonStorage, LazyDatabase, SqliteStorage, split_descriptions
+
+
+def make_db() -> dict:
+    date = datetime(2017, 3, 21, tzinfo=timezone.utc)
+    return {
+        "cast": {
+            "date": date,
+            "etag": '"v1"',
+            "items": {
+                "ep1": {
+                    "title": "Episode 1",
+                    "date": date,
+                    "duration": timedelta(minutes=30),
+                    "href": "http://localhost/ep1.mp3",
+                    "length": 1234,
+                    "mimetype": "audio/mpeg",
+                    "localname": "ep1.mp3",
+                },
+                "ep2": {
+                    "title": "Episode 2",
+                    "date": None,
+                    "duration": None,
+                    "href": None,
+                    "length": None,
+                    "mimetype": None,
+                    "listened": date,
+                },
+            },
+        }
+    }
+
+
+class SqliteStorageTest(TestCase):
+    def test_roundtrip(self):
+        db = make_db()
+        with TemporaryDirectory() as tmpdir:
+            storage = SqliteStorage(Path(tmpdir) / "feeds.db.sqlite")
+            with self.assertRaises(FileNotFoundError):
+                storage.load()
+
+            storage.save(db, {("cast", None), ("cast", "ep1"), ("cast", "ep2")}, {("cast", "ep1"): "Description"})
+            self.assertEqual(db, storage.load())
+            self.assertEqual("Description", storage.load_description("cast", "ep1"))
+            self.assertIsNone(storage.load_description("cast", "ep2"))
+
+            del db["cast"]["items"]["ep2"]
+            db["cast"]["items"]["ep1"]["listened"] = db["cast"]["date"]
+            storage.save(db, {("cast", "ep1"), ("cast", "ep2")})
+            self.assertEqual(db, storage.load())
+            self.assertEqual("Description", storage.load_description("cast", "ep1"))  # kept by updates
+
+            del db["cast"]
+            storage.save(db, {("cast", None)})
+            self.assertEqual({}, storage.load())
+            storage.close()
+
+    def test_migrate(self):
+        db = make_db()
+        db["cast"]["items"]["ep1"]["description"] = "Description"  # stored in the database by older versions
+        with TemporaryDirectory() as tmpdir:
+            json_path = Path(tmpdir) / "feeds.db.json"
+            write_json(db, json_path, cls=BuiltinRoundtripEncoder)
+
+            storage = SqliteStorage(Path(tmpdir) / "feeds.db.sqlite", json_path)
+            self.assertEqual({("cast", "ep1"): "Description"}, split_descriptions(db))
+            self.assertEqual(db, storage.load())
+            self.assertEqual("Description", storage.load_description("cast", "ep1"))
+            self.assertFalse(json_path.exists())
+            storage.close()
+
+
+class JsonStorageTest(TestCase):
+    def test_descriptions(self):
+        db = make_db()
+        with TemporaryDirectory() as tmpdir:
+            storage = JsonStorage(Path(tmpdir) / "feeds.db.json")
+            storage.save(db, {("cast", None)}, {("cast", "ep1"): "Description"})
+            self.assertEqual(1, len(list((Path(tmpdir) / "feeds.db.descriptions").iterdir())))
+
+            storage = JsonStorage(Path(tmpdir) / "feeds.db.json")
+            self.assertEqual(db, storage.load())
+            self.assertEqual("Description", storage.load_description("cast", "ep1"))
+
+            del db["cast"]
+            storage.save(db, {("cast", None)})
+            self.assertIsNone(storage.load_description("cast", "ep1"))
+            self.assertEqual([], list((Path(tmpdir) / "feeds.db.descriptions").iterdir()))
+
+    def test_legacy_descriptions(self):
+        with TemporaryDirectory() as tmpdir:
+            write_json({"cast": {"ep1": "Description"}}, Path(tmpdir) / "feeds.db.descriptions.json")
+            storage = JsonStorage(Path(tmpdir) / "feeds.db.json")
+            self.assertEqual("Description", storage.load_description("cast", "ep1"))
+            self.assertEqual({("cast", "ep1"): "Description"}, storage.load_descriptions())
+            self.assertFalse((Path(tmpdir) / "feeds.db.descriptions.json").exists())
+
+
+class LazyDatabaseTest(TestCase):
+    def test_load_cast(self):
+        db = make_db()
+        db["other"] = {"date": None, "items": {}}
+        with TemporaryDirectory() as tmpdir:
+            write_json(db, Path(tmpdir) / "feeds.db.json", cls=BuiltinRoundtripEncoder)
+            for storage in (
+                JsonStorage(Path(tmpdir) / "feeds.db.json"),
+                SqliteStorage(Path(tmpdir) / "feeds.db.sqlite", json_path=Path(tmpdir) / "feeds.db.json"),
+            ):
+                loaded = []
+
+                def load(cast_uid):
+                    loaded.append(cast_uid)
+                    return storage.load_cast(cast_uid)
+
+                lazy = LazyDatabase(storage.cast_uids(), load)
+                self.assertEqual(["cast", "other"], sorted(lazy))
+                self.assertIn("cast", lazy)
+                self.assertEqual([], loaded)
+
+                self.assertEqual(db["cast"], lazy["cast"])
+                self.assertEqual(db["cast"], lazy["cast"])
+                self.assertEqual(["cast"], loaded)
+                self.assertFalse(lazy.loaded("other"))
+
+                self.assertEqual(db["cast"], storage.load_cast("cast"))  # loaded again
+                with self.assertRaises(KeyError):
+                    storage.load_cast("missing")
+                storage.close()
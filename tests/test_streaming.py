@@ -0,0 +1,170 @@
+import gzip
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from podcatcher.streaming import EXPIRY_MARGIN, CachedFeed, FeedCache, VideoCache, YoutubeToFeed
+from podcatcher.youtube import Playlist, PlaylistEntry, Video, VideoUnavailable, YoutubeClient
+
+
+class FeedCacheTest(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "cache.sqlite"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def put(self, cache, playlist):
+        return cache.put(playlist, {"rss": f"rss-{playlist}".encode(), "atom": f"atom-{playlist}".encode()})
+
+    def test_lru(self):
+        cache = FeedCache(self.path)
+        try:
+            size = sum(len(entry.data) for entry in self.put(cache, "a").values())
+        finally:
+            cache.close()
+        self.path.unlink()
+
+        cache = FeedCache(self.path, max_size=2 * size)
+        try:
+            self.put(cache, "a")
+            self.put(cache, "b")
+            self.assertEqual(b"atom-a", cache.get("a", "atom").data)  # "b" is the least recently used now
+            self.put(cache, "c")
+
+            self.assertIsNone(cache.get("b", "rss"))
+            self.assertEqual(b"rss-a", cache.get("a", "rss").data)
+            self.assertEqual(b"rss-c", gzip.decompress(cache.get("c", "rss", "gzip").data))
+            stats = cache.stats()
+            self.assertEqual((3, 1, 1, 2), (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]))
+
+            with self.assertRaises(ValueError):
+                cache.get("a", "json")
+        finally:
+            cache.close()
+
+        # entries are persistent
+        cache = FeedCache(self.path)
+        try:
+            self.assertEqual(b"rss-c", cache.get("c", "rss").data)
+        finally:
+            cache.close()
+
+    def test_encodings(self):
+        cache = FeedCache(self.path)
+        try:
+            entries = self.put(cache, "a")
+            gzipped = cache.get("a", "rss", "gzip")
+            self.assertEqual(b"rss-a", gzip.decompress(gzipped.data))
+            self.assertNotEqual(gzipped.etag, cache.get("a", "rss").etag)
+            self.assertEqual(entries[("rss", "gzip")], gzipped)
+
+            self.assertEqual(CachedFeed(gzipped.etag, None), cache.get("a", "rss", "gzip", {gzipped.etag}))
+            self.assertEqual(1, cache.stats()["not_modified"])
+
+            # unchanged feeds keep their etag
+            self.assertEqual(gzipped.etag, self.put(cache, "a")[("rss", "gzip")].etag)
+        finally:
+            cache.close()
+
+    def test_ttl(self):
+        cache = FeedCache(self.path, ttl=timedelta(seconds=-1))
+        try:
+            self.put(cache, "a")
+            self.assertIsNone(cache.get("a", "rss"))
+            self.assertEqual(0, cache.stats()["entries"])
+        finally:
+            cache.close()
+
+
+class VideoCacheTest(TestCase):
+    def test_url_expiry(self):
+        with TemporaryDirectory() as tmpdir:
+            cache = VideoCache(Path(tmpdir) / "cache.sqlite")
+            try:
+                soon = int(time.time()) + EXPIRY_MARGIN // 2
+                later = int(time.time()) + 3600 + EXPIRY_MARGIN
+                videos = [
+                    Video(video_id, "", "", "", "00:01:00", url, "audio/mp4")
+                    for video_id, url in [
+                        ("a", "http://localhost/a"),
+                        ("b", f"http://localhost/b?expire={soon}&sig=x"),
+                        ("c", f"http://localhost/c?expire={later}"),
+                    ]
+                ]
+                cache.put_many(videos)
+                self.assertEqual(["a", "c"], sorted(cache.get_many(["a", "b", "c"])))
+            finally:
+                cache.close()
+
+
+class StubClient(YoutubeClient):
+    def __init__(self, video_ids, expire=None):
+        self.video_ids = video_ids
+        self.expire = expire
+        self.resolved = []
+        self.lock = threading.Lock()
+
+    def playlist(self, url):
+        date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        entries = [PlaylistEntry(video_id, date, date) for video_id in self.video_ids]
+        return Playlist("Playlist", "Author", "Description"), entries
+
+    def video(self, video_id):
+        with self.lock:
+            self.resolved.append(video_id)
+        if video_id == "private":
+            raise VideoUnavailable(video_id)
+        url = (
+            f"http://localhost/{video_id}"
+            if self.expire is None
+            else f"http://localhost/{video_id}?expire={self.expire}"
+        )
+        return Video(video_id, f"Video {video_id}", "Author", "", "00:01:00", url, "audio/mp4")
+
+
+class YoutubeToFeedTest(TestCase):
+    def test_get_feed(self):
+        with TemporaryDirectory() as tmpdir:
+            client = StubClient(["a", "b", "private"])
+            yt = YoutubeToFeed(Path(tmpdir) / "cache.sqlite", client=client)
+            try:
+                playlist = "https://www.youtube.com/playlist?list=test"
+                rss = yt.get_feed(playlist, "rss").data
+                self.assertIn(b"Video b", rss)
+                self.assertNotIn(b"private", rss)
+                self.assertIn(b"<feed", gzip.decompress(yt.get_feed(playlist, "atom", "gzip").data))
+                self.assertEqual(1, yt.cache.stats()["hits"])
+                self.assertEqual(["a", "b", "private"], sorted(client.resolved))
+
+                # only new and unavailable videos are resolved again
+                client.video_ids = ["c", "a", "b", "private"]
+                client.resolved = []
+                feed = yt.create_feed(playlist)
+                self.assertEqual(["c", "private"], sorted(client.resolved))
+                self.assertEqual(["Video a", "Video b", "Video c"], sorted(entry.title() for entry in feed.entry()))
+            finally:
+                yt.close()
+
+    def test_expired_urls(self):
+        with TemporaryDirectory() as tmpdir:
+            # the stream urls are already within the margin before they expire
+            client = StubClient(["a", "b"], expire=int(time.time()) + EXPIRY_MARGIN // 2)
+            yt = YoutubeToFeed(Path(tmpdir) / "cache.sqlite", client=client)
+            try:
+                playlist = "https://www.youtube.com/playlist?list=test"
+                yt.get_feed(playlist, "rss")
+                client.resolved = []
+                self.assertIn(b"Video b", yt.get_feed(playlist, "rss").data)
+                self.assertEqual(["a", "b"], sorted(client.resolved))
+                self.assertEqual(0, yt.cache.stats()["hits"])
+            finally:
+                yt.close()
+
+    def test_abstract_client(self):
+        with self.assertRaises(TypeError):
+            YoutubeClient()
@@ -0,0 +1,128 @@
+import gzip
+from email.message import Message
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from urllib.error import HTTPError
+
+import feedparser
+from flask import url_for
+from genutility.json import write_json
+from test_streaming import StubClient
+
+from podcatcher.catcher import Catcher
+from podcatcher.journal import STATE_QUEUED
+from podcatcher.serve import connect_catcher, share_catcher
+from podcatcher.streaming import YoutubeToFeed
+from podcatcher.web import create_app
+
+FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Test cast</title>
+<item><title>Episode 1</title><guid>ep1</guid><pubDate>Tue, 21 Mar 2017 00:00:00 GMT</pubDate>
+<description>The first episode</description>
+<enclosure url="http://localhost/ep1.mp3" length="1234" type="audio/mpeg"/></item>
+</channel></rss>
+"""
+
+
+class WebTest(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        appdatadir = Path(self.tmpdir.name)
+        write_json({"casts-directory": self.tmpdir.name, "refresh-interval": 3600}, appdatadir / "config.json")
+        write_json({"Test cast": {"url": "http://localhost/feed.xml"}}, appdatadir / "casts.json")
+
+        self.catcher = Catcher(appdatadir)
+        self.catcher.db = {}
+        self.catcher.update_feed("Test cast", feedparser.parse(FEED))
+
+    def tearDown(self):
+        self.catcher.close()
+        self.tmpdir.cleanup()
+
+    def check_app(self, app):
+        client = app.test_client()
+        with app.test_request_context():
+            episode_url = url_for("podcatcher.episode_json", cast_uid="Test cast", episode_uid="ep1")
+            listento_url = url_for("podcatcher.listento", cast_uid="Test cast", episode_uid="ep1")
+
+        response = client.get("/")
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b"Episode 1", response.data)
+
+        info = client.get(episode_url).get_json()
+        self.assertEqual("The first episode", info["description"])
+        self.assertIsNone(info["listened"])
+
+        self.assertEqual(302, client.get(listento_url).status_code)
+        self.assertIsNotNone(client.get(episode_url).get_json()["listened"])
+        self.assertIn("listened", self.catcher.episode("Test cast", "ep1"))
+
+    def test_create_app(self):
+        self.check_app(create_app(Path(self.tmpdir.name), catcher=self.catcher))
+
+    def test_shared_catcher(self):
+        address, authkey = share_catcher(self.catcher)
+        self.check_app(create_app(Path(self.tmpdir.name), catcher=connect_catcher(address, authkey)))
+
+    def test_shared_download_status(self):
+        url = "http://localhost/ep1.mp3"
+        self.catcher.dl.failed.append((HTTPError(url, 404, "Not Found", Message(), None), (url, None, None)))
+        address, authkey = share_catcher(self.catcher)
+        _waiting, _running, _finished, failed = connect_catcher(address, authkey).get_download_status()
+        self.assertEqual([("HTTP Error 404: Not Found", (url, None, None))], failed)
+
+    def test_playepisode(self):
+        app = create_app(Path(self.tmpdir.name), catcher=self.catcher)
+        client = app.test_client()
+        with app.test_request_context():
+            url = url_for("podcatcher.playepisode", cast_uid="Test cast", episode_uid="ep1")
+
+        self.assertEqual(302, client.get(url).status_code)  # not downloaded yet
+
+        path = Path(self.tmpdir.name) / "Test cast" / "ep1.mp3"
+        path.parent.mkdir()
+        path.write_bytes(b"0123456789")
+        self.catcher.episode("Test cast", "ep1")["localname"] = "ep1.mp3"
+
+        response = client.get(url, headers={"Range": "bytes=2-4"})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b"234", response.get_data())
+        self.assertEqual("audio/mpeg", response.mimetype)
+        response.close()
+
+    def test_downloadepisode_repeated(self):
+        app = create_app(Path(self.tmpdir.name), catcher=self.catcher)
+        client = app.test_client()
+        with app.test_request_context():
+            url = url_for("podcatcher.downloadepisode", cast_uid="Test cast", episode_uid="ep1")
+            invalid_url = url_for("podcatcher.downloadepisode", cast_uid="Test cast", episode_uid="ep2")
+
+        # an earlier request for the episode is still queued
+        self.catcher.journal.record(("Test cast", "ep1"), STATE_QUEUED)
+        self.assertEqual(302, client.get(url).status_code)
+        with client.session_transaction() as session:
+            self.assertEqual("warning", session["_flashes"][-1][0])
+
+        self.assertEqual(302, client.get(invalid_url).status_code)
+        with client.session_transaction() as session:
+            self.assertEqual(("error", "Invalid episode"), session["_flashes"][-1])
+
+    def test_youtube_to_feed(self):
+        app = create_app(Path(self.tmpdir.name), catcher=self.catcher)
+        app.extensions["youtube"] = YoutubeToFeed(Path(self.tmpdir.name) / "youtube.sqlite", client=StubClient(["a"]))
+        client = app.test_client()
+        url = "/youtube/rss/https://www.youtube.com/playlist?list=test"
+
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertIn(b"Video a", gzip.decompress(response.data))
+
+        response = client.get(url, headers={"If-None-Match": response.headers["ETag"], "Accept-Encoding": "gzip"})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b"", response.data)
+
+        response = client.get(url)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn(b"Video a", response.data)
+        app.extensions["youtube"].close()